@@ -0,0 +1,62 @@
+# Allocations, garbage collections and time for an arithmetic-heavy loop with
+# Integer / Float pooling (shared small Integers, free lists fed by the
+# temporaries of arithmetic chains) and with every value made fresh.
+#
+#   python benchmarks/bench_alloc.py [iterations]
+
+import os
+import gc
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+import rruntime
+
+SOURCE = """
+i = 0
+x = 0
+y = 0
+while i < %d do
+  x = i * 3 + i * 7 - 6 + 2000
+  y = x * 2.5 + i / 3 - 1.5
+  i = i + 1
+end
+puts x
+puts y
+"""
+
+def run(code):
+    out = rcomp.File(open(os.devnull, "w"))
+    consts, rlocals, rglobals = rcomp.standard_env(out, out)
+    gc.collect()
+    collections = sum(i["collections"] for i in gc.get_stats())
+    t = time.perf_counter()
+    env = rcomp.ruby_exec(code, constants=consts, rlocals_init=rlocals, rglobals=rglobals, stats=True)
+    dt = time.perf_counter() - t
+    collections = sum(i["collections"] for i in gc.get_stats()) - collections
+    return sum(env.stats()["allocations"].values()), collections, dt
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(SOURCE % n))), "<alloc>", "exec")
+
+    pooled = run(code)
+
+    integer_box, float_box, free_size = rruntime.Integer.box, rruntime.Float.box, rruntime.FREE_LIST_SIZE
+    rruntime.Integer.box = staticmethod(rruntime.Integer)
+    rruntime.Float.box = staticmethod(rruntime.Float)
+    rruntime.FREE_LIST_SIZE = 0
+    try:
+        fresh = run(code)
+    finally:
+        rruntime.Integer.box, rruntime.Float.box = staticmethod(integer_box), staticmethod(float_box)
+        rruntime.FREE_LIST_SIZE = free_size
+
+    for name, (allocations, collections, dt) in (("fresh", fresh), ("pooled", pooled)):
+        print("%-7s %9d allocations (%5.1f per iteration) %6d collections %7.3fs" % (
+            name, allocations, allocations / n, collections, dt))
+    print("pooled: %.1fx fewer allocations, %.2fx faster" % (fresh[0] / max(pooled[0], 1), fresh[2] / pooled[2]))
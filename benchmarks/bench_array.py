@@ -0,0 +1,73 @@
+# Element-wise arithmetic and reductions over a million-element Array: typed
+# storage vectorised through numpy, the same storage without numpy (plain
+# Python loops over the raw values) and a list of Integer / Float objects.
+#
+#   python benchmarks/bench_array.py [elements]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import array
+
+import rlex, rast, rcomp, rruntime
+
+PROGRAM = """
+a = Array.new(%d, 3)
+b = a * 2 + 1
+c = b / 2.0
+d = b > 5
+puts b.sum, c.max, d.size
+"""
+
+# Integer arithmetic at the int64 boundary has to come out as bignums, the same
+# as it does for Integers, rather than wrap around
+BOUNDARY = [
+    ("Array.new(3, 4611686018427387904) * 4", [2 ** 64] * 3),
+    ("Array.new(4, 4611686018427387904).sum", 2 ** 64),
+    ("Array.new(2, 9223372036854775807) + 1", [2 ** 63] * 2),
+    ("Array.new(2, 0 - 9223372036854775807) - 2", [-2 ** 63 - 1] * 2),
+]
+
+def check_boundary():
+    session = rcomp.RubySession.standard(rcomp.STDIN, rcomp.STDOUT)
+    for source, expected in BOUNDARY:
+        res = session.eval(source)
+        res = [i.int for i in res.boxed()] if isinstance(res, rcomp.Array) else res.int
+        assert res == expected, (source, res)
+
+def run(n):
+    code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(PROGRAM % n))), "<compiled ruby code>", "exec")
+    with open(os.devnull, "w") as f:
+        consts, rlocals, rglobals = rcomp.standard_env(rcomp.STDIN, rcomp.File(f))
+        t = time.perf_counter()
+        rcomp.ruby_exec(code, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
+        rcomp.flush_all_files()
+        return time.perf_counter() - t
+
+def object_storage(items):
+    # In place of rruntime._array_storage: never typed
+    if isinstance(items, array.array):
+        return [rruntime._box(i) for i in items]
+    return list(items)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    small = max(n // 100, 1)
+    numpy, storage = rruntime._load_numpy(), rruntime._array_storage
+    if numpy is None:
+        print("numpy is not installed, not measuring it")
+    else:
+        check_boundary()
+        print("numpy           %9d elements  %8.3fs" % (n, run(n)))
+    rruntime.numpy = None
+    try:
+        check_boundary()
+        print("without numpy   %9d elements  %8.3fs (extrapolated from %d)" % (n, run(small) * n / small, small))
+        rruntime._array_storage = object_storage
+        check_boundary()
+        print("object storage  %9d elements  %8.3fs (extrapolated from %d)" % (n, run(small) * n / small, small))
+    finally:
+        rruntime.numpy, rruntime._array_storage = numpy, storage
@@ -0,0 +1,88 @@
+# Memory and throughput of Array / Hash against a naive list of Integer objects.
+#
+#   python benchmarks/bench_collections.py [elements]
+
+import os
+import sys
+import time
+import tracemalloc
+import functools
+import operator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rcomp
+
+def measure(fn):
+    # (result, seconds, bytes still allocated by fn's result)
+    tracemalloc.start()
+    t = time.perf_counter()
+    res = fn()
+    dt = time.perf_counter() - t
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return res, dt, size
+
+def build_naive(values):
+    res = []
+    for v in values:
+        res.append(v)
+    return res
+
+def build_array(values):
+    res = rcomp.Array([])
+    append = res.methods["<<"]
+    for v in values:
+        append(v)
+    return res
+
+def build_hash(values):
+    res = rcomp.Hash()
+    store = res.methods["[]="]
+    for v in values:
+        store(v, v)
+    return res
+
+def read_all(get, n):
+    for i in range(n):
+        get(i)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    values = [rcomp.Integer(i) for i in range(n)]
+
+    naive, build_naive_t, naive_size = measure(lambda: build_naive(values))
+    arr, build_array_t, _ = measure(lambda: build_array(values))
+    # The naive list keeps every Integer alive, the Array only raw int64s
+    del values
+    naive_size = measure(lambda: [rcomp.Integer(i) for i in range(n)])[2]
+    array_size = measure(lambda: build_array(rcomp.Integer(i) for i in range(n)))[2]
+
+    t = time.perf_counter()
+    read_all(naive.__getitem__, n)
+    read_naive_t = time.perf_counter() - t
+    t = time.perf_counter()
+    read_all(arr.methods["[]"], n)
+    read_array_t = time.perf_counter() - t
+
+    t = time.perf_counter()
+    functools.reduce(operator.add, naive)
+    sum_naive_t = time.perf_counter() - t
+    t = time.perf_counter()
+    arr.methods["sum"]()
+    sum_array_t = time.perf_counter() - t
+
+    hsh, build_hash_t, hash_size = measure(lambda: build_hash(naive))
+    get = hsh.methods["[]"]
+    t = time.perf_counter()
+    for v in naive:
+        get(v)
+    read_hash_t = time.perf_counter() - t
+
+    print("%d elements" % n)
+    print("%-24s %12s %12s" % ("", "list[Integer]", "Array"))
+    print("%-24s %11.1fM %11.1fM" % ("memory (MiB)", naive_size / 2 ** 20, array_size / 2 ** 20))
+    print("%-24s %12.0f %12.0f" % ("append / s", n / build_naive_t, n / build_array_t))
+    print("%-24s %12.0f %12.0f" % ("index read / s", n / read_naive_t, n / read_array_t))
+    print("%-24s %12.4f %12.4f" % ("sum (s)", sum_naive_t, sum_array_t))
+    print("Hash: %.0f stores/s, %.0f lookups/s, %.1f MiB" % (n / build_hash_t, n / read_hash_t, hash_size / 2 ** 20))
@@ -0,0 +1,27 @@
+# Execution time of the call-heavy programs with the default method frames
+# against CompileOptions(lean_frames=True).
+#
+#   python benchmarks/bench_frames.py [repeat]
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rcomp
+from suite import load_programs, run_pipeline
+
+PROGRAMS = ["corpus/calls", "corpus/fib", "synthetic/medium", "synthetic/large"]
+
+def best_exec(source, options, repeat):
+    return min(run_pipeline(source, options)[0]["exec"] for _ in range(repeat))
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    lean = rcomp.CompileOptions(lean_frames=True)
+
+    programs = load_programs()
+    for name in PROGRAMS:
+        default_t = best_exec(programs[name], rcomp.DEFAULT_OPTIONS, repeat)
+        lean_t = best_exec(programs[name], lean, repeat)
+        print("%-18s default %8.2fms   lean %8.2fms  (%.2fx)" % (name, default_t * 1000, lean_t * 1000, default_t / lean_t))
@@ -0,0 +1,37 @@
+# rlex.lex against rlex.lex_parallel with 2, 4, ... processes (up to the core
+# count) on a multi-megabyte generated program. With one process lex_parallel
+# is lex, so there's nothing to measure on a single core.
+#
+#   python benchmarks/bench_lex.py [megabytes]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+from suite import synthetic_program
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+    chunk = synthetic_program(100)
+    source = chunk * max(1, int(megabytes * 1e6 / len(chunk)))
+    print("%.1f MB source, %d cores" % (len(source) / 1e6, os.cpu_count() or 1))
+
+    t = time.perf_counter()
+    toks = rlex.lex(source)
+    serial = time.perf_counter() - t
+    print("lex:                    %7.3fs" % serial)
+
+    if (os.cpu_count() or 1) < 2:
+        print("lex_parallel:           unmeasured, a pool needs more than one core")
+    processes = 2
+    while processes <= (os.cpu_count() or 1):
+        t = time.perf_counter()
+        res = rlex.lex_parallel(source, processes, min_size=0)
+        dt = time.perf_counter() - t
+        assert len(res) == len(toks) and res[-1].line == toks[-1].line
+        print("lex_parallel(%2d):       %7.3fs  (%.2fx)" % (processes, dt, serial / dt))
+        processes *= 2
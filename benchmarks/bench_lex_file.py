@@ -0,0 +1,65 @@
+# Peak memory and time of rlex.lex_file (mmap + compact token columns) against
+# reading the file and running rlex.lex on it, each in a fresh process, on a
+# generated program of the given size; then of lexing and parsing a smaller one
+# end to end, rast.parse reading the TokenStream through a cursor against
+# taking the list rlex.lex makes. Parsing is much slower than lexing (and
+# quadratic over a list, which it pops from the front), hence the smaller
+# size.
+#
+#   python benchmarks/bench_lex_file.py [megabytes] [parse megabytes]
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+from suite import synthetic_program
+
+def measure(how, path):
+    # Runs in the child: lexes path and reports tokens, seconds, peak RSS
+    t = time.perf_counter()
+    if how.startswith("lex_file"):
+        toks = rlex.lex_file(path)
+    else:
+        with open(path, encoding="utf-8") as f:
+            toks = rlex.lex(f.read())
+    n = len(toks)
+    if how.endswith("+parse"):
+        rast.parse(toks)
+    dt = time.perf_counter() - t
+    print(n, dt, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+def run(how, path):
+    out = subprocess.run([sys.executable, __file__, "--child", how, path], capture_output=True, text=True, check=True).stdout
+    n, dt, rss = out.split()
+    return int(n), float(dt), int(rss)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        measure(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    parse_megabytes = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    chunk = synthetic_program(100).encode()
+    _, _, baseline = run("lex_file", os.devnull)
+    for size, hows in ((megabytes, ("lex", "lex_file")), (parse_megabytes, ("lex+parse", "lex_file+parse"))):
+        with tempfile.NamedTemporaryFile(suffix=".rb", delete=False) as f:
+            for _ in range(max(1, int(size * 1e6 / len(chunk)))):
+                f.write(chunk)
+        try:
+            size = os.path.getsize(f.name)
+            print("%.1f MB source, interpreter alone %.1f MB" % (size / 1e6, baseline / 1e6))
+            for how in hows:
+                n, dt, rss = run(how, f.name)
+                print("%-15s %9d tokens %8.3fs  peak RSS %8.1f MB (%.2fx the file)" % (
+                    how, n, dt, rss / 1e6, (rss - baseline) / size))
+        finally:
+            os.unlink(f.name)
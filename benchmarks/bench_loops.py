@@ -0,0 +1,61 @@
+# Counting / accumulation while loops: generic code vs specialize_loops vs the
+# same loop written in plain Python.
+#
+#   python benchmarks/bench_loops.py [iterations]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex, rast, rcomp
+
+PROGRAMS = {
+    "count": ("""
+x = 0
+while x < %(n)d do
+    x = x + 1
+end
+""", """
+x = 0
+while x < %(n)d:
+    x = x + 1
+"""),
+    "accumulate": ("""
+x = 0
+total = 0.0
+while x < %(n)d do
+    total = total + x * 0.5
+    x = x + 1
+end
+""", """
+x = 0
+total = 0.0
+while x < %(n)d:
+    total = total + x * 0.5
+    x = x + 1
+"""),
+}
+
+def run_ruby(src, options):
+    code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(src)), options=options), "<compiled ruby code>", "exec")
+    t = time.perf_counter()
+    rcomp.ruby_exec(code)
+    return time.perf_counter() - t
+
+def run_python(src):
+    code = compile(src, "<python>", "exec")
+    t = time.perf_counter()
+    exec(code, {})
+    return time.perf_counter() - t
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for name, (rsrc, psrc) in PROGRAMS.items():
+        generic = run_ruby(rsrc % {"n": n // 10}, rcomp.DEFAULT_OPTIONS) * 10
+        specialized = run_ruby(rsrc % {"n": n}, rcomp.CompileOptions(specialize_loops=True))
+        native = run_python(psrc % {"n": n})
+        print("%-11s %9d iterations  generic %8.3fs (extrapolated)  specialized %7.4fs  python %7.4fs" % (
+            name, n, generic, specialized, native
+        ))
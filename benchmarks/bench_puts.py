@@ -0,0 +1,47 @@
+# Prints a million lines through File.puts, unbuffered vs buffered.
+#
+#   python benchmarks/bench_puts.py [lines]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex, rast, rcomp
+
+RUBY_LOOP = """
+x = 0
+while x < %d do
+    puts x, 'line', 1.5
+    x = x + 1
+end
+"""
+
+def bench_method(lines, buffer_size):
+    with open(os.devnull, "w") as f:
+        out = rcomp.File(f, buffer_size)
+        puts = out.methods["puts"]
+        args = (rcomp.Integer(42), rcomp.String("line"), rcomp.Float(1.5))
+        t = time.perf_counter()
+        for _ in range(lines):
+            puts(*args)
+        out.flush()
+        return time.perf_counter() - t
+
+def bench_program(lines, buffer_size):
+    with open(os.devnull, "w") as f:
+        out = rcomp.File(f, buffer_size)
+        consts, rlocals, rglobals = rcomp.standard_env(rcomp.STDIN, out)
+        code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(RUBY_LOOP % lines))), "<compiled ruby code>", "exec")
+        t = time.perf_counter()
+        rcomp.ruby_exec(code, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
+        out.flush()
+        return time.perf_counter() - t
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    for name, fn, n in [("File.puts", bench_method, lines), ("ruby while/puts", bench_program, lines // 10)]:
+        for buffer_size in (0, rcomp.File.BUFFER_SIZE):
+            dt = fn(n, buffer_size)
+            print("%-16s buffer_size=%-6d %8d lines  %7.3fs  %10.0f lines/s" % (name, buffer_size, n, dt, n / dt))
@@ -0,0 +1,76 @@
+# A counting while loop against Range#each with a block, and the peak memory of
+# a lazy pipeline over a huge Range against the same pipeline made eager.
+#
+# Only the memory comparison runs under tracemalloc, which slows Python code
+# down several times over, on a smaller eager pipeline than the loops'.
+#
+#   python benchmarks/bench_ranges.py [iterations] [eager elements]
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+
+WHILE_LOOP = """
+total = 0
+i = 0
+while i < %d do
+  total = total + i
+  i = i + 1
+end
+"""
+
+RANGE_EACH = """
+total = 0
+(0...%d).each do |i|
+  total = total + i
+end
+"""
+
+LAZY = """
+r = (1..%d).lazy.map { |x| x * 3 }.select { |x| x > 10 }.first(5)
+"""
+
+EAGER = """
+r = (1..%d).map { |x| x * 3 }.select { |x| x > 10 }.first(5)
+"""
+
+def compiled(source):
+    # With loop specialisation off, so both loops go through the generic
+    # Integer path
+    options = rcomp.CompileOptions(specialize_loops=False)
+    return rcomp.ruby_aspython(rast.parse(rlex.lex(source)), options=options)
+
+def timed(source):
+    code = compiled(source)
+    t = time.perf_counter()
+    rcomp.ruby_exec(code)
+    return time.perf_counter() - t
+
+def peak(source):
+    # Peak bytes allocated running source
+    code = compiled(source)
+    tracemalloc.start()
+    try:
+        rcomp.ruby_exec(code)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    while_t = timed(WHILE_LOOP % n)
+    each_t = timed(RANGE_EACH % n)
+    print("while loop:    %8.3fs" % while_t)
+    print("Range#each:    %8.3fs  (%.2fx)" % (each_t, while_t / each_t))
+
+    print("lazy  over %9d: peak %8.1f KiB" % (m * 1000, peak(LAZY % (m * 1000)) / 1024))
+    print("eager over %9d: peak %8.1f KiB" % (m, peak(EAGER % m) / 1024))
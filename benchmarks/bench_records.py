@@ -0,0 +1,48 @@
+# Records per second evaluating a per-record rule: a fresh ruby_exec per record
+# (the old way) against RubySession.run_records, for an arithmetic rule (run
+# column-wise) and one calling a method (run record by record).
+#
+#   python benchmarks/bench_records.py [records]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+import rruntime
+
+PRELUDE = "Rate = 3\ndef bonus(x)\n  x * Rate\nend\n"
+RULES = [
+    ("arithmetic", "price * qty + 5 - price / qty"),
+    ("method call", "bonus(price) + qty"),
+]
+
+def per_exec(source, records):
+    code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(PRELUDE + source))), "<rule>", "exec")
+    for r in records:
+        env = rcomp.ruby_exec(code, rlocals_init={k: rruntime._variable(rcomp.Integer(v)) for k, v in r.items()})
+        yield env[1]["result"]
+
+def rate(results, n):
+    t = time.perf_counter()
+    for _ in results:
+        pass
+    return n / (time.perf_counter() - t)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    random.seed(1)
+    records = [{"price": random.randint(1, 100), "qty": random.randint(1, 9)} for _ in range(n)]
+    slow = records[:min(n, 5000)]
+
+    session = rcomp.RubySession()
+    session.eval(PRELUDE)
+    for name, source in RULES:
+        old = rate(per_exec(source, slow), len(slow))
+        new = rate(session.run_records(source, records), n)
+        print("%-12s ruby_exec %9.0f records/s  run_records %9.0f records/s  (%.0fx)" % (name, old, new, new / old))
@@ -0,0 +1,76 @@
+# Deep recursion with CompileOptions(trampoline=True): a non-tail recursive
+# method (one frame per level) and a tail recursive one (tail calls reuse the
+# frame), with the default frames and with lean_frames. Each case runs in its
+# own process; memory is the growth of peak RSS divided by the depth.
+#
+#   python benchmarks/bench_recursion.py [depth]
+
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+
+PROGRAMS = {
+    "non-tail": """
+def depth(n)
+  if n < 1 then
+    n
+  else
+    a = depth(n - 1)
+    a + 1
+  end
+end
+result = depth(%d)
+""",
+    "tail": """
+def count(n, acc)
+  if n < 1 then
+    acc
+  else
+    count(n - 1, acc + 1)
+  end
+end
+result = count(%d, 0)
+""",
+}
+
+MODES = {
+    "default": {},
+    "trampoline": {"trampoline": True},
+    "trampoline+lean": {"trampoline": True, "lean_frames": True},
+}
+
+def run_case(program, mode, depth):
+    code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(PROGRAMS[program] % depth)),
+        options=rcomp.CompileOptions(**MODES[mode])), "<recursion>", "exec")
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = time.perf_counter()
+    try:
+        env = rcomp.ruby_exec(code)
+    except RecursionError:
+        print("RecursionError")
+        return
+    dt = time.perf_counter() - t
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) * 1024
+    assert env[0]["rlocals"]["result"]().int == depth
+    print("%.2fs %.0f bytes/frame" % (dt, grown / depth))
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--case":
+        run_case(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit(0)
+
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("depth %d" % depth)
+    for program in PROGRAMS:
+        for mode in MODES:
+            res = subprocess.run([sys.executable, __file__, "--case", program, mode, str(depth)],
+                capture_output=True, text=True)
+            print("%-9s %-16s %s" % (program, mode, (res.stdout or res.stderr.strip().split("\n")[-1]).strip()))
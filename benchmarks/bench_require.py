@@ -0,0 +1,48 @@
+# Running many small scripts that share a large library of methods: pasting the
+# library into every script (compiled each time) against require, which
+# compiles it once per process and reruns the cached code in each script's
+# environment.
+#
+#   python benchmarks/bench_require.py [methods] [scripts]
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+from suite import SYNTHETIC_DEF
+
+SCRIPT = "x = f%d(3, 4)\n"
+
+def run(source):
+    code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(source))), "<script>", "exec")
+    rcomp.ruby_exec(code)
+
+def timed(fn, scripts):
+    t = time.perf_counter()
+    for i in range(scripts):
+        fn(i)
+    return (time.perf_counter() - t) / scripts
+
+if __name__ == "__main__":
+    methods = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    scripts = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    library = "".join(SYNTHETIC_DEF % {"i": i} for i in range(methods))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "library.rb")
+        with open(path, "w") as f:
+            f.write(library)
+
+        pasted = timed(lambda i: run(library + SCRIPT % (i % methods)), scripts)
+        required = timed(lambda i: run('require "%s"\n' % path + SCRIPT % (i % methods)), scripts)
+        loader = rcomp.MODULE_LOADER
+        print("%d methods, %d scripts" % (methods, scripts))
+        print("pasted    %8.2fms/script" % (pasted * 1000))
+        print("require   %8.2fms/script  (%.1fx), %d compile(s), %d cache hits" % (
+            required * 1000, pasted / required, loader.compiles, loader.hits))
@@ -0,0 +1,52 @@
+# rserial.loads against re-running lex + parse and pickle, on a large generated
+# program: time and size, plus a lazy load that only decodes one method body.
+#
+#   python benchmarks/bench_serial.py [functions]
+
+import os
+import gc
+import sys
+import time
+import pickle
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rserial
+from suite import synthetic_program
+
+def timed(fn):
+    gc.collect()
+    t = time.perf_counter()
+    res = fn()
+    return res, time.perf_counter() - t
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    source = synthetic_program(n)
+
+    tree, parse_t = timed(lambda: rast.parse(rlex.lex(source)))
+    data, dump_t = timed(lambda: rserial.dumps(tree))
+    loaded, load_t = timed(lambda: rserial.loads(data))
+    assert repr(loaded) == repr(tree)
+    pickled = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+    _, unpickle_t = timed(lambda: pickle.loads(pickled))
+
+    print("source        %9d bytes" % len(source))
+    print("lex + parse                     %8.3fs" % parse_t)
+    print("rserial       %9d bytes  %8.3fs load (%.1fx faster), %.3fs dump" % (len(data), load_t, parse_t / load_t, dump_t))
+    print("pickle        %9d bytes  %8.3fs load" % (len(pickled), unpickle_t))
+
+    with tempfile.NamedTemporaryFile(suffix=".rast", delete=False) as f:
+        f.write(data)
+    try:
+        with open(f.name, "rb") as file:
+            lazy, lazy_t = timed(lambda: rserial.load(file, lazy=True))
+            define = next(i for i in lazy.children[1:] if isinstance(i, rast.Define))
+            _, body_t = timed(lambda: define.children[1].children)
+            print("lazy mmap load                  %8.3fs, first body %.6fs" % (lazy_t, body_t))
+            del lazy, define
+    finally:
+        os.unlink(f.name)
@@ -0,0 +1,49 @@
+# Cost of evaluating one REPL line as a session grows: RubySession against the
+# old way of building a fresh environment per line and copying it back.
+#
+#   python benchmarks/bench_session.py [definitions]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+
+LINE = compile(rcomp.ruby_aspython(rast.parse(rlex.lex("y = 1 + 2\n"))), "<line>", "exec")
+
+def define(n):
+    # n variables and n methods
+    src = "".join("v%d = %d\n" % (i, i) for i in range(n))
+    src += "".join("def m%d(a)\n  a\nend\n" % i for i in range(n))
+    return compile(rcomp.ruby_aspython(rast.parse(rlex.lex(src))), "<defs>", "exec")
+
+def per_line(fn, repeat=200):
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat
+
+def copying(consts, rlocals, rglobals):
+    env = rcomp.ruby_exec(LINE, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
+    consts.update(env[0]["rconsts"].v)
+    rglobals.update(env[0]["rglobals"].v)
+    rlocals.update(env[0]["rlocals"].stack[-1])
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    out = rcomp.File(open(os.devnull, "w"))
+
+    for size in (0, n):
+        session = rcomp.RubySession.standard(out, out)
+        consts, rlocals, rglobals = rcomp.standard_env(out, out)
+        if size:
+            session.run(define(size))
+            env = rcomp.ruby_exec(define(size), constants=consts, rlocals_init=rlocals, rglobals=rglobals)
+            rlocals.update(env[0]["rlocals"].stack[-1])
+        print("%6d definitions: session %8.1fus/line, copying %8.1fus/line" % (
+            size, per_line(lambda: session.run(LINE)) * 1e6, per_line(lambda: copying(consts, rlocals, rglobals)) * 1e6))
+    rcomp.flush_all_files()
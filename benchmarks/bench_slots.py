@@ -0,0 +1,39 @@
+# Global and constant reads as compiled (slot-indexed) against name-based
+# access through Globals / Constants, the way they used to compile.
+#
+#   python benchmarks/bench_slots.py [reads]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+
+SOURCE = """
+$total = 1
+Limit = 2
+x = $total
+y = Limit
+"""
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    code = rcomp.ruby_aspython(rast.parse(rlex.lex(SOURCE)))
+    eglobals, _ = rcomp.ruby_exec(code)
+    global_read = code.split("\n")[3].split("](", 1)[1][:-1]
+    const_read = code.split("\n")[4].split("](", 1)[1][:-1]
+
+    cases = [
+        ("global", global_read, "rglobals['total']"),
+        ("constant", const_read, "rconsts['Limit']"),
+    ]
+    for name, slot_expr, name_expr in cases:
+        slot_t = timeit.timeit(slot_expr, globals=eglobals, number=n)
+        name_t = timeit.timeit(name_expr, globals=eglobals, number=n)
+        print("%-8s slot %6.1fns  name %6.1fns  (%.2fx)   %s" % (
+            name, slot_t / n * 1e9, name_t / n * 1e9, name_t / slot_t, slot_expr))
@@ -0,0 +1,54 @@
+# Warming a session up by running a prelude of method definitions and
+# constants, against restoring an rsnapshot of a session that ran it: from the
+# snapshot's code objects, and from its ASTs (what a process whose slot layouts
+# differ gets).
+#
+#   python benchmarks/bench_snapshot.py [methods]
+
+import os
+import gc
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rcomp
+import rsnapshot
+from suite import SYNTHETIC_DEF
+
+def prelude(n):
+    src = "".join(SYNTHETIC_DEF % {"i": i} for i in range(n))
+    src += "".join("Limit%d = %d\n" % (i, i) for i in range(n))
+    return src
+
+def timed(fn):
+    gc.collect()
+    t = time.perf_counter()
+    res = fn()
+    return res, time.perf_counter() - t
+
+def restore(data):
+    session = rcomp.RubySession()
+    rsnapshot.loads(data, session)
+    return session
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    source = prelude(n)
+    check = "f%d(3, 4)" % (n - 1)
+
+    _, run_t = timed(lambda: rcomp.RubySession().eval(source))
+    session = rcomp.RubySession()
+    session.eval(source)
+    data, dump_t = timed(lambda: rsnapshot.dumps(session))
+    restored, load_t = timed(lambda: restore(data))
+    assert restored.eval(check).int == session.eval(check).int
+
+    # Without usable code objects every method is recompiled from its AST
+    stale = data.replace(rsnapshot.importlib.util.MAGIC_NUMBER, b"\0\0\r\n", 1)
+    recompiled, ast_t = timed(lambda: restore(stale))
+    assert recompiled.eval(check).int == session.eval(check).int
+
+    print("prelude        %9d bytes  %8.3fs to run" % (len(source), run_t))
+    print("snapshot       %9d bytes  %8.3fs load (%.1fx faster), %.3fs dump" % (len(data), load_t, run_t / load_t, dump_t))
+    print("from ASTs                        %8.3fs load (%.1fx faster)" % (ast_t, run_t / ast_t))
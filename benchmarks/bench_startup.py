@@ -0,0 +1,59 @@
+# Process startup plus run time of each corpus program and of a large
+# generated one (mostly definitions, so compile-bound): the full pipeline
+# (import rcomp, lex, parse, compile, run) against a raot-compiled module whose
+# .pyc is already cached. "python" is the interpreter starting and exiting.
+#
+#   python benchmarks/bench_startup.py [repeat]
+
+import os
+import sys
+import time
+import tempfile
+import py_compile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import raot
+from suite import synthetic_program
+
+CORPUS_DIR = os.path.join(ROOT, "benchmarks", "corpus")
+
+PIPELINE = """
+import sys, rlex, rast, rcomp
+code = compile(rcomp.ruby_aspython(rast.parse(rlex.lex(open(sys.argv[1]).read()))), sys.argv[1], "exec")
+consts, rlocals, rglobals = rcomp.standard_env(rcomp.STDIN, rcomp.STDOUT)
+rcomp.ruby_exec(code, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
+rcomp.flush_all_files()
+"""
+
+def best(args, env, repeat):
+    res = None
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            t = time.perf_counter()
+            subprocess.run(args, env=env, stdout=devnull, stdin=subprocess.DEVNULL, check=True)
+            dt = time.perf_counter() - t
+            res = dt if res is None else min(res, dt)
+    return res
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp, ROOT]))
+        # Byte-compile the runtime the same way importing it would
+        py_compile.compile(os.path.join(ROOT, "rruntime.py"))
+        print("python              %8.1fms" % (best([sys.executable, "-c", "pass"], env, repeat) * 1000))
+        programs = [os.path.join(CORPUS_DIR, i) for i in sorted(os.listdir(CORPUS_DIR)) if i.endswith(".rb")]
+        programs.append(os.path.join(tmp, "synthetic.rb"))
+        with open(programs[-1], "w") as f:
+            f.write(synthetic_program(400))
+        for path in programs:
+            name = os.path.basename(path)
+            module = "aot_" + name[:-3]
+            py_compile.compile(raot.compile_file(path, os.path.join(tmp, module + ".py")))
+            pipeline = best([sys.executable, "-c", PIPELINE, path], env, repeat)
+            aot = best([sys.executable, "-c", "import %s; %s.main()" % (module, module)], env, repeat)
+            print("%-12s pipeline %8.1fms   aot %8.1fms  (%.2fx)" % (name[:-3], pipeline * 1000, aot * 1000, pipeline / aot))
@@ -0,0 +1,59 @@
+# String building: a Ruby loop appending with << and with s = s + piece at
+# doubling sizes (time per piece should stay flat), and a report-sized string
+# built directly through String#<<.
+#
+#   python benchmarks/bench_strings.py [megabytes]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+
+APPEND = """
+s = ''
+i = 0
+while i < %d do
+  s << "line #{i}, "
+  i = i + 1
+end
+n = s.size
+"""
+
+PLUS = """
+s = ''
+i = 0
+while i < %d do
+  s = s + "line #{i}, "
+  i = i + 1
+end
+n = s.size
+"""
+
+def run(source):
+    code = rcomp.ruby_aspython(rast.parse(rlex.lex(source)))
+    t = time.perf_counter()
+    rcomp.ruby_exec(code)
+    return time.perf_counter() - t
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    for name, source in (("<<", APPEND), ("+", PLUS)):
+        for n in (10000, 20000, 40000):
+            dt = run(source % n)
+            print("s %-2s %6d pieces: %7.3fs  %6.2fus/piece" % (name, n, dt, dt / n * 1e6))
+
+    piece = rcomp.String("x" * 99 + "\n")
+    s = rcomp.String("")
+    append = s.methods["<<"]
+    t = time.perf_counter()
+    for _ in range(megabytes * 10000):
+        append(piece)
+    text = s.s
+    dt = time.perf_counter() - t
+    print("%d MB with <<: %.3fs" % (len(text) // 1000000, dt))
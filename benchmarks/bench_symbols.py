@@ -0,0 +1,71 @@
+# Dispatch-heavy Ruby code keyed by symbols against the same code keyed by
+# strings: send(:name) / send('name') and Hash lookups h[:k] / h['k'].
+#
+#   python benchmarks/bench_symbols.py [iterations]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex
+import rast
+import rcomp
+
+SEND = """
+a = [1, 2, 3]
+i = 0
+while i < %d do
+  a.send(%s)
+  a.send(%s)
+  a.send(%s)
+  i = i + 1
+end
+"""
+
+HASH = """
+h = Hash.new
+h[%s] = 1
+h[%s] = 2
+i = 0
+while i < %d do
+  x = h[%s]
+  y = h[%s]
+  i = i + 1
+end
+"""
+
+def run(source):
+    code = rcomp.ruby_aspython(rast.parse(rlex.lex(source)))
+    t = time.perf_counter()
+    rcomp.ruby_exec(code, constants={"Hash": rcomp.HASH_CLASS})
+    return time.perf_counter() - t
+
+def lookup(key, n):
+    # Raw Methods lookups, as a compiled .methods[...] or send does them
+    methods = rcomp.Array([1, 2, 3]).methods
+    t = time.perf_counter()
+    for _ in range(n):
+        methods[key]
+    return time.perf_counter() - t
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    cases = [
+        ("send", SEND % (n, ":size", ":first", ":last"), SEND % (n, "'size'", "'first'", "'last'")),
+        ("hash", HASH % (":a", ":b", n, ":a", ":b"), HASH % ("'a'", "'b'", n, "'a'", "'b'")),
+    ]
+    for name, sym_src, str_src in cases:
+        sym_t = run(sym_src)
+        str_t = run(str_src)
+        print("%-6s symbols %8.3fs  strings %8.3fs  (%.2fx)" % (name, sym_t, str_t, str_t / sym_t))
+
+    # An equal but separately built str has to be compared character by
+    # character against the table's key; a symbol's interned name is the key
+    interned = rcomp.Symbol.intern("first").name
+    copied = "".join(["fir", "st"])
+    sym_t = lookup(interned, n * 20)
+    str_t = lookup(copied, n * 20)
+    print("%-6s symbols %8.3fs  strings %8.3fs  (%.2fx)" % ("lookup", sym_t, str_t, str_t / sym_t))
@@ -0,0 +1,13 @@
+x = 0
+total = 0
+while x < 2000 do
+    total = total + x * 3 - 7
+    x = x + 1
+end
+puts 'total', total
+
+y = 0.5
+while y < 500.0 do
+    y = y * 1.5 + 0.25
+end
+puts y
@@ -0,0 +1,16 @@
+def mul(a, b, c)
+    a * b * c
+end
+
+def add(a, b)
+    a + b
+end
+
+i = 0
+acc = 0
+while i < 500 do
+    acc = add(acc, mul(i, 2, 3))
+    acc = add(acc, mul(2, (mul 1, i, 1), 1))
+    i = i + 1
+end
+STDOUT.puts acc
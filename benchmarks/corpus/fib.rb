@@ -0,0 +1,11 @@
+def fib(n)
+    if n < 2 then
+        n
+    else
+        a = fib(n - 1)
+        b = fib(n - 2)
+        a + b
+    end
+end
+
+puts fib(15)
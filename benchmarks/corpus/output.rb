@@ -0,0 +1,11 @@
+name = 'gwitr'
+i = 0
+while i < 1000 do
+    if name == 'gwitr' then
+        $stdout.puts 'line', i, 2.5
+    else
+        puts 'never'
+    end
+    i = i + 1
+end
+$stdout.flush
@@ -0,0 +1,212 @@
+# Pipeline benchmarks: times rlex.lex, rast.parse, ruby_aspython, compile and
+# execution separately over benchmarks/corpus/*.rb and synthetic programs.
+#
+#   python benchmarks/suite.py [-o results.json] [--compare baseline.json] [--threshold 0.1] [--budgets]
+#
+# Timings are the best of --repeat runs; peak memory is measured in a separate
+# run under tracemalloc so it doesn't skew the timings. With --compare, any
+# stage slower than the baseline by more than the threshold is reported and the
+# exit status is 1. Differences under --min-delta ms are treated as noise.
+# --budgets compiles with budget checks and runs under an unlimited RubyBudget,
+# to measure their overhead against a baseline run without.
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rlex, rast, rcomp
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+SYNTHETIC_SIZES = {"small": 10, "medium": 100, "large": 400}
+STAGES = ["lex", "parse", "aspython", "compile", "exec"]
+
+SYNTHETIC_DEF = """
+def f%(i)d(a, b)
+    c = a * b + %(i)d
+    if c > 100 then
+        c - a
+    else
+        c + b
+    end
+end
+"""
+
+def synthetic_program(n):
+    # n method definitions followed by a loop calling each of them
+    src = "".join(SYNTHETIC_DEF % {"i": i} for i in range(n))
+    src += "\ni = 0\nx = 0\nwhile i < 3 do\n"
+    src += "".join("    x = f%d(i, %d)\n" % (i, i % 7) for i in range(n))
+    src += "    i = i + 1\nend\nputs x\n"
+    return src
+
+def load_programs():
+    programs = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".rb"):
+            with open(os.path.join(CORPUS_DIR, name)) as f:
+                programs["corpus/" + name[:-3]] = f.read()
+    for name, n in SYNTHETIC_SIZES.items():
+        programs["synthetic/" + name] = synthetic_program(n)
+    return programs
+
+def new_budget(options):
+    return rcomp.RubyBudget() if options.budgets else None
+
+def run_pipeline(source, options=rcomp.DEFAULT_OPTIONS):
+    # Returns ({stage: seconds}, {stage: output size})
+    times = {}
+    sizes = {}
+
+    t = time.perf_counter()
+    toks = rlex.lex(source)
+    times["lex"] = time.perf_counter() - t
+    sizes["lex"] = len(source)
+
+    t = time.perf_counter()
+    ast = rast.parse(toks)
+    times["parse"] = time.perf_counter() - t
+    sizes["parse"] = len(toks)
+
+    t = time.perf_counter()
+    pcode = rcomp.ruby_aspython(ast, options=options)
+    times["aspython"] = time.perf_counter() - t
+    sizes["aspython"] = len(ast.children) - 1
+
+    t = time.perf_counter()
+    code = compile(pcode, "<compiled ruby code>", "exec")
+    times["compile"] = time.perf_counter() - t
+    sizes["compile"] = len(pcode)
+
+    with open(os.devnull, "w") as f:
+        out = rcomp.File(f)
+        consts, rlocals, rglobals = rcomp.standard_env(rcomp.STDIN, out)
+        t = time.perf_counter()
+        rcomp.ruby_exec(code, constants=consts, rlocals_init=rlocals, rglobals=rglobals, budget=new_budget(options))
+        out.flush()
+        times["exec"] = time.perf_counter() - t
+    sizes["exec"] = source.count("\n") + 1
+
+    return times, sizes
+
+def peak_memory(source, options=rcomp.DEFAULT_OPTIONS):
+    # Peak traced allocation per stage, in bytes
+    peaks = {}
+    tracemalloc.start()
+    try:
+        stages = [
+            ("lex", lambda _: rlex.lex(source)),
+            ("parse", rast.parse),
+            ("aspython", lambda ast: rcomp.ruby_aspython(ast, options=options)),
+            ("compile", lambda pcode: compile(pcode, "<compiled ruby code>", "exec")),
+        ]
+        v = None
+        for stage, fn in stages:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            v = fn(v)
+            peaks[stage] = tracemalloc.get_traced_memory()[1] - base
+
+        with open(os.devnull, "w") as f:
+            out = rcomp.File(f)
+            consts, rlocals, rglobals = rcomp.standard_env(rcomp.STDIN, out)
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            rcomp.ruby_exec(v, constants=consts, rlocals_init=rlocals, rglobals=rglobals, budget=new_budget(options))
+            out.flush()
+            peaks["exec"] = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def bench_program(source, repeat, options=rcomp.DEFAULT_OPTIONS):
+    best = None
+    for _ in range(repeat):
+        times, sizes = run_pipeline(source, options)
+        if best is None:
+            best = times
+        else:
+            best = {k: min(best[k], times[k]) for k in best}
+    peaks = peak_memory(source, options)
+    return {
+        stage: {
+            "seconds": best[stage],
+            "throughput": sizes[stage] / best[stage] if best[stage] > 0 else None,
+            "peak_bytes": peaks[stage]
+        } for stage in STAGES
+    }
+
+# Throughput units, by stage
+UNITS = {"lex": "chars/s", "parse": "tokens/s", "aspython": "stmts/s", "compile": "chars/s", "exec": "lines/s"}
+
+def run_suite(repeat=3, only=None, options=rcomp.DEFAULT_OPTIONS):
+    results = {}
+    for name, source in load_programs().items():
+        if only is not None and only not in name:
+            continue
+        results[name] = bench_program(source, repeat, options)
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": repeat,
+        "units": UNITS,
+        "results": results
+    }
+
+def compare(baseline, current, threshold, min_delta=0.001):
+    # Yields (program, stage, old seconds, new seconds) for every regression
+    for name, stages in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for stage, v in stages.items():
+            old = baseline["results"][name].get(stage)
+            if old is None:
+                continue
+            if v["seconds"] > old["seconds"] * (1 + threshold) and v["seconds"] - old["seconds"] > min_delta:
+                yield name, stage, old["seconds"], v["seconds"]
+
+def format_results(data):
+    res = "%-22s %-9s %10s %16s %12s\n" % ("program", "stage", "ms", "throughput", "peak KiB")
+    for name, stages in data["results"].items():
+        for stage, v in stages.items():
+            res += "%-22s %-9s %10.2f %9.0f %-8s %10.1f\n" % (
+                name, stage, v["seconds"] * 1000, v["throughput"] or 0, UNITS[stage], v["peak_bytes"] / 1024
+            )
+    return res
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the lex/parse/compile/execute pipeline")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, as a fraction (default 0.10)")
+    parser.add_argument("--min-delta", type=float, default=1.0, help="ignore differences below this many ms (default 1.0)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="only run programs whose name contains this string")
+    parser.add_argument("--budgets", action="store_true", help="compile with budget checks and run under an unlimited budget")
+    args = parser.parse_args(argv)
+
+    options = rcomp.CompileOptions(budgets=True) if args.budgets else rcomp.DEFAULT_OPTIONS
+    data = run_suite(args.repeat, args.only, options)
+    print(format_results(data), end="")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = list(compare(baseline, data, args.threshold, args.min_delta / 1000))
+        for name, stage, old, new in regressions:
+            print("REGRESSION %s %s: %.2fms -> %.2fms (%+.1f%%)" % (name, stage, old * 1000, new * 1000, (new / old - 1) * 100))
+        if len(regressions) > 0:
+            return 1
+        print("No regressions beyond %.0f%%" % (args.threshold * 100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# Ahead-of-time compiler: turns a Ruby program into a Python module that only
+# imports rruntime, so running it skips rlex / rast / rcomp altogether and
+# starts as fast as any other module with a cached .pyc.
+#
+#   python raot.py program.rb [-o program.py]
+#
+# The module's main(stdin=None, stdout=None) runs the program (on the real
+# stdin / stdout by default) and returns the value of its last statement;
+# running the module as a script calls it. Global and constant slots are
+# looked up by name when the module is imported (CompileOptions(named_slots)),
+# since the compiling process's slot layouts mean nothing to the one running it.
+
+import os
+import re
+import sys
+import argparse
+
+import rlex, rast, rcomp
+
+OPTIONS = rcomp.CompileOptions(named_slots=True)
+
+SLOT_NAME_RE = re.compile(r"\b(rgslot|rcslot)_(\w+)")
+
+MODULE_TEMPLATE = '''\
+# Compiled from %(source)s by raot; don't edit, recompile.
+
+import rruntime
+
+%(slots)s
+def ruby_main():
+    %(code)s
+    return result
+
+def main(stdin=None, stdout=None):
+    globals().update(rruntime.module_globals(stdin, stdout))
+    try:
+        return ruby_main()
+    finally:
+        rruntime.flush_all_files()
+
+if __name__ == "__main__":
+    main()
+'''
+
+def compile_source(source, filename="<ruby>"):
+    # The Python source of a module running the Ruby program source
+    code = rcomp.ruby_aspython(rast.parse(rlex.lex(source)), options=OPTIONS)
+    slots = ""
+    seen = set()
+    for m in SLOT_NAME_RE.finditer(code):
+        if m.group(0) not in seen:
+            seen.add(m.group(0))
+            layout = "GLOBAL_SLOTS" if m.group(1) == "rgslot" else "CONSTANT_SLOTS"
+            slots += "%s = rruntime.%s.slot(%r)\n" % (m.group(0), layout, m.group(2))
+    res = MODULE_TEMPLATE % {
+        "source": os.path.basename(filename),
+        "slots": slots,
+        "code": code.rstrip().replace("\n", "\n    "),
+    }
+    # Fails here rather than on import if the generated code is broken
+    compile(res, filename, "exec")
+    return res
+
+def compile_file(path, output=None):
+    # Writes the module for the program at path to output (default: the same
+    # name with .py); returns output
+    if output is None:
+        output = os.path.splitext(path)[0] + ".py"
+    with open(path) as f:
+        source = f.read()
+    res = compile_source(source, path)
+    with open(output, "w") as f:
+        f.write(res)
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a Ruby program into an importable Python module")
+    parser.add_argument("source", help="the .rb file")
+    parser.add_argument("-o", "--output", help="the module to write (default: source with a .py extension)")
+    args = parser.parse_args(argv)
+    compile_file(args.source, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
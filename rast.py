@@ -65,6 +65,16 @@ class Symbol(Node):
     token: rlex.Symbol
     children: None = None
 
+@dataclass(init=False)
+class Interpolation(Node):
+    # Children: Literal strings and the interpolated expressions, in order
+    token: rlex.Interpolation
+
+@dataclass(init=False)
+class ArrayLiteral(Node):
+    # Children: The elements
+    token: rlex.Operator    # The opening [
+
 @dataclass(init=False)
 class NameSequence(Node):
     token: None = None
@@ -73,6 +83,7 @@ class NameSequence(Node):
 class Block(Node):
     # 1st child: NameSequence
     # All next children: The instructions inside of the block
+    # token: The do / { opening a block passed to a call, None otherwise
     token: None = None
 
 @dataclass(init=False)
@@ -97,6 +108,18 @@ class Define(Node):
     token: None = None
     children: List[rast.Node]
 
+def first_line(node):
+    # Line of the first token under node that carries a real position, or None
+    if node is None:
+        return None
+    if node.token is not None and node.token.line > 0:
+        return node.token.line
+    for i in node.children or []:
+        line = first_line(i)
+        if line is not None:
+            return line
+    return None
+
 # Pain
 
 if AST_DEBUG:
@@ -158,6 +181,11 @@ class ElseSignal(Exception):
 
 @dbg
 def parse(toks):
+    # toks: A list of tokens, or an rlex.TokenStream, which is read through a
+    # cursor making each token as it's reached. The AST is still built whole,
+    # so the tokens it keeps (names, literals) stay alive with it.
+    if isinstance(toks, rlex.TokenStream):
+        return _tok2ast(toks.cursor())
     return _tok2ast(toks.copy())
 
 @dbg    
@@ -174,7 +202,7 @@ def _tok2ast(t):
                 raise ElseSignal(Block(children=[NameSequence(children=[]), *exprs]))
 
         elif isinstance(t[0], rlex.Operator):
-            if t[0].value == ")":
+            if t[0].value in {")", "}"}:
                 t.pop(0)
                 break
         
@@ -203,7 +231,7 @@ def expr2ast(toks, exprs, ignore_sy_operator=False):
             elif ntok.value == ".":
                 l = dot(tok, toks)
                 res = Global(token=tok)
-                for i in l[:0:-1]:
+                for i in l[1:]:
                     res = Call(children=[res, i])
                 res.children += exprseq2astseq(toks, exprs=exprs)
                 return res
@@ -236,7 +264,15 @@ def expr2ast(toks, exprs, ignore_sy_operator=False):
             return If(children=[cond, block])
 
         elif tok.value == "while":
-            cond = expr2ast(toks, exprs=exprs)
+            # The condition ends at the first do, which can't start a block there
+            for n, i in enumerate(toks):
+                if isinstance(i, rlex.Keyword) and i.value == "do":
+                    break
+            else:
+                raise ValueError("Expected Keyword do, not EOF")
+            cond_toks = toks[:n] + [rlex.Separator(line=toks[n].line, char=toks[n].char)]
+            del toks[:n]
+            cond = expr2ast(cond_toks, exprs=exprs)
             # print(toks[0])
             if (not isinstance(toks[0], rlex.Keyword)) or (not toks[0].value == "do"):
                 raise ValueError("Expected Keyword then, got %s %s" % (
@@ -303,31 +339,41 @@ def expr2ast(toks, exprs, ignore_sy_operator=False):
                     return Call(children=[None, Constant(token=rlex.Name(value=tok.value + "=", line=tok.line, char=tok.char)), expr2ast(toks, exprs=exprs)])
                 return Call(children=[None, Name(token=rlex.Name(value=tok.value + "=", line=tok.line, char=tok.char)), expr2ast(toks, exprs=exprs)])
 
+            elif ntok.value == "[" and adjacent(tok, ntok):
+                if tok.value[0] in "QWERTYUIOPASDFGHJKLZXCVBNM":
+                    res = Constant(token=tok)
+                else:
+                    res = Call(children=[None, Name(token=tok)])
+                toks.insert(0, ntok)
+                return postfix(res, tok, toks, exprs, ignore_sy_operator)
+
             elif ntok.value == ".":
                 l = dot(tok, toks)
                 if tok.value[0] in "QWERTYUIOPASDFGHJKLZXCVBNM":
                     res = Constant(token=tok)
                 else:
                     res = Call(children=[None, Name(token=tok)])
-                for i in l[:0:-1]:
+                for i in l[1:]:
                     res = Call(children=[res, i])
                 if isinstance(toks[0], rlex.Operator) and toks[0].value == "(":
                     toks.pop(0)
                     res.children += exprseq2astseq(toks, exprs=exprs, st_paren=True)
                 else:
                     res.children += exprseq2astseq(toks, exprs=exprs)
-                return res
+                return call_tail(res, toks, exprs, ignore_sy_operator)
             
             else:
                 toks.insert(0, ntok)
-                if ignore_sy_operator or ntok.value in {",", "(", ")"}:
+                if ignore_sy_operator or ntok.value in {",", "(", ")", "]", "{", "}"}:
                     if tok.value[0] in "QWERTYUIOPASDFGHJKLZXCVBNM":
                         # Constant name
                         return Constant(token=tok)
                     if isinstance(toks[0], rlex.Operator) and toks[0].value == "(":
                         toks.pop(0)
-                        return Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs, st_paren=True)])
-                    return Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs)])
+                        res = Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs, st_paren=True)])
+                    else:
+                        res = Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs)])
+                    return call_tail(res, toks, exprs, ignore_sy_operator)
                 else:
                     toks.insert(0, tok)
                     return shunting_yard(toks, exprs=exprs)
@@ -339,23 +385,37 @@ def expr2ast(toks, exprs, ignore_sy_operator=False):
                 return Constant(token=tok)
             if isinstance(toks[0], rlex.Operator) and toks[0].value == "(":
                 toks.pop(0)
-                return Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs, st_paren=True)])
-            return Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs)])
-
-    elif isinstance(tok, rlex.Literal):
+                res = Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs, st_paren=True)])
+            else:
+                res = Call(children=[None, Name(token=tok), *exprseq2astseq(toks, exprs=exprs)])
+            return call_tail(res, toks, exprs, ignore_sy_operator)
+
+    elif isinstance(tok, (rlex.Literal, rlex.Symbol, rlex.Interpolation)):
+        if isinstance(tok, rlex.Symbol):
+            node = Symbol(token=tok)
+        elif isinstance(tok, rlex.Interpolation):
+            node = interpolation(tok)
+        else:
+            node = Literal(token=tok)
         if len(toks) > 0:
             if isinstance(toks[0], rlex.Operator):
-                if ignore_sy_operator or toks[0].value in {",", "(", ")"}:
-                    return Literal(token=tok)
+                if toks[0].value == ".":
+                    return postfix(node, tok, toks, exprs, ignore_sy_operator)
+                if ignore_sy_operator or toks[0].value in {",", "(", ")", "]", "}"}:
+                    return node
                 else:
                     toks.insert(0, tok)
                     return shunting_yard(toks, exprs=exprs)
             
-        return Literal(token=tok)
+        return node
 
     elif isinstance(tok, rlex.Operator) and tok.value == ",":
         raise ValueError("Operator , is invalid here.")
 
+    elif isinstance(tok, rlex.Operator) and tok.value == "[":
+        items, close = array_items(toks, exprs=exprs)
+        return postfix(ArrayLiteral(token=tok, children=items), close, toks, exprs, ignore_sy_operator)
+
     elif isinstance(tok, rlex.Operator) and tok.value == "(":
         toks.insert(0, tok)
         t = exprseq2astseq(toks, exprs=exprs)
@@ -363,7 +423,7 @@ def expr2ast(toks, exprs, ignore_sy_operator=False):
             raise ValueError("More than 1 expression in parenthesis")
         if len(t) < 1:
             raise ValueError("Empty parenthesis")
-        return t[0]
+        return postfix(t[0], None, toks, exprs, ignore_sy_operator)
 
     elif isinstance(tok, rlex.Operator):
         p = exprs.pop()
@@ -375,16 +435,19 @@ def expr2ast(toks, exprs, ignore_sy_operator=False):
     raise NotImplementedError(type(tok).__name__)
 
 SY_PRECEDENCE = {
-    "**": 5,
-    "*": 4,
-    "/": 4,
-    "-": 3,
-    "+": 3,
+    "**": 6,
+    "*": 5,
+    "/": 5,
+    "-": 4,
+    "+": 4,
+    "<<": 3,
     "==": 2,
     "!=": 2,
     "<": 2,
     ">": 2,
     "<=>": 2,
+    "..": 1,
+    "...": 1,
     "": float("-inf")
 }
 @dbg
@@ -415,8 +478,11 @@ def shunting_yard(toks, exprs, init=[]):
                 if e is None:
                     raise Break
                 return e
+
+            if toks[0].value == "[":
+                return expr2ast(toks, ignore_sy_operator=True, exprs=exprs)
             
-            if toks[0].value == ",":
+            if toks[0].value in {",", "]", "}", "{"}:
                 raise Break
             return toks.pop(0).value
         
@@ -471,16 +537,122 @@ def dot(tok, toks):
         if isinstance(ntok2l[-1], rlex.Operator):
             if ntok2l[-1].value == ".":
                 ntok2l.append(toks.pop(0))
-            elif ntok2l[-1].value == "(":
+            else:
                 toks.insert(0, ntok2l[-1])
                 break
-            else:
-                raise ValueError("Invalid token sequence: %s, Operator ., %s" % (tok, ", ".join("%s %s" % (type(i).__name__, i.value) for i in ntok2l)))
         else:
             toks.insert(0, ntok2l[-1])
             break
     return l
 
+def adjacent(tok, ntok):
+    # Whether ntok directly follows tok, as in "a[0]" (an index) vs "a [0]"
+    length = len(tok.value) + 1 if isinstance(tok, rlex.GlobalName) else len(str(tok.value))
+    return tok.line == ntok.line and tok.char + length == ntok.char
+
+@dbg
+def postfix(res, last, toks, exprs, ignore_sy_operator=False):
+    # Whatever may follow an already parsed value res, whose last token was last:
+    # an index "[...]" (or index assignment "[...] = x"), a method call or the
+    # rest of a binary operator expression
+    if len(toks) == 0 or not isinstance(toks[0], rlex.Operator):
+        return res
+
+    if toks[0].value == "[" and last is not None and adjacent(last, toks[0]):
+        ntok = toks.pop(0)
+        args, close = array_items(toks, exprs=exprs)
+        if len(toks) > 0 and isinstance(toks[0], rlex.Operator) and toks[0].value == "=":
+            toks.pop(0)
+            name = rlex.Name(value="[]=", line=ntok.line, char=ntok.char)
+            return Call(children=[res, Name(token=name), *args, expr2ast(toks, exprs=exprs)])
+        name = rlex.Name(value="[]", line=ntok.line, char=ntok.char)
+        return postfix(Call(children=[res, Name(token=name), *args]), close, toks, exprs, ignore_sy_operator)
+
+    if toks[0].value == ".":
+        toks.pop(0)
+        for i in dot(last, toks)[1:]:
+            res = Call(children=[res, i])
+        if isinstance(toks[0], rlex.Operator) and toks[0].value == "(":
+            toks.pop(0)
+            res.children += exprseq2astseq(toks, exprs=exprs, st_paren=True)
+        else:
+            res.children += exprseq2astseq(toks, exprs=exprs)
+        return call_tail(res, toks, exprs, ignore_sy_operator)
+
+    if not (ignore_sy_operator or toks[0].value in {",", "(", ")", "]", "{", "}"}):
+        return shunting_yard(toks, exprs=exprs, init=[res])
+    return res
+
+def interpolation(tok):
+    children = []
+    for part in tok.value:
+        if isinstance(part, str):
+            if part != "":
+                children.append(Literal(token=rlex.Literal(value=part, line=tok.line, char=tok.char)))
+        elif len(part) > 0:
+            children.append(expr2ast(part + [rlex.Separator(line=part[-1].line, char=part[-1].char)], exprs=[]))
+    return Interpolation(token=tok, children=children)
+
+def starts_block(toks):
+    if len(toks) == 0:
+        return False
+    return (isinstance(toks[0], rlex.Keyword) and toks[0].value == "do") or \
+        (isinstance(toks[0], rlex.Operator) and toks[0].value == "{")
+
+@dbg
+def call_tail(res, toks, exprs, ignore_sy_operator=False):
+    # After a method call's arguments: an optional block, then a further ".method"
+    if isinstance(res, Call) and starts_block(toks):
+        res.children.append(block(toks, exprs))
+        return postfix(res, None, toks, exprs, ignore_sy_operator)
+    if len(toks) > 0 and isinstance(toks[0], rlex.Operator) and toks[0].value == ".":
+        return postfix(res, None, toks, exprs, ignore_sy_operator)
+    return res
+
+@dbg
+def block(toks, exprs):
+    # "do |a, b| ... end" or "{ |a, b| ... }"
+    opener = toks.pop(0)
+    params = []
+    if len(toks) > 0 and isinstance(toks[0], rlex.Operator) and toks[0].value == "|":
+        toks.pop(0)
+        while 1:
+            ntok = toks.pop(0)
+            if isinstance(ntok, rlex.Operator) and ntok.value == "|":
+                break
+            if isinstance(ntok, rlex.Operator) and ntok.value == ",":
+                continue
+            if not isinstance(ntok, rlex.Name):
+                raise ValueError("Block parameter list must only contain Name tokens")
+            params.append(Name(token=ntok))
+
+    body = _tok2ast(toks)
+    return Block(token=opener, children=[NameSequence(children=params), *body.children[1:]])
+
+@dbg
+def array_items(toks, exprs):
+    # The elements of an array literal (or index), up to the closing ]; returns
+    # (elements, closing token)
+    items = []
+    while 1:
+        while len(toks) > 0 and isinstance(toks[0], rlex.Separator):
+            toks.pop(0)
+        if len(toks) == 0:
+            raise ValueError("Expected Operator ], not EOF")
+        if isinstance(toks[0], rlex.Operator) and toks[0].value == "]":
+            return items, toks.pop(0)
+
+        items.append(expr2ast(toks, exprs=exprs))
+
+        while len(toks) > 0 and isinstance(toks[0], rlex.Separator):
+            toks.pop(0)
+        if len(toks) == 0:
+            raise ValueError("Expected Operator ], not EOF")
+        if isinstance(toks[0], rlex.Operator) and toks[0].value == ",":
+            toks.pop(0)
+        elif not (isinstance(toks[0], rlex.Operator) and toks[0].value == "]"):
+            raise ValueError("Expected Operator , or ] - got %s %s" % (type(toks[0]).__name__, toks[0].value))
+
 @dbg
 def exprseq2astseq(toks, exprs, st_paren=False):
     if AST_DEBUG:
@@ -495,7 +667,7 @@ def exprseq2astseq(toks, exprs, st_paren=False):
         if isinstance(toks[0], rlex.Keyword):
             return []
         
-        if isinstance(toks[0], rlex.Operator) and toks[0].value != "(":
+        if isinstance(toks[0], rlex.Operator) and toks[0].value not in {"(", "["}:
             return []
 
         r = [expr2ast(toks, exprs=exprs)]
@@ -516,6 +688,13 @@ def exprseq2astseq(toks, exprs, st_paren=False):
                 toks.pop(0)
             break
 
+        if isinstance(toks[0], rlex.Operator) and toks[0].value in {"]", "}"}:
+            break
+
+        if isinstance(toks[0], rlex.Operator) and toks[0].value == ".":
+            r.append(postfix(r.pop(), None, toks, exprs))
+            continue
+
         #print("c4")
         if isinstance(toks[0], rlex.Operator) and toks[0].value == "(":
             toks.pop(0)
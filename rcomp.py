@@ -1,279 +1,113 @@
 # Important things TODO: Overhaul the whole exception system (to add support for actual line numbers)
 
-import dis
+import os
 import sys
-import warnings
+import copy
+import hashlib
+import asyncio
 import traceback
+import itertools
 import rlex, rast
-from functools import partial
-
-class RubyErrors:
-    
-    class StandardError(Exception):
-        pass
-
-    class NameError(StandardError):
-        pass
-
-    class NoMethodError(StandardError):
-        pass
-
-class RubyWarning(UserWarning):
-    pass
-
-class Locals():
-    
-    def __init__(self):
-        self.stack = [{}]
-
-    def push(self):
-        self.stack.append({})
-
-    def pop(self):
-        self.stack.pop()
-
-    def update(self, d):
-        if d is None:
-            return
-        self.stack[-1].update(d)
-
-    def __getitem__(self, x):
-        def _wrap(y):
-            nonlocal x, self
-            self[x[:-1]] = y
-        
-        if x.endswith("="):
-            return _wrap
-        
-        for i in reversed(self.stack):
-            if x in i:
-                return i[x]
-        
-        raise RubyErrors.NameError("undefined local variable or method `%s'" % (x, ))
-
-    def __setitem__(self, x, y):
-        def _wrap():
-            nonlocal y
-            return y
-        
-        if callable(y):
-            self.stack[-1][x] = y
-        else:
-            self.stack[-1][x] = _wrap
-
-class Methods():
-
-    def __init__(self, parent, v=None):
-        self.parent = parent
-        self.v = v
-        if self.v is None:
-            self.v = {}
-
-    def __getitem__(self, x):
-        try:
-            return self.v[x]
-        except KeyError:
-            raise RubyErrors.NoMethodError("undefined method `%s' for %s" % (x, self.parent.__name__)) from None
-
-    def __setitem__(self, x, y):
-        self.v[x] = y
-
-class Constants():
-
-    def __init__(self, v):
-        self.v = v
-        if self.v is None:
-            self.v = {}
-
-    def __getitem__(self, x):
-        def _wrap(y):
-            nonlocal x, self
-            self[x[:-1]] = y
-        
-        if x.endswith("="):
-            return _wrap
-        
-        if x in self.v:
-            return self.v[x]
-        
-        raise RubyErrors.NameError("Uninitialized constant %s" % x)
-
-    def __setitem__(self, x, y):
-        if x in self.v:
-            warnings.warn(RubyWarning("alerady initialized constant %s" % x))
-        self.v[x] = y
-
-class Globals():
-
-    def __init__(self, v):
-        self.v = v
-        if self.v is None:
-            self.v = {}
-
-    def __getitem__(self, x):
-        return self.v.get(x)
-
-    def __setitem__(self, x, y):
-        self.v[x] = y
-
-class Object():
-
-    def __init__(self, *args):
-        self.__name__ = "Object"
-        self.methods = Methods(self, {
-            "initialize": self.initialize,
-            "to_s": self.to_s,
-            "==": partial(object.__eq__, self),
-            "!=": partial(object.__ne__, self)
-        })
-        self.ivars = {}
-        return self.methods["initialize"](*args)
-    
-    def __add__(self, other):
-        return self.methods["+"](other)
-    def __sub__(self, other):
-        return self.methods["-"](other)
-    def __mul__(self, other):
-        return self.methods["*"](other)
-    def __truediv__(self, other):
-        return self.methods["/"](other)
-
-    def __gt__(self, other):
-        return self.methods[">"](other)
-    def __lt__(self, other):
-        return self.methods["<"](other)
-    def __ge__(self, other):
-        return self.methods[">="](other)
-    def __le__(self, other):
-        return self.methods["<="](other)
-    def __eq__(self, other):
-        return self.methods["=="](other)
-    def __ne__(self, other):
-        return not self.methods["=="](other)
-
-    def __repr__(self):
-        return self.methods["to_s"]().s
-
-    def to_s(self):
-        return String("#<%s:0x%08x>" % (self.__name__, id(self)))
-
-    def __str__(self):
-        return self.methods["to_s"]().s
-
-class Integer(Object):
-    
-    def initialize(self, *args):
-        self.int = int(args[0])
-        
-        self.methods["+"] = lambda other: Integer(self.int + Integer(other).int)
-        self.methods["-"] = lambda other: Integer(self.int - Integer(other).int)
-        self.methods["*"] = lambda other: Integer(self.int * Integer(other).int)
-        self.methods["/"] = lambda other: Integer(self.int / Integer(other).int)
-
-        self.methods["=="] = lambda other: self.int == other.int
-        self.methods["!="] = lambda other: self.int != other.int
-        self.methods[">"]  = lambda other: self.int > other.int
-        self.methods["<"]  = lambda other: self.int < other.int
-        self.methods[">="] = lambda other: self.int >= other.int
-        self.methods["<="] = lambda other: self.int <= other.int
-        
-        self.__name__ = "Integer"
-
-    def to_s(self):
-        return String(self.int)
-
-    def __int__(self):
-        return self.int
-
-class String(Object):
-
-    def initialize(self, *args):
-        self.s = str(args[0])
-
-        self.methods["=="] = lambda other: self.s == other.s
-        self.methods["!="] = lambda other: self.s != other.s
-
-    def to_s(self):
-        return self
-    
-    def __repr__(self):
-        return self.s
-
-    def __str__(self):
-        return self.s
-
-class Float(Object):
-
-    def initialize(self, *args):
-        try:
-            self.float = float(args[0])
-        except TypeError:
-            self.float = float(int(args[0]))
-        
-        self.methods["+"] = lambda other: Float(self.float + Float(other).float)
-        self.methods["-"] = lambda other: Float(self.float - Float(other).float)
-        self.methods["*"] = lambda other: Float(self.float * Float(other).float)
-        self.methods["/"] = lambda other: Float(self.float / Float(other).float)
-
-        self.methods["=="] = lambda other: self.float == other.float
-        self.methods["!="] = lambda other: self.float != other.float
-        self.methods[">"]  = lambda other: self.float > other.float
-        self.methods["<"]  = lambda other: self.float < other.float
-        self.methods[">="] = lambda other: self.float >= other.float
-        self.methods["<="] = lambda other: self.float <= other.float
-        
-        self.__name__ = "Float"
-
-    def to_s(self):
-        return String(self.float)
-
-    def __int__(self):
-        return int(self.float)
-    
-    def __float__(self):
-        return self.float
-
-    def __str__(self):
-        return str(self.float)
-
-class File(Object):
-
-    def initialize(self, *args):
-        self.file = args[0]
-
-        self.methods["puts"] = self.puts
-        self.methods["gets"] = self.gets
-        self.methods["print"] = self.print
-        self.methods["flush"] = self.flush
-
-        self.__name__ = "File"
+import rserial
+import rruntime
+from rruntime import *
+from rruntime import _exec_globals, _sync_slots, _charging_allocations
+
+class CompileOptions():
+    # async_mode:   Emit a coroutine; method definitions become "async def" and every
+    #               method call is awaited if it returns an awaitable.
+    # line_markers: Tag the first generated line of every statement with a
+    #               "# @rb:<ruby line>" comment (see line_map).
+    # specialize_loops: Let numeric while loops switch to a version compiled for
+    #               native int / float arithmetic once they are warm (see LoopTrace).
+    # budgets:      Count a step at every loop iteration and method / block call,
+    #               so a RubyBudget passed to ruby_exec can stop the program.
+    # named_slots:  Index global / constant slots by variables (rgslot_<name>,
+    #               rcslot_<name>) instead of numbers, for code that runs in
+    #               another process, whose slot layouts differ (see raot).
+    # lean_frames:  Compile methods that don't capture their scope (no blocks or
+    #               nested defs) to plain Python functions: variables are Python
+    #               locals, there's no rlocals frame, and only the last
+    #               statement's value is stored (see _lean_locals).
+    # trampoline:   Compile methods to generators run by rruntime.run_trampoline,
+    #               so recursion isn't limited by Python's stack and calls in
+    #               tail position don't use any (see _mark_tail_calls).
+
+    def __init__(self, **kwargs):
+        self.async_mode = kwargs.pop("async_mode", False)
+        self.line_markers = kwargs.pop("line_markers", False)
+        self.specialize_loops = kwargs.pop("specialize_loops", False)
+        self.budgets = kwargs.pop("budgets", False)
+        self.named_slots = kwargs.pop("named_slots", False)
+        self.lean_frames = kwargs.pop("lean_frames", False)
+        self.trampoline = kwargs.pop("trampoline", False)
+        if len(kwargs) > 0:
+            raise TypeError("Unknown compile option '%s'" % next(iter(kwargs)))
+        if self.trampoline and self.async_mode:
+            raise TypeError("Compile options 'trampoline' and 'async_mode' don't go together")
+        # Inside a lean method: the names of its variables (see for_frame)
+        self.frame_locals = None
+        # Inside a trampolined method's generator (see for_generator)
+        self.generator = False
+
+    def for_frame(self, names):
+        # These options, for the body of a lean method with variables names
+        res = copy.copy(self)
+        res.frame_locals = frozenset(names)
+        return res
 
-    def print(self, *args):
-        self.file.write(" ".join(str(i) for i in args))
+    def for_generator(self, generator):
+        # These options, for code inside (True) or outside (False) a
+        # trampolined method's generator
+        if self.generator == generator:
+            return self
+        res = copy.copy(self)
+        res.generator = generator
+        return res
 
-    def flush(self):
-        self.file.flush()
+DEFAULT_OPTIONS = CompileOptions()
 
-    def puts(self, *args):
-        self.file.write(" ".join(str(i) for i in args) + "\n")
+def _global_slot(name, options):
+    if options.named_slots:
+        return "rgslot_" + name
+    return "%d" % GLOBAL_SLOTS.slot(name)
 
-    def gets(self):
-        return String(self.file.readline()[:-1])
+def _constant_slot(name, options):
+    if options.named_slots:
+        return "rcslot_" + name
+    return "%d" % CONSTANT_SLOTS.slot(name)
 
-def ruby_aspython(ast, push_locals=False, pop_locals=False):
+def ruby_aspython(ast, push_locals=False, pop_locals=False, options=DEFAULT_OPTIONS, block_scope=False, want_result=True):
+    # want_result: Whether the code has to leave the value of the last
+    # statement in result; only lean methods (options.frame_locals) skip it
+    lean = options.frame_locals is not None
     if push_locals:
-        code = "rlocals.push()\nresult = None\ntry:\n"
+        code = "rlocals.push(%s)\nresult = None\ntry:\n" % ("True" if block_scope else "")
         indent = "  "
+    elif lean:
+        code = "result = None\n" if want_result and len(ast.children) == 1 else ""
+        indent = ""
     else:
         code = "result = None\n"
         indent = ""
 
-    for n in ast.children[0].children:
-        code += indent + "rlocals[%r](%s)\n" % (n.token.value + "=", n.token.value)
+    for n in ast.children[0].children if not lean else ():
+        if block_scope:
+            code += indent + "rlocals.define(%r, %s)\n" % (n.token.value, n.token.value)
+        else:
+            code += indent + "rlocals[%r](%s)\n" % (n.token.value + "=", n.token.value)
     
     try:
         for i in ast.children[1:]:
-            code += indent + ruby_compile_as_statement(i).replace("\n", "\n" + indent) + "\n"
+            blocks = _hoist_blocks(i, options)
+            if lean:
+                stmt = ruby_compile_as_statement(i, options, want_result and i is ast.children[-1])
+            else:
+                stmt = ruby_compile_as_statement(i, options)
+            if options.line_markers:
+                stmt = _add_line_marker(stmt, i)
+            stmt = blocks + stmt
+            code += indent + stmt.replace("\n", "\n" + indent) + "\n"
     
     except:
         print("Code generated before crash:\n  " + code.replace("\n", "\n  "), file=sys.stderr)
@@ -285,55 +119,437 @@ def ruby_aspython(ast, push_locals=False, pop_locals=False):
     
     return code
 
-def ruby_compile_as_statement(ast):
+# Blocks passed to calls ("do |x| ... end", "{ |x| ... }") are compiled to
+# plain functions defined right before the statement containing the call, which
+# then passes the function as block=.
+
+_block_ids = itertools.count()
+
+def _hoist_blocks(ast, options):
+    # The definitions of the blocks in statement ast, not counting the ones in
+    # nested statements (method and if / while bodies), which get theirs
+    if isinstance(ast, rast.Define):
+        return ""
+    if isinstance(ast, (rast.If, rast.While)):
+        children = ast.children[:1]
+    else:
+        children = ast.children or []
+    code = ""
+    for i in children:
+        if isinstance(i, rast.Block):
+            code += _compile_block(i, options)
+        elif isinstance(i, rast.Node):
+            code += _hoist_blocks(i, options)
+    return code
+
+def _compile_block(ast, options):
+    if options.async_mode:
+        raise NotImplementedError("Blocks aren't supported in async mode")
+    ast.pyname = "_block_%d" % next(_block_ids)
+    # Blocks are called by the runtime, as plain functions
+    options = options.for_generator(False)
+    # Ruby lets a block take fewer or more arguments than it's given
+    params = ["%s=None" % i.token.value for i in ast.children[0].children] + ["*_"]
+    res = "def %s(%s):\n" % (ast.pyname, ", ".join(params))
+    if options.budgets:
+        res += "  rtick()\n"
+    res += "  " + ruby_aspython(ast, push_locals=True, pop_locals=True, options=options, block_scope=True).replace("\n", "\n  ")
+    res += "\n  return result\n"
+    return res
+
+def _add_line_marker(stmt, ast):
+    line = rast.first_line(ast)
+    if line is None:
+        return stmt
+    marker = "  # @rb:%d" % line
+    if isinstance(ast, rast.Define):
+        marker += " def:%s" % ast.children[0].token.value
+    first, nl, rest = stmt.partition("\n")
+    return first + marker + nl + rest
+
+def line_map(pcode):
+    # Maps generated line numbers to Ruby line numbers using the markers emitted
+    # with line_markers=True. Unmarked lines belong to the closest marked line
+    # above them. Also returns {generated def line: Ruby method name}.
+    lines = {}
+    methods = {}
+    last = None
+    for n, text in enumerate(pcode.split("\n"), 1):
+        _, marker, info = text.partition("  # @rb:")
+        if marker:
+            line, _, name = info.partition(" def:")
+            last = int(line)
+            if name:
+                methods[n] = name
+        lines[n] = last
+    return lines, methods
+
+def ruby_aspython_async(ast, options=None):
+    # Compiles a whole program into the "ruby_main" coroutine (see ruby_exec_async)
+    code = ruby_aspython(ast, options=options or CompileOptions(async_mode=True))
+    return "async def ruby_main():\n  %s\n  return result\n" % code.replace("\n", "\n  ")
+
+def ruby_compile_as_statement(ast, options=DEFAULT_OPTIONS, want_result=True):
+    # want_result: See ruby_aspython; only honoured in lean methods
+    lean = options.frame_locals is not None
     if isinstance(ast, rast.AssignGlobal):
-        return "rglobals[%r] = %s" % (ast.token.value, ruby_compile_as_rvalue(ast.children[1]))
+        res = "rgslots[%s] = %s" % (_global_slot(ast.children[0].token.value, options), ruby_compile_as_rvalue(ast.children[1], options))
+        if lean and want_result:
+            res += "\nresult = None"
+        return res
 
     elif isinstance(ast, rast.Call):
-        return "result = " + ruby_compile_as_rvalue(ast)
+        if lean:
+            name = _local_assignment(ast)
+            if name is not None and name in options.frame_locals:
+                res = "v_%s = %s" % (name, ruby_compile_as_rvalue(ast.children[2], options))
+                return res + "\nresult = None" if want_result else res
+            if not want_result:
+                return ruby_compile_as_rvalue(ast, options)
+        return "result = " + ruby_compile_as_rvalue(ast, options)
+
+    elif isinstance(ast, rast.Define) and options.lean_frames and _lean_locals(ast) is not None:
+        return _compile_lean_method(ast, options)
 
     elif isinstance(ast, rast.Define):
-        res = "def _method_definition(%s):\n" % (", ".join(i.token.value for i in ast.children[1].children[0].children))
-        res += "  " + ruby_aspython(ast.children[1], push_locals=True, pop_locals=True).replace("\n", "\n  ")
-        res += "\n  return result\n_method_definition.__name__ = %r\nrlocals[%r] = _method_definition\n" % (
-            ast.children[0].token.value,
-            ast.children[0].token.value
+        if options.trampoline:
+            _mark_tail_calls(ast.children[1])
+            options = options.for_generator(True)
+        res = "async def" if options.async_mode else "def"
+        res += " _method_definition(%s):\n" % (", ".join(i.token.value for i in ast.children[1].children[0].children))
+        if options.budgets:
+            res += "  rtick()\n"
+        res += "  " + ruby_aspython(ast.children[1], push_locals=True, pop_locals=True, options=options).replace("\n", "\n  ")
+        return res + _bind_method(ast, options)
+
+    elif isinstance(ast, rast.If) and lean:
+        res = "if %s:\n  %s" % (
+            ruby_compile_as_rvalue(ast.children[0], options),
+            _lean_body(ast.children[1], options, want_result)
         )
+        if len(ast.children) == 3:
+            res += "\nelse:\n  %s" % _lean_body(ast.children[2], options, want_result)
+        elif want_result:
+            res += "\nelse:\n  result = None"
         return res
 
     elif isinstance(ast, rast.If):
         if len(ast.children) == 3:
             return "if %s:\n  %s\nelse:\n  %s" % (
-                ruby_compile_as_rvalue(ast.children[0]),
-                ruby_aspython(ast.children[1]).replace("\n", "\n  "),
-                ruby_aspython(ast.children[2]).replace("\n", "\n  ")
+                ruby_compile_as_rvalue(ast.children[0], options),
+                ruby_aspython(ast.children[1], options=options).replace("\n", "\n  "),
+                ruby_aspython(ast.children[2], options=options).replace("\n", "\n  ")
             )
         return "if %s:\n  %s" % (
-            ruby_compile_as_rvalue(ast.children[0]),
-            ruby_aspython(ast.children[1]).replace("\n", "\n  ")
+            ruby_compile_as_rvalue(ast.children[0], options),
+            ruby_aspython(ast.children[1], options=options).replace("\n", "\n  ")
+        )
+
+    elif isinstance(ast, rast.While) and lean:
+        res = "while %s:\n  %s%s" % (
+            ruby_compile_as_rvalue(ast.children[0], options),
+            "rtick()\n  " if options.budgets else "",
+            _lean_body(ast.children[1], options, False)
         )
+        return res + "\nresult = None" if want_result else res
 
     elif isinstance(ast, rast.While):
-        return "while %s:\n  %s" % (
-            ruby_compile_as_rvalue(ast.children[0]),
-            ruby_aspython(ast.children[1]).replace("\n", "\n  ")
+        res = "while %s:\n  %s%s" % (
+            ruby_compile_as_rvalue(ast.children[0], options),
+            "rtick()\n  " if options.budgets else "",
+            ruby_aspython(ast.children[1], options=options).replace("\n", "\n  ")
         )
+        if options.specialize_loops and _is_numeric_loop(ast):
+            # The loop carries its own AST, so its trace is made (and kept) by
+            # the code running it (see rruntime.run_loop_trace)
+            res += "if rtrace(%d, %r, %r, rlocals):\n    break" % (next(LOOP_NUMBERS), rserial.dumps(ast), options.budgets)
+        return res
 
     elif isinstance(ast, rast.Name):
         return "result = rlocals[%r]" % ast.token.value
 
     elif isinstance(ast, rast.Constant):
-        return "result = rconsts[%r]" % ast.token.value
+        return "result = " + ruby_compile_as_rvalue(ast, options)
 
     elif isinstance(ast, rast.Global):
-        return "result = rglobals[%r]" % ast.token.value
+        return "result = " + ruby_compile_as_rvalue(ast, options)
     
     else:
         raise NotImplementedError(type(ast).__name__)
 
-def ruby_compile_as_lvalue(ast):
+# Lean methods
+#
+# With lean_frames, a method whose body doesn't capture its scope (no blocks,
+# no nested defs) and only assigns variables as whole statements compiles to a
+# plain function: parameters and variables are Python locals (v_<name>, nil
+# until assigned), it pushes no rlocals frame, and only its last statement's
+# value is stored in result. Names that aren't its variables are still looked
+# up through rlocals, as method calls.
+
+def _local_assignment(ast):
+    # The variable a "name = value" Call assigns, else None
+    if isinstance(ast, rast.Call) and ast.children[0] is None and isinstance(ast.children[1], rast.Name) \
+            and ast.children[1].token.value.endswith("=") and len(ast.children) == 3:
+        return ast.children[1].token.value[:-1]
+    return None
+
+def _lean_locals(ast):
+    # The variables of Define ast (parameters first) if it can be compiled as a
+    # lean method, else None
+    names = [i.token.value for i in ast.children[1].children[0].children]
+
+    def statements(block):
+        for i in block.children[1:]:
+            name = _local_assignment(i)
+            if name is not None:
+                if name not in names:
+                    names.append(name)
+                if not expression(i.children[2]):
+                    return False
+            elif isinstance(i, rast.If):
+                if not expression(i.children[0]) or not all(statements(j) for j in i.children[1:]):
+                    return False
+            elif isinstance(i, rast.While):
+                if not expression(i.children[0]) or not statements(i.children[1]):
+                    return False
+            elif not expression(i):
+                return False
+        return True
+
+    def expression(node):
+        if node is None:
+            return True
+        if isinstance(node, (rast.Block, rast.Define, rast.If, rast.While)) or _local_assignment(node) is not None:
+            return False
+        return all(expression(i) for i in node.children or [] if isinstance(i, rast.Node))
+
+    if not statements(ast.children[1]):
+        return None
+    return names
+
+def _lean_body(ast, options, want_result):
+    # An if / while body in a lean method, indented to go after its header
+    code = ruby_aspython(ast, options=options, want_result=want_result)
+    return (code if code else "pass\n").replace("\n", "\n  ")
+
+def _compile_lean_method(ast, options):
+    names = _lean_locals(ast)
+    params = [i.token.value for i in ast.children[1].children[0].children]
+    options = options.for_frame(names)
+    if options.trampoline:
+        _mark_tail_calls(ast.children[1])
+        options = options.for_generator(True)
+    res = "async def" if options.async_mode else "def"
+    res += " _method_definition(%s):\n" % ", ".join("v_" + i for i in params)
+    if options.budgets:
+        res += "  rtick()\n"
+    variables = names[len(params):]
+    if variables:
+        res += "  %s = None\n" % " = ".join("v_" + i for i in variables)
+    res += "  " + ruby_aspython(ast.children[1], options=options).replace("\n", "\n  ")
+    return res + _bind_method(ast, options)
+
+def _bind_method(ast, options):
+    # The end of a method definition: returning its result, then defining it
+    name = ast.children[0].token.value
+    fn = "Trampolined(_method_definition)" if options.trampoline else "_method_definition"
+    return "\n  return result\n_method_definition.__name__ = %r\nrlocals[%r] = %s\n" % (name, name, fn)
+
+# Trampolined methods
+#
+# In a trampolined method's generator, a call to a method (a call without a
+# receiver) evaluates its arguments, and if the method is Trampolined yields it
+# with them to run_trampoline, which starts its generator and sends back the
+# result; other callables are called directly. A call in tail position returns
+# TailCall(method, args) instead, so the caller's frame is gone before the
+# callee's starts. Names are resolved with rlocals.method, which only looks in
+# the method's own frames and the top level.
+
+def _mark_tail_calls(block):
+    # Marks the method calls whose value is the value of method body block
+    if len(block.children) < 2:
+        return
+    last = block.children[-1]
+    if isinstance(last, rast.If):
+        for i in last.children[1:]:
+            _mark_tail_calls(i)
+    elif isinstance(last, rast.Call) and last.children[0] is None and isinstance(last.children[1], rast.Name) \
+            and not last.children[1].token.value.endswith("="):
+        last.tail = True
+
+# Loop specialisation
+#
+# A while loop whose condition and body only use local variables, numeric
+# literals, arithmetic, comparisons, assignments and nested if / while gets a
+# LoopTrace. The generic loop calls rtrace at the end of every iteration; after
+# LoopTrace.WARMUP iterations it reads the loop's variables, and if they're all
+# Integer / Float it runs the rest of the loop in a version compiled for exactly
+# those types, then boxes the variables back into rlocals. Types are checked
+# (guarded) on every entry and versions are cached per type signature; a
+# signature whose types wouldn't stay the same across iterations, or any
+# non-numeric variable, keeps the loop on the generic path.
+
+ARITHMETIC_OPS = {"+", "-", "*", "/"}
+
+# Tells a code object's loops apart (see rruntime.LOOP_TRACES)
+LOOP_NUMBERS = itertools.count()
+
+
+class Unspecializable(Exception):
+    pass
+
+def _is_temporary(ast):
+    # Whether ast makes a new Integer / Float that only the operation using it
+    # will see: a + - * / operation, or a number literal that isn't one of the
+    # shared small Integers (see rruntime.arith)
+    if isinstance(ast, rast.Literal):
+        v = ast.token.value
+        return type(v) is float or type(v) is int and not Integer.SMALL_MIN <= v <= Integer.SMALL_MAX
+    return isinstance(ast, rast.Call) and ast.children[0] is not None and len(ast.children) == 3 \
+        and ast.children[1].token.value in ARITHMETIC_OPS
+
+def _is_variable_read(ast):
+    return isinstance(ast, rast.Call) and ast.children[0] is None and len(ast.children) == 2 \
+        and isinstance(ast.children[1], rast.Name)
+
+def _is_variable_write(ast):
+    return isinstance(ast, rast.Call) and ast.children[0] is None and len(ast.children) == 3 \
+        and isinstance(ast.children[1], rast.Name) and ast.children[1].token.value.endswith("=")
+
+def _is_numeric_expr(ast, ops=ARITHMETIC_OPS):
+    if isinstance(ast, rast.Literal):
+        return type(ast.token.value) in (int, float)
+    if _is_variable_read(ast):
+        return True
+    if isinstance(ast, rast.Call) and ast.children[0] is not None and len(ast.children) == 3:
+        return ast.children[1].token.value in ops and _is_numeric_expr(ast.children[0]) \
+            and _is_numeric_expr(ast.children[2])
+    return False
+
+def _is_numeric_cond(ast):
+    return isinstance(ast, rast.Call) and ast.children[0] is not None and len(ast.children) == 3 \
+        and ast.children[1].token.value in COMPARISON_OPS and _is_numeric_expr(ast.children[0]) \
+        and _is_numeric_expr(ast.children[2])
+
+def _is_numeric_block(ast):
+    for i in ast.children[1:]:
+        if _is_variable_write(i):
+            if not _is_numeric_expr(i.children[2]):
+                return False
+        elif isinstance(i, rast.If):
+            if not (_is_numeric_cond(i.children[0]) and all(_is_numeric_block(j) for j in i.children[1:])):
+                return False
+        elif not _is_numeric_loop(i):
+            return False
+    return True
+
+def _is_numeric_loop(ast):
+    return isinstance(ast, rast.While) and _is_numeric_cond(ast.children[0]) and _is_numeric_block(ast.children[1])
+
+def _loop_variables(ast, reads=None, writes=None):
+    if reads is None:
+        reads, writes = set(), set()
+    if _is_variable_read(ast):
+        reads.add(ast.children[1].token.value)
+    elif _is_variable_write(ast):
+        writes.add(ast.children[1].token.value[:-1])
+    for i in ast.children or []:
+        if isinstance(i, rast.Node):
+            _loop_variables(i, reads, writes)
+    return reads, writes
+
+def _native_expr(ast, types):
+    # Returns (python code, "int" / "float" / "bool") computing ast the way
+    # Integer / Float methods would for the given variable types
+    if isinstance(ast, rast.Literal):
+        return repr(ast.token.value), type(ast.token.value).__name__
+
+    if _is_variable_read(ast):
+        return "v_" + ast.children[1].token.value, types[ast.children[1].token.value]
+
+    left, ltype = _native_expr(ast.children[0], types)
+    right, rtype = _native_expr(ast.children[2], types)
+    op = ast.children[1].token.value
+    if op in COMPARISON_OPS:
+        # Integer#< etc. read other.int, so only same-typed comparisons work
+        if ltype != rtype:
+            raise Unspecializable("comparison between %s and %s" % (ltype, rtype))
+        return "(%s %s %s)" % (left, op, right), "bool"
+
+    # The result takes the receiver's type, with the argument converted to it
+    if ltype != rtype:
+        right = "%s(%s)" % (ltype, right)
+    if op == "/" and ltype == "int":
+        return "int(%s / %s)" % (left, right), "int"
+    return "(%s %s %s)" % (left, op, right), ltype
+
+def _native_block(ast, types, budgets=False):
+    code = ""
+    for i in ast.children[1:]:
+        if _is_variable_write(i):
+            name = i.children[1].token.value[:-1]
+            expr, etype = _native_expr(i.children[2], types)
+            if etype != types[name]:
+                raise Unspecializable("%s changes type from %s to %s" % (name, types[name], etype))
+            code += "v_%s = %s\n" % (name, expr)
+        elif isinstance(i, rast.If):
+            code += "if %s:\n  %s\n" % (_native_expr(i.children[0], types)[0], _native_block(i.children[1], types, budgets).replace("\n", "\n  "))
+            if len(i.children) == 3:
+                code += "else:\n  %s\n" % _native_block(i.children[2], types, budgets).replace("\n", "\n  ")
+        else:
+            code += _native_loop(i, types, budgets) + "\n"
+    return code + "pass"
+
+# With budgets, native loops count steps in a plain local and only report them
+# (rsteps) every NATIVE_STEP_BATCH iterations and on exit
+NATIVE_STEP_BATCH = 1024
+
+def _native_loop(ast, types, budgets=False):
+    steps = ""
+    if budgets:
+        steps = "n_steps += 1\nif n_steps == %d:\n  rsteps(n_steps)\n  n_steps = 0\n" % NATIVE_STEP_BATCH
+    return "while %s:\n  %s" % (
+        _native_expr(ast.children[0], types)[0],
+        (steps + _native_block(ast.children[1], types, budgets)).replace("\n", "\n  ")
+    )
+
+class LoopTrace():
+
+    WARMUP = 16
+
+    def __init__(self, ast, budgets=False):
+        self.ast = ast
+        self.budgets = budgets
+        reads, writes = _loop_variables(ast)
+        self.names = sorted(reads | writes)
+        self.writes = sorted(writes)
+        self.count = 0
+        self.versions = {}
+        self.entries = 0
+        self.guard_failures = 0
+
+    def specialize(self, types):
+        # Compiles the loop for {name: "int" / "float"}; None if it can't be
+        types = dict(zip(self.names, types))
+        try:
+            loop = _native_loop(self.ast, types, self.budgets)
+        except Unspecializable:
+            return None
+        code = "def trace(rlocals, rsteps, %s):\n  n_steps = 0\n  try:\n    %s\n  finally:\n" % (
+            ", ".join("v_" + i for i in self.names),
+            loop.replace("\n", "\n    ")
+        )
+        if self.budgets:
+            code += "    rsteps(n_steps)\n"
+        for i in self.writes:
+            code += "    rlocals[%r](%s(v_%s))\n" % (i + "=", "Integer" if types[i] == "int" else "Float", i)
+        env = {"Integer": Integer.box, "Float": Float.box, "__builtins__": {"int": int, "float": float}}
+        exec(compile(code, "<specialized ruby loop>", "exec"), env)
+        return env["trace"]
+
+def ruby_compile_as_lvalue(ast, options=DEFAULT_OPTIONS):
     if isinstance(ast, rast.Global):
-        return "rglobals[%r]" % ast.token.value
+        return "rgslots[%s]" % _global_slot(ast.token.value, options)
 
     elif isinstance(ast, rast.Constant):
         return "rconsts[%r]" % ast.token.value
@@ -344,31 +560,62 @@ def ruby_compile_as_lvalue(ast):
     else:
         raise NotImplementedError(type(ast).__name__)
 
-def ruby_compile_as_rvalue(ast):
+def ruby_compile_as_rvalue(ast, options=DEFAULT_OPTIONS):
     # print("rvalue", ast)
     if isinstance(ast, rast.Literal):
         return "LITERAL_TYPE_MAP[%r](%r)" % (type(ast.token.value).__name__, ast.token.value)
 
+    elif isinstance(ast, rast.Symbol):
+        return "LITERAL_TYPE_MAP['sym'](%r)" % ast.token.value
+
+    elif isinstance(ast, rast.Interpolation):
+        return "LITERAL_TYPE_MAP['interp'](%s)" % ", ".join(
+            repr(i.token.value) if isinstance(i, rast.Literal) else ruby_compile_as_rvalue(i, options)
+            for i in ast.children)
+
     elif isinstance(ast, rast.Name):
         return "rlocals[%r]" % ast.token.value
 
     elif isinstance(ast, rast.Global):
-        return "rglobals[%r]" % ast.token.value
+        return "rgslots[%s]" % _global_slot(ast.token.value, options)
 
     elif isinstance(ast, rast.Constant):
-        return "rconsts[%r]" % ast.token.value
+        n = _constant_slot(ast.token.value, options)
+        return "(rcslots[{0}] if rcslots[{0}] is not UNSET else rconsts.missing({0}))".format(n)
+
+    elif isinstance(ast, rast.ArrayLiteral):
+        return "LITERAL_TYPE_MAP['list']([%s])" % ", ".join(ruby_compile_as_rvalue(i, options) for i in ast.children)
 
     elif isinstance(ast, rast.Call):
         method_name = ast.children[1].token.value
-        args = [ruby_compile_as_rvalue(i) for i in ast.children[2:]]
+        children = ast.children[2:]
+        block = None
+        if len(children) > 0 and isinstance(children[-1], rast.Block):
+            block = children.pop()
+        args = [ruby_compile_as_rvalue(i, options) for i in children]
+        if block is not None:
+            args.append("block=%s" % block.pyname)
         args_repr = ", ".join("%s" % i for i in args)
+        call_fmt = "(await rawait(%s))" if options.async_mode else "%s"
+        if method_name in ("..", "..."):
+            return "LITERAL_TYPE_MAP['range'](%s, %s, %r)" % (
+                ruby_compile_as_rvalue(ast.children[0], options), args_repr, method_name == "...")
         if ast.children[0] is None:
+            if options.frame_locals is not None and not args and method_name in options.frame_locals:
+                return "v_" + method_name
             if isinstance(ast.children[1], rast.Constant):
-                return "rconsts[%r](%s)" % (method_name, args_repr)
-            return "rlocals[%r](%s)" % (method_name, args_repr)
+                if method_name.endswith("="):
+                    return "rconsts.assign(%s, %s)" % (_constant_slot(method_name[:-1], options), args_repr)
+                return call_fmt % ("rconsts[%r](%s)" % (method_name, args_repr))
+            if options.generator and block is None and not method_name.endswith("="):
+                if getattr(ast, "tail", False):
+                    return "TailCall(rlocals.method(%r), (%s))" % (method_name, args_repr + "," if args else "")
+                return "((yield (_rf, _ra)) if (_ra := (%s)) is not None and (_rf := rlocals.method(%r)).__class__ is Trampolined else _rf(*_ra))" % (
+                    args_repr + "," if args else "", method_name)
+            return call_fmt % ("rlocals[%r](%s)" % (method_name, args_repr))
         
         else:
-            source_obj = ruby_compile_as_rvalue(ast.children[0])
+            source_obj = ruby_compile_as_rvalue(ast.children[0], options)
             MAP = {
                 "+":  "({0} + {2})",
                 "-":  "({0} - {2})",
@@ -387,29 +634,363 @@ def ruby_compile_as_rvalue(ast):
                 
             }
             # print(args_repr)
-            return MAP.get(method_name, "{0}.methods[{1}]({2})").format(source_obj, repr(method_name), args_repr)
+            if method_name in ARITHMETIC_OPS and len(children) == 1:
+                temps = _is_temporary(ast.children[0]) | _is_temporary(children[0]) << 1
+                if temps:
+                    return "rarith(%r, %s, %s, %d)" % (method_name, source_obj, args_repr, temps)
+            if method_name in MAP:
+                return MAP[method_name].format(source_obj, repr(method_name), args_repr)
+            return call_fmt % "{0}.methods[{1}]({2})".format(source_obj, repr(method_name), args_repr)
     
     else:
         raise NotImplementedError(type(ast).__name__)
 
-def ruby_exec(code, *, constants=None, rglobals=None, rlocals_init=None):
-    constants = Constants(constants)
-    rglobals = Globals(rglobals)
-    eglobals = {
-        "rlocals": Locals(),
-        "rglobals": rglobals,
-        "rconsts": constants,
-        "__builtins__": {},
-        "LITERAL_TYPE_MAP": {
-            "int": Integer,
-            "str": String,
-            "float": Float
-        }
-    }
-    eglobals["rlocals"].update(rlocals_init)
-    locals = {}
-    exec(code, eglobals, locals)
-    return eglobals, locals
+class CompiledFile():
+    __slots__ = ("mtime_ns", "size", "digest", "code")
+
+    def __init__(self, mtime_ns, size, digest, code):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+        self.code = code
+
+class ModuleLoader():
+    # Backs require / require_relative / load. Each file is compiled once per
+    # process and its code object cached by path; loading it into an
+    # environment runs that code there, which binds its methods in that
+    # environment's top-level frame. A cached file is checked against its
+    # mtime and size on every load, and only recompiled if they changed and
+    # its content hash did too.
+    #
+    # require and require_relative load a file once per environment (they
+    # record it in $LOADED_FEATURES) and return whether they did; load always
+    # runs it. Names without a directory are searched for in $LOAD_PATH,
+    # require_relative's relative to the file requiring them.
+
+    def __init__(self, options=DEFAULT_OPTIONS):
+        self.options = options
+        self.cache = {}
+        self.compiles = 0
+        self.hits = 0
+        # Paths being loaded, innermost last
+        self.loading = []
+
+    def resolve(self, eglobals, kind, name):
+        file = name if name.endswith(".rb") else name + ".rb"
+        if os.path.isabs(file):
+            candidates = [file]
+        elif kind == "require_relative":
+            base = os.path.dirname(self.loading[-1]) if self.loading else os.getcwd()
+            candidates = [os.path.join(base, file)]
+        elif file.startswith("./") or file.startswith("../"):
+            candidates = [file]
+        else:
+            candidates = [os.path.join(str(i), file) for i in eglobals["rglobals"]["LOAD_PATH"].boxed()]
+        for i in candidates:
+            if os.path.isfile(i):
+                return os.path.abspath(i)
+        raise RubyErrors.LoadError("cannot load such file -- %s" % name)
+
+    def compiled(self, path):
+        st = os.stat(path)
+        entry = self.cache.get(path)
+        if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+            self.hits += 1
+            return entry.code
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).digest()
+        if entry is not None and entry.digest == digest:
+            entry.mtime_ns, entry.size = st.st_mtime_ns, st.st_size
+            self.hits += 1
+            return entry.code
+        pcode = ruby_aspython(rast.parse(rlex.lex(data.decode("utf-8"))), options=self.options)
+        code = compile(pcode, path, "exec")
+        self.cache[path] = CompiledFile(st.st_mtime_ns, st.st_size, digest, code)
+        self.compiles += 1
+        return code
+
+    def load(self, eglobals, kind, name):
+        path = self.resolve(eglobals, kind, name)
+        if kind != "load":
+            features = eglobals["rglobals"]["LOADED_FEATURES"]
+            if any(str(i) == path for i in features.boxed()):
+                return False
+            features.append(String(path))
+        code = self.compiled(path)
+        _sync_slots(eglobals)
+        # The file runs at the top level, whatever frame required it
+        rlocals = eglobals["rlocals"]
+        saved = rlocals.stack, rlocals.blocks
+        rlocals.stack, rlocals.blocks = saved[0][:1], saved[1][:1]
+        self.loading.append(path)
+        try:
+            exec(code, eglobals, {})
+        finally:
+            self.loading.pop()
+            rlocals.stack, rlocals.blocks = saved
+        return True
+
+MODULE_LOADER = rruntime.module_loader = ModuleLoader()
+rruntime.loop_tracer = lambda loop, budgets: LoopTrace(rserial.loads(loop), budgets)
+
+# Record batches (RubySession.run_records): one program evaluated per record of
+# bindings. A program that is a single arithmetic expression or comparison over
+# variables runs a whole batch at once, column by column, through a function
+# compiled for the batch's Integer / Float variable types, like a specialized
+# loop (see _native_expr); anything else runs record by record.
+
+RECORD_BATCH_SIZE = 1024
+
+NATIVE_TYPES = {int: "int", float: "float", Integer: "int", Float: "float"}
+
+def _record_rule(ast):
+    # (expression, variable names) if the program can run column-wise
+    if len(ast.children) != 2 or len(ast.children[0].children) > 0:
+        return None
+    stmt = ast.children[1]
+    if not (_is_numeric_expr(stmt) or _is_numeric_cond(stmt)):
+        return None
+    names = sorted(_loop_variables(stmt)[0])
+    if len(names) == 0:
+        return None
+    return stmt, names
+
+def _native_rule(stmt, names, types):
+    # A function of the plain variable values computing stmt for the given
+    # types, or None if they don't specialize
+    try:
+        expr = _native_expr(stmt, dict(zip(names, types)))[0]
+    except Unspecializable:
+        return None
+    code = "def rule(%s):\n  return %s\n" % (", ".join("v_" + i for i in names), expr)
+    env = {"__builtins__": {"int": int, "float": float}}
+    exec(compile(code, "<ruby record rule>", "exec"), env)
+    return env["rule"]
+
+def _column(batch, name):
+    # The plain values of name across batch and their native type, or None
+    # if some record doesn't bind it to an Integer / Float like the first
+    try:
+        col = [r[name] for r in batch]
+    except KeyError:
+        return None
+    t = type(col[0])
+    if t not in NATIVE_TYPES:
+        return None
+    for v in col:
+        if type(v) is not t:
+            return None
+    if t is Integer:
+        col = [v.int for v in col]
+    elif t is Float:
+        col = [v.float for v in col]
+    return col, NATIVE_TYPES[t]
+
+def _record_value(v):
+    # A binding as a Ruby value: Python ints, floats and strs are boxed
+    if isinstance(v, str):
+        return String(v)
+    return rruntime._box(v)
+
+def _plain_value(v):
+    # A result as a Python value where there's one: Integer, Float and String
+    # are unboxed, true / false / nil already are bool / None
+    t = type(v)
+    if t is Integer:
+        return v.int
+    if t is Float:
+        return v.float
+    if t is String:
+        return v.s
+    return v
+
+class RubySession():
+    # An environment evaluating code chunk after chunk (a REPL's inputs): every
+    # chunk runs directly against the same rlocals / rglobals / rconsts, so
+    # definitions persist without copying any state between chunks, and a
+    # chunk costs the same however much the session has defined.
+
+    def __init__(self, constants=None, rglobals=None, rlocals_init=None, options=DEFAULT_OPTIONS):
+        self.options = options
+        self.eglobals = _exec_globals(constants, rglobals, rlocals_init)
+        self.rlocals = self.eglobals["rlocals"]
+        # The AST of each top-level method compile() has seen, by name (see
+        # rsnapshot)
+        self.definitions = {}
+
+    @classmethod
+    def standard(cls, stdin, stdout, options=DEFAULT_OPTIONS):
+        consts, rlocals, rglobals = standard_env(stdin, stdout)
+        return cls(consts, rglobals, rlocals, options)
+
+    def translate(self, source):
+        # The Python source compile() compiles
+        ast = rast.parse(rlex.lex(source))
+        for i in ast.children[1:]:
+            if isinstance(i, rast.Define):
+                self.definitions[i.children[0].token.value] = i
+        if self.options.async_mode:
+            return ruby_aspython_async(ast, self.options)
+        return ruby_aspython(ast, options=self.options)
+
+    def compile(self, source):
+        return compile(self.translate(source), "<compiled ruby code>", "exec")
+
+    def run(self, code, budget=None):
+        # The value of the chunk's last statement. budget: A RubyBudget for
+        # this chunk only
+        _sync_slots(self.eglobals)
+        if budget is not None:
+            budget.install(self.eglobals)
+        locals = {}
+        try:
+            with _charging_allocations(budget):
+                exec(code, self.eglobals, locals)
+        except BaseException:
+            self.unwind()
+            raise
+        finally:
+            if budget is not None:
+                RubyBudget.uninstall(self.eglobals)
+        return locals["result"]
+
+    async def run_async(self, code, budget=None):
+        # For code compiled with async_mode
+        _sync_slots(self.eglobals)
+        if budget is not None:
+            budget.install(self.eglobals)
+        locals = {}
+        try:
+            with _charging_allocations(budget):
+                exec(code, self.eglobals, locals)
+                return await locals["ruby_main"]()
+        except BaseException:
+            self.unwind()
+            raise
+        finally:
+            if budget is not None:
+                RubyBudget.uninstall(self.eglobals)
+
+    def eval(self, source, budget=None):
+        return self.run(self.compile(source), budget)
+
+    def run_records(self, source, records, batch_size=RECORD_BATCH_SIZE):
+        # Compiles source once and yields its value for each record, a dict of
+        # local variable bindings (Python or Ruby values). Every record starts
+        # from the session's top-level locals; globals and constants it sets
+        # persist. Results come back as Python values where possible (see
+        # _plain_value).
+        if self.options.async_mode:
+            raise TypeError("run_records needs a session compiled without async_mode")
+        ast = rast.parse(rlex.lex(source))
+        code = compile(ruby_aspython(ast, options=self.options), "<compiled ruby code>", "exec")
+        rule = _record_rule(ast)
+        natives = {}
+        _sync_slots(self.eglobals)
+        rlocals = self.rlocals
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if len(batch) == 0:
+                break
+            if rule is not None:
+                cols = [_column(batch, name) for name in rule[1]]
+                if None not in cols:
+                    types = tuple(i[1] for i in cols)
+                    if types not in natives:
+                        natives[types] = _native_rule(rule[0], rule[1], types)
+                    if natives[types] is not None:
+                        yield from map(natives[types], *(i[0] for i in cols))
+                        continue
+            for record in batch:
+                # The record runs in a frame of its own over the top level,
+                # popped before its result is yielded, so whatever the caller
+                # does between records sees the session as it was
+                rlocals.push()
+                frame = rlocals.stack[-1]
+                for name, value in record.items():
+                    frame[name] = rruntime._variable(_record_value(value))
+                locals = {}
+                try:
+                    exec(code, self.eglobals, locals)
+                except BaseException:
+                    self.unwind()
+                    raise
+                rlocals.pop()
+                yield _plain_value(locals["result"])
+
+    async def eval_async(self, source, budget=None):
+        return await self.run_async(self.compile(source), budget)
+
+    def unwind(self):
+        # Drops frames left over by an error (frames normally pop themselves)
+        del self.rlocals.stack[1:]
+        del self.rlocals.blocks[1:]
+
+def block_depth(toks):
+    # How many blocks a line opens (positive) or closes (negative); used by the REPLs
+    depth = 0
+    for i in toks:
+        if isinstance(i, rlex.Keyword) and i.value in {"then", "do", "def"}:
+            depth += 1
+        elif isinstance(i, rlex.Keyword) and i.value == "end":
+            depth -= 1
+    return depth
+
+def format_ruby_error(e, tb):
+    stack = traceback.extract_tb(tb)
+    i = 0
+    while i < len(stack):
+        if stack[i].filename.endswith(".py"):
+            # i += 1
+            stack.pop(i)
+        else:
+            i += 1
+    if len(stack) == 0:
+        return "%s (%s)\n" % (str(e), type(e).__name__)
+    res = "%s:in `%s': %s (%s)\n" % (stack[-1].filename, stack[-1].name, str(e), type(e).__name__)
+    for s in stack[::-1]:
+        res += "        from %s:in `%s'\n" % (s.filename, s.name)
+    return res
+
+async def ruby_serve_session(reader, writer):
+    # One interactive session over an asyncio stream pair, suitable as a
+    # client_connected_cb for asyncio.start_server
+    stdio = AsyncFile(reader, writer)
+    session = RubySession.standard(stdio, stdio, CompileOptions(async_mode=True))
+
+    depth = 0
+    fcode = ""
+    try:
+        while 1:
+            writer.write(b"... " if depth > 0 else b">>> ")
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode().rstrip("\r\n")
+            try:
+                fcode += line + "\n"
+                depth += block_depth(rlex.lex(line))
+                if depth > 0:
+                    continue
+
+                depth = 0
+                code = session.compile(fcode)
+                fcode = ""
+                result = await session.run_async(code)
+                if result is not None:
+                    await stdio.puts(result)
+
+            except Exception as e:
+                # Any error in the client's code (many surface as plain Python
+                # ones: 1 + "a" is a TypeError) ends the input, not the session
+                depth = 0
+                fcode = ""
+                writer.write(format_ruby_error(e, e.__traceback__).encode())
+    finally:
+        writer.close()
 
 rcode = """
 def bruh(a, b, c)
@@ -505,79 +1086,54 @@ STDOUT.puts x + y * 10 - 6
 # print(code)
 # code = compile(code, "<compiled ruby code>", "exec")
 
-STDIN  = File(sys.stdin)
-STDOUT = File(sys.stdout)
-
-consts = {
-    "STDIN":  STDIN,
-    "STDOUT": STDOUT
-}
-rlocals = {
-    "puts": STDOUT.methods["puts"],
-    "gets": STDIN.methods["gets"],
-    "print": STDOUT.methods["print"]
-}
-rglobals = {
-    "stdout": STDOUT,
-    "stdin": STDIN
-}
-
-toks = rlex.lex(rcode)
-ast = rast.parse(toks)
-pcode = ruby_aspython(ast)
-bcode = compile(pcode, "<compiled ruby code>", "exec")
-ruby_exec(bcode, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
-
-depth = 0
-fcode = ""
-while 1:
-    try:
-        if depth > 0:
-            line = input("... ")
-        else:
-            line = input(">>> ")
-        fcode += line + "\n"
-        toks = rlex.lex(line)
-        for i in toks:
-            if isinstance(i, rlex.Keyword) and i.value == "then":
-                depth += 1
-            elif isinstance(i, rlex.Keyword) and i.value == "do":
-                depth += 1
-            elif isinstance(i, rlex.Keyword) and i.value == "def":
-                depth += 1
-            elif isinstance(i, rlex.Keyword) and i.value == "end":
-                depth -= 1
-        
-        if depth == 0:
-            toks = rlex.lex(fcode)
-            ast = rast.parse(toks)
-            c = ruby_aspython(ast)
-            print(c)
-            code = compile(c, "<compiled ruby code>", "exec")
-            
-            env = ruby_exec(code, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
-            if env[1]["result"] is not None:
-                print(env[1]["result"])
-            
-            consts.update(env[0]["rconsts"].v)
-            rglobals.update(env[0]["rglobals"].v)
-            rlocals.update(env[0]["rlocals"].stack[-1])
+async def _serve(host, port):
+    server = await asyncio.start_server(ruby_serve_session, host, port)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__" and len(sys.argv) > 2 and sys.argv[1] == "--serve":
+    host, _, port = sys.argv[2].rpartition(":")
+    asyncio.run(_serve(host or "127.0.0.1", int(port)))
+
+elif __name__ == "__main__":
+    consts, rlocals, rglobals = standard_env(STDIN, STDOUT)
+
+    toks = rlex.lex(rcode)
+    ast = rast.parse(toks)
+    pcode = ruby_aspython(ast)
+    bcode = compile(pcode, "<compiled ruby code>", "exec")
+    ruby_exec(bcode, constants=consts, rlocals_init=rlocals, rglobals=rglobals)
+    flush_all_files()
+
+    session = RubySession.standard(STDIN, STDOUT)
+    depth = 0
+    fcode = ""
+    while 1:
+        try:
+            if depth > 0:
+                line = input("... ")
+            else:
+                line = input(">>> ")
+            fcode += line + "\n"
+            toks = rlex.lex(line)
+            depth += block_depth(toks)
             
-            fcode = ""
+            if depth == 0:
+                c = session.translate(fcode)
+                print(c)
+                code = compile(c, "<compiled ruby code>", "exec")
+                
+                result = session.run(code)
+                flush_all_files()
+                if result is not None:
+                    print(result)
+                
+                fcode = ""
 
-    except RubyErrors.StandardError as e:
-        fcode = ""
-        
-        _, _, tb = sys.exc_info()
-        stack = traceback.extract_tb(tb)
-        i = 0
-        while i < len(stack):
-            if stack[i].filename.endswith(".py"):
-                # i += 1
-                stack.pop(i)
-            else:
-                i += 1
-        print("%s:in `%s': %s (%s)" % (stack[-1].filename, stack[-1].name, str(e), type(e).__name__), file=sys.stderr)
-        for s in stack[::-1]:
-            print("        from %s:in `%s'" % (s.filename, s.name), file=sys.stderr)
-        del tb, stack
+        except RubyErrors.StandardError as e:
+            fcode = ""
+            flush_all_files()
+            
+            _, _, tb = sys.exc_info()
+            print(format_ruby_error(e, tb), end="", file=sys.stderr)
+            del tb
@@ -1,6 +1,15 @@
 from __future__ import annotations
 
+import gc
+import os
+import re
+import mmap
+import array
+import bisect
+import itertools
+import collections
 import dataclasses
+import concurrent.futures
 from typing import *
 from dataclasses import dataclass
 
@@ -42,6 +51,12 @@ class Literal(Token):
 class Symbol(Token):
     value: str
 
+@dataclass(init=False, repr=False)
+class Interpolation(Token):
+    # A double-quoted string with #{...} in it. value alternates between the
+    # literal text (str) and the tokens of each interpolated expression (list).
+    value: list
+
 @dataclass(init=False, repr=False)
 class Operator(Token):
     value: str
@@ -61,12 +76,40 @@ class Keyword(Token):
 IDENT_START_A = "QWERTYUIOPASDFGHJKLZXCVBNMqwertyuiopasdfghjklzxcvbnm_"
 IDENT_A = "qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM_0123456789"
 WHITESPACE_A = " \t\r"
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "0": "\0", "e": "\x1b", "s": " "}
+SYMBOL_OPERATORS = {"+", "-", "*", "/", "<", ">", "==", "!=", "<=", ">=", "<<", "**", "[]", "[]="}
 
-def lex(code):
+def interpolation_end(code, i):
+    # The index of the } closing an interpolation whose code starts at i
+    depth = 0
+    while i < len(code):
+        if code[i] in "'\"":
+            quote = code[i]
+            i += 1
+            while i < len(code) and code[i] != quote:
+                i += 2 if code[i] == "\\" else 1
+        elif code[i] == "{":
+            depth += 1
+        elif code[i] == "}":
+            if depth == 0:
+                return i
+            depth -= 1
+        i += 1
+    raise ValueError("Unterminated string interpolation")
+
+def string_end(code, start, i, line, char, li):
+    # (line, char, li) after a string literal from start to i that may span
+    # lines
+    nl = code.rfind("\n", start, i)
+    if nl == -1:
+        return line, char, li
+    return line + code.count("\n", start, i), 1, nl + 1
+
+def lex(code, line=1):
+    # line: The line number code starts at
     toks = []
     i = 0
     li = 0
-    line = 1
     char = 1
     while i < len(code):
         if code[i] == "\n":
@@ -74,12 +117,21 @@ def lex(code):
             char = 1
             line += 1
             i += 1
+            li = i
             continue
         
         chars_left = len(code) - i
         # print(repr(code[i]), chars_left)
+        if chars_left >= 3:
+            if code[i:i+3] == "...":
+                toks.append(Operator(value=code[i:i+3], line=line, char=char))
+                i += 3
+                char += i - li
+                li = i
+                continue
+
         if chars_left >= 2:
-            if code[i:i+2] in {"==", "!=", "**"}:
+            if code[i:i+2] in {"==", "!=", "**", "<<", ".."}:
                 toks.append(Operator(value=code[i:i+2], line=line, char=char))
                 i += 2
                 char += i - li
@@ -88,7 +140,7 @@ def lex(code):
         
         if chars_left >= 1:
             # print("in")
-            if code[i:i+1] in {"+", "-", "*", "/", "(", ")", "=", "<", ">", ".", ","}:
+            if code[i:i+1] in {"+", "-", "*", "/", "(", ")", "[", "]", "{", "}", "|", "=", "<", ">", ".", ","}:
                 # print("in2", code[i:i+1])
                 toks.append(Operator(value=code[i:i+1], line=line, char=char))
                 # print(toks)
@@ -103,6 +155,10 @@ def lex(code):
             while i < len(code) and code[i] in IDENT_A:
                 x += code[i]
                 i += 1
+            # Method names may end in ? or ! (but "x != y" is a comparison)
+            if i < len(code) and code[i] in "?!" and code[i+1:i+2] != "=":
+                x += code[i]
+                i += 1
             
             if x in {"if", "then", "else", "end", "while", "do", "def"}:
                 toks.append(Keyword(value=x, line=line, char=char))
@@ -110,6 +166,7 @@ def lex(code):
                 toks.append(Name(value=x, line=line, char=char))
 
         elif code[i] == "'":
+            start = i
             i += 1
             x = ""
             while i < len(code) and code[i] != "'":
@@ -119,6 +176,55 @@ def lex(code):
                 i += 1
             toks.append(Literal(value=x, line=line, char=char))
             i += 1
+            line, char, li = string_end(code, start, i, line, char, li)
+
+        elif code[i] == '"':
+            start = i
+            i += 1
+            parts = []
+            x = ""
+            while i < len(code) and code[i] != '"':
+                if code[i] == "\\":
+                    i += 1
+                    x += ESCAPES.get(code[i], code[i])
+                    i += 1
+                elif code[i:i+2] == "#{":
+                    end = interpolation_end(code, i + 2)
+                    inner_line = line + code.count("\n", start, i)
+                    inner = lex(code[i+2:end], inner_line)[:-1]
+                    for t in inner:
+                        if t.line == inner_line:
+                            t.char += i + 2 - code.rfind("\n", 0, i + 2) - 1
+                    parts += [x, inner]
+                    x = ""
+                    i = end + 1
+                else:
+                    x += code[i]
+                    i += 1
+            i += 1
+            if len(parts) == 0:
+                toks.append(Literal(value=x, line=line, char=char))
+            else:
+                toks.append(Interpolation(value=parts + [x], line=line, char=char))
+            line, char, li = string_end(code, start, i, line, char, li)
+
+        elif code[i] == ":" and any(code[i+1:i+1+n] in SYMBOL_OPERATORS for n in (1, 2, 3)):
+            # Operator method names: :+, :==, :[]=, ...
+            n = max(n for n in (1, 2, 3) if code[i+1:i+1+n] in SYMBOL_OPERATORS)
+            toks.append(Symbol(value=code[i+1:i+1+n], line=line, char=char))
+            i += 1 + n
+
+        elif code[i] == ":" and chars_left >= 2 and code[i+1] in IDENT_START_A:
+            x = ""
+            i += 1
+            while i < len(code) and code[i] in IDENT_A:
+                x += code[i]
+                i += 1
+            if i < len(code) and code[i] in "?!=":
+                x += code[i]
+                i += 1
+
+            toks.append(Symbol(value=x, line=line, char=char))
 
         elif code[i] == "$":
             x = ""
@@ -135,6 +241,9 @@ def lex(code):
         elif code[i] in "0123456789.":
             x = ""
             while i < len(code) and code[i] in "0123456789.":
+                # A dot only belongs to the number if a digit follows: "3.times", "1..5"
+                if code[i] == "." and (i + 1 >= len(code) or code[i+1] not in "0123456789"):
+                    break
                 x += code[i]
                 i += 1
             toks.append(Literal(value=float(x) if '.' in x else int(x), line=line, char=char))
@@ -147,6 +256,444 @@ def lex(code):
 
     return toks + [Separator(line=line + 1, char=0)]
 
+# Parallel lexing: the source is cut into chunks at newlines outside of string
+# literals, which the lexer never carries state across, and each chunk is lexed
+# in a worker process starting at its own line number.
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", re.S)
+
+# Sources shorter than this are lexed in-process, where starting workers and
+# shipping tokens back would cost more than it saves
+PARALLEL_MIN_SIZE = 1 << 20
+
+def split_points(code, n):
+    # Up to n - 1 indices just past a newline that isn't inside a string
+    # literal, splitting code into roughly equal chunks
+    spans = [m.span() for m in STRING_LITERAL_RE.finditer(code)]
+    starts = [i[0] for i in spans]
+    res = []
+    for k in range(1, n):
+        i = code.find("\n", len(code) * k // n)
+        while i != -1:
+            j = bisect.bisect_right(starts, i) - 1
+            if j < 0 or spans[j][1] <= i:
+                break
+            i = code.find("\n", spans[j][1])
+        if i == -1:
+            break
+        if len(res) == 0 or i + 1 > res[-1]:
+            res.append(i + 1)
+    return res
+
+TOKEN_TYPES = (Separator, Literal, Symbol, Interpolation, Operator, Name, GlobalName, Keyword)
+TOKEN_TYPE_INDEX = {t: n for n, t in enumerate(TOKEN_TYPES)}
+
+def _lex_chunk(args):
+    # Tokens go back to the parent as columns of plain values, which unpickle
+    # several times faster than Token objects
+    toks = lex(*args)
+    return (
+        [TOKEN_TYPE_INDEX[type(t)] for t in toks],
+        [t.value for t in toks],
+        [t.line for t in toks],
+        [t.char for t in toks],
+    )
+
+def _unpack_tokens(packed, res):
+    new = object.__new__
+    for n, value, line, char in zip(*packed):
+        t = new(TOKEN_TYPES[n])
+        t.value = value
+        t.line = line
+        t.char = char
+        res.append(t)
+
+def lex_parallel(code, processes=None, min_size=PARALLEL_MIN_SIZE):
+    # Same tokens as lex(code), lexed in a pool of processes (default: one per
+    # core)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes < 2 or len(code) < min_size:
+        return lex(code)
+
+    bounds = [0] + split_points(code, processes) + [len(code)]
+    chunks = []
+    line = 1
+    for a, b in zip(bounds, bounds[1:]):
+        chunks.append((code[a:b], line))
+        line += code.count("\n", a, b)
+
+    toks = []
+    # Collections can't free anything while the tokens are being built, they'd
+    # only rescan them over and over
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            for packed in pool.map(_lex_chunk, chunks):
+                _unpack_tokens(packed, toks)
+                # Every chunk but the last ends with a newline whose Separator
+                # is there already: drop the end-of-input one
+                toks.pop()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    toks.append(Separator(line=line + 1, char=0))
+    return toks
+
+# Lexing bytes: a UTF-8 source held as bytes or an mmap is scanned with one
+# regex into one compact column, a byte per token holding its type and the
+# distance in bytes from the previous token, so a large file costs about a byte
+# per token rather than a Token object each. Values (and lines) are only decoded when the
+# parser asks for them.
+
+TOKEN_RE = re.compile(rb"""
+    (\n)
+  | ([ \t\r]+)
+  | (\.\.\.|==|!=|\*\*|<<|\.\.|[-+*/()\[\]{}|=<>.,])
+  | ([A-Za-z_][A-Za-z0-9_]*(?:[?!](?!=))?)
+  | ([0-9](?:[0-9]|\.(?=[0-9]))*)
+  | ('(?:[^'\\]|\\.)*'?)
+  | (")
+  | (:(?:\[\]=|\[\]|==|!=|<=|>=|<<|\*\*|[-+*/<>]))
+  | (:[A-Za-z_][A-Za-z0-9_]*[?!=]?)
+  | (\$[A-Za-z0-9_]*)
+""", re.X | re.S)
+
+(_NEWLINE, _SPACE, _OPERATOR, _NAME, _NUMBER, _SQUOTE, _DQUOTE, _OPERATOR_SYMBOL,
+    _SYMBOL, _GLOBAL) = range(1, 11)
+
+KEYWORDS = {b"if", b"then", b"else", b"end", b"while", b"do", b"def"}
+
+# Every CHECKPOINT_EVERY tokens the absolute offset is kept, so finding a
+# token's offset only sums the deltas since the last checkpoint
+CHECKPOINT_EVERY = 64
+# The type takes the low TYPE_BITS of a token's byte and the delta the rest.
+# Deltas that don't fit are stored as BIG_DELTA and looked up in
+# TokenStream.big_deltas.
+TYPE_BITS = 3
+TYPE_MASK = (1 << TYPE_BITS) - 1
+BIG_DELTA = 0xff >> TYPE_BITS
+
+def bytes_string_end(data, i):
+    # The index just past the " closing a double-quoted string whose text
+    # starts at i
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x22:
+            return i + 1
+        if c == 0x5c:
+            i += 2
+        elif c == 0x23 and data[i+1:i+2] == b"{":
+            depth = 0
+            i += 2
+            while i < n:
+                c = data[i]
+                if c in (0x22, 0x27):
+                    i += 1
+                    while i < n and data[i] != c:
+                        i += 2 if data[i] == 0x5c else 1
+                elif c == 0x7b:
+                    depth += 1
+                elif c == 0x7d:
+                    if depth == 0:
+                        break
+                    depth -= 1
+                i += 1
+            else:
+                raise ValueError("Unterminated string interpolation")
+            i += 1
+        else:
+            i += 1
+    return n
+
+class LazyToken():
+    # Base of the token types a TokenStream hands out: a token knows its
+    # stream and byte offset, and decodes value, line and char on first use
+
+    def __init__(self, stream, offset):
+        self.stream = stream
+        self.offset = offset
+
+    def _get_value(self):
+        if "_value" not in self.__dict__:
+            self._value = self.stream.decode(self)
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+
+    def _get_line(self):
+        if "_line" not in self.__dict__:
+            self._line, self._char = self.stream.position(self.offset)
+        return self._line
+
+    def _set_line(self, line):
+        self._line = line
+
+    def _get_char(self):
+        if "_char" not in self.__dict__:
+            self._line, self._char = self.stream.position(self.offset)
+        return self._char
+
+    def _set_char(self, char):
+        self._char = char
+
+    value = property(_get_value, _set_value)
+    line = property(_get_line, _set_line)
+    char = property(_get_char, _set_char)
+
+    def plain(self):
+        # The token as the ordinary Token type it stands for
+        return _unpack_token(TOKEN_TYPE_INDEX[type(self)], self.value, self.line, self.char)
+
+    def __repr__(self):
+        return repr(self.plain())
+
+    def __reduce__(self):
+        # Pickles (and copies) without the stream and the data behind it
+        return (_unpack_token, (TOKEN_TYPE_INDEX[type(self)], self.value, self.line, self.char))
+
+def _unpack_token(n, value, line, char):
+    t = object.__new__(TOKEN_TYPES[n])
+    t.value = value
+    t.line = line
+    t.char = char
+    return t
+
+LAZY_TOKEN_TYPES = tuple(type("Lazy" + t.__name__, (LazyToken, t), {"__init__": LazyToken.__init__}) for t in TOKEN_TYPES)
+# Lazy tokens serialize as the token type they stand for
+TOKEN_TYPE_INDEX.update({t: n for n, t in enumerate(LAZY_TOKEN_TYPES)})
+
+class TokenStream():
+    # The tokens of data (bytes or an mmap), the same ones lex() would give
+    # for the decoded text, except that char is a column in bytes and the
+    # final Separator sits at the end of the data
+
+    def __init__(self, data, packed, checkpoints, big_deltas):
+        self.data = data
+        self.packed = packed
+        self.checkpoints = checkpoints
+        self.big_deltas = big_deltas
+        self.newlines = None
+
+    def __len__(self):
+        return len(self.packed)
+
+    def offset(self, n):
+        # The byte offset token n starts at
+        k = n - n % CHECKPOINT_EVERY
+        offset = self.checkpoints[k // CHECKPOINT_EVERY]
+        packed = self.packed
+        for i in range(k + 1, n + 1):
+            d = packed[i] >> TYPE_BITS
+            offset += self.big_deltas[i] if d == BIG_DELTA else d
+        return offset
+
+    def token(self, n, offset=None):
+        if offset is None:
+            offset = self.offset(n)
+        return LAZY_TOKEN_TYPES[self.packed[n] & TYPE_MASK](self, offset)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("token index out of range")
+        return self.token(n)
+
+    def __iter__(self):
+        big_deltas = self.big_deltas
+        offset = 0
+        for n, p in enumerate(self.packed):
+            d = p >> TYPE_BITS
+            offset += big_deltas[n] if d == BIG_DELTA else d
+            yield LAZY_TOKEN_TYPES[p & TYPE_MASK](self, offset)
+
+    def tokens(self):
+        # A list of the (lazy) tokens
+        return list(self)
+
+    def cursor(self):
+        # What rast.parse reads a stream through (see TokenCursor)
+        return TokenCursor(self)
+
+    def end(self, tok):
+        # The offset just past tok's text
+        data = self.data
+        if tok.offset >= len(data):
+            return tok.offset
+        if data[tok.offset] == 0x22:
+            return bytes_string_end(data, tok.offset + 1)
+        return TOKEN_RE.match(data, tok.offset).end()
+
+    def decode(self, tok):
+        if isinstance(tok, Separator):
+            return None
+        text = self.data[tok.offset:self.end(tok)].decode("utf-8")
+        if isinstance(tok, (Literal, Interpolation)):
+            if text[0] not in "'\"":
+                return float(text) if "." in text else int(text)
+            # Strings are rare enough to go through lex() for their escapes
+            # and interpolated code
+            return lex(text, self.position(tok.offset)[0])[0].value
+        if isinstance(tok, (Symbol, GlobalName)):
+            return text[1:]
+        return text
+
+    def position(self, offset):
+        # (line, char) of a byte offset, char counted in bytes. The newline
+        # index is only built the first time a position is needed.
+        if self.newlines is None:
+            self.newlines = array.array("q", (m.start() for m in re.finditer(rb"\n", self.data)))
+        line = bisect.bisect_left(self.newlines, offset)
+        line_start = self.newlines[line - 1] + 1 if line > 0 else 0
+        return line + 1, offset - line_start + 1
+
+class TokenCursor():
+    # The tokens of a TokenStream not yet consumed, behind the few list
+    # operations the parser uses (toks[0], toks.pop(0), toks.insert(0, tok),
+    # toks[:n], del toks[:n]). Tokens are only made when the parser reaches
+    # them, so the ones it drops (separators, brackets, operators) are freed
+    # straight away instead of all being held in a list until parsing ends,
+    # and consuming one is O(1) where list.pop(0) moves the rest of the list.
+
+    def __init__(self, stream):
+        self.stream = stream
+        # Tokens made but not yet consumed, then tokens n on in the stream;
+        # offset is token n - 1's
+        self.front = collections.deque()
+        self.n = 0
+        self.offset = 0
+
+    def _fill(self, k):
+        # Makes at least the first k tokens (if there are that many)
+        front = self.front
+        stream = self.stream
+        packed = stream.packed
+        while len(front) < k and self.n < len(packed):
+            d = packed[self.n] >> TYPE_BITS
+            self.offset += stream.big_deltas[self.n] if d == BIG_DELTA else d
+            front.append(stream.token(self.n, self.offset))
+            self.n += 1
+
+    def __len__(self):
+        return len(self.front) + len(self.stream.packed) - self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            self._fill(stop)
+            return list(itertools.islice(self.front, start, stop, step))
+        if i < 0:
+            i += len(self)
+        self._fill(i + 1)
+        if not 0 <= i < len(self.front):
+            raise IndexError("token index out of range")
+        return self.front[i]
+
+    def __delitem__(self, i):
+        if not isinstance(i, slice):
+            i = slice(i, i + 1) if i >= 0 else slice(i + len(self), i + len(self) + 1)
+        indices = range(*i.indices(len(self)))
+        if len(indices) > 0:
+            self._fill(max(indices) + 1)
+        for k in sorted(indices, reverse=True):
+            del self.front[k]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            self._fill(i + 1)
+            if i >= len(self.front):
+                return
+            yield self.front[i]
+            i += 1
+
+    def pop(self, i=0):
+        tok = self[i]
+        del self[i]
+        return tok
+
+    def insert(self, i, tok):
+        self._fill(i)
+        self.front.insert(i, tok)
+
+    def copy(self):
+        res = TokenCursor(self.stream)
+        res.front = collections.deque(self.front)
+        res.n = self.n
+        res.offset = self.offset
+        return res
+
+def lex_bytes(data):
+    # A TokenStream over data, which must stay alive (and unchanged) while its
+    # tokens are in use
+    packed = bytearray()
+    checkpoints = array.array("q")
+    big_deltas = {}
+    match = TOKEN_RE.match
+    n = len(data)
+    count = 0
+    prev = 0
+    i = 0
+    while i < n:
+        m = match(data, i)
+        if m is None:
+            line, char = TokenStream(data, packed, checkpoints, big_deltas).position(i)
+            raise ValueError("(line: %d, char: %d) Unexpected character '%s'" % (line, char, data[i:i+4].decode("utf-8", "replace")[0]))
+        kind = m.lastindex
+        end = m.end()
+        if kind == _SPACE:
+            i = end
+            continue
+        if kind == _NEWLINE:
+            t = 0
+        elif kind == _OPERATOR:
+            t = 4
+        elif kind == _NAME:
+            t = 7 if data[i:end] in KEYWORDS else 5
+        elif kind == _NUMBER or kind == _SQUOTE:
+            t = 1
+        elif kind == _DQUOTE:
+            end = bytes_string_end(data, end)
+            t = 3 if data.find(b"#{", i, end) != -1 else 1
+        elif kind == _GLOBAL:
+            t = 6
+        else:
+            t = 2
+        d = i - prev
+        if count % CHECKPOINT_EVERY == 0:
+            checkpoints.append(i)
+        if d >= BIG_DELTA:
+            big_deltas[count] = d
+            d = BIG_DELTA
+        packed.append(t | d << TYPE_BITS)
+        count += 1
+        prev = i
+        i = end
+
+    # The end-of-input Separator
+    d = n - prev
+    if count % CHECKPOINT_EVERY == 0:
+        checkpoints.append(n)
+    if d >= BIG_DELTA:
+        big_deltas[count] = d
+        d = BIG_DELTA
+    packed.append(d << TYPE_BITS)
+    return TokenStream(data, packed, checkpoints, big_deltas)
+
+def lex_file(path):
+    # lex_bytes over the file mapped into memory: only the pages being
+    # scanned are resident, and they can be dropped again under pressure
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return lex_bytes(b"")
+        return lex_bytes(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
 if __name__ == "__main__":
     code = r"""
 print 'What\'s your name? '
@@ -0,0 +1,124 @@
+import sys
+import threading
+import collections
+import rlex, rast, rcomp
+
+COMPILED_FILENAME = "<compiled ruby code>"
+
+class Profiler():
+    # Sampling profiler for programs compiled with line_markers=True. A background
+    # thread looks at the profiled thread's stack every `interval` seconds and
+    # records the Ruby (method, line) frames on it.
+
+    def __init__(self, pcode, interval=0.001, filename=COMPILED_FILENAME):
+        self.lines, self.methods = rcomp.line_map(pcode)
+        self.interval = interval
+        self.filename = filename
+        self.samples = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            if frame.f_code.co_filename == self.filename:
+                stack.append((
+                    self.methods.get(frame.f_code.co_firstlineno, "<main>"),
+                    self.lines.get(frame.f_lineno)
+                ))
+            frame = frame.f_back
+        return tuple(stack[::-1])
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = self._stack(frame)
+            if len(stack) > 0:
+                self.samples[stack] += 1
+
+    def start(self):
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(), ), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def line_counts(self):
+        # Samples whose innermost frame is at a given (method, line)
+        res = collections.Counter()
+        for stack, n in self.samples.items():
+            res[stack[-1]] += n
+        return res
+
+    def method_counts(self):
+        # (self samples, total samples) per method
+        res = collections.defaultdict(lambda: [0, 0])
+        for stack, n in self.samples.items():
+            res[stack[-1][0]][0] += n
+            for name in {i[0] for i in stack}:
+                res[name][1] += n
+        return res
+
+    def report(self, source=None):
+        total = sum(self.samples.values())
+        if total == 0:
+            return "No samples collected\n"
+        src_lines = source.split("\n") if source is not None else []
+
+        res = "%d samples, %.1f ms interval\n\n" % (total, self.interval * 1000)
+        res += "%7s %6s  %-20s %5s  %s\n" % ("samples", "%", "method", "line", "source")
+        for (method, line), n in self.line_counts().most_common():
+            text = src_lines[line - 1].strip() if line is not None and line <= len(src_lines) else ""
+            res += "%7d %5.1f%%  %-20s %5s  %s\n" % (n, 100 * n / total, method, line, text)
+
+        res += "\n%7s %7s  %s\n" % ("self", "total", "method")
+        for method, (s, t) in sorted(self.method_counts().items(), key=lambda i: -i[1][1]):
+            res += "%6.1f%% %6.1f%%  %s\n" % (100 * s / total, 100 * t / total, method)
+        return res
+
+    def collapsed(self):
+        # Brendan Gregg's collapsed stack format, as read by flamegraph.pl / speedscope
+        res = ""
+        for stack, n in sorted(self.samples.items()):
+            res += "%s %d\n" % (";".join("%s:%s" % i for i in stack), n)
+        return res
+
+def profile(source, interval=0.001, constants=None, rglobals=None, rlocals_init=None):
+    pcode = rcomp.ruby_aspython(rast.parse(rlex.lex(source)), options=rcomp.CompileOptions(line_markers=True))
+    code = compile(pcode, COMPILED_FILENAME, "exec")
+    profiler = Profiler(pcode, interval)
+    with profiler:
+        rcomp.ruby_exec(code, constants=constants, rglobals=rglobals, rlocals_init=rlocals_init)
+    rcomp.flush_all_files()
+    return profiler
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile a Ruby program per source line")
+    parser.add_argument("file")
+    parser.add_argument("--interval", type=float, default=1.0, help="sampling interval in ms")
+    parser.add_argument("--collapsed", help="write collapsed stacks for flamegraph tools to this file")
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        source = f.read()
+    consts, rlocals, rglobals = rcomp.standard_env(rcomp.STDIN, rcomp.STDOUT)
+    profiler = profile(source, args.interval / 1000, constants=consts, rglobals=rglobals, rlocals_init=rlocals)
+
+    print(profiler.report(source), file=sys.stderr)
+    if args.collapsed is not None:
+        with open(args.collapsed, "w") as f:
+            f.write(profiler.collapsed())
@@ -0,0 +1,1811 @@
+# The runtime that compiled Ruby code runs against: the object model, the
+# environment (locals, globals, constants) and ruby_exec. It doesn't need the
+# lexer, parser or compiler, so modules compiled ahead of time (see raot)
+# import only this.
+
+import sys
+import time
+import atexit
+import inspect
+import weakref
+import warnings
+import threading
+import contextlib
+import contextvars
+import array
+import operator
+import functools
+import itertools
+import collections
+from types import GeneratorType
+from functools import partial
+
+# numpy takes about as long to import as the rest of the runtime, so it's only
+# imported by the first vectorised Array operation (see _load_numpy): False
+# until then, None if it isn't installed
+numpy = False
+
+def _load_numpy():
+    global numpy
+    if numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+class RubyErrors:
+    
+    class StandardError(Exception):
+        pass
+
+    class NameError(StandardError):
+        pass
+
+    class NoMethodError(StandardError):
+        pass
+
+    class ArgumentError(StandardError):
+        pass
+
+    class IndexError(StandardError):
+        pass
+
+    class TypeError(StandardError):
+        pass
+
+    class LocalJumpError(StandardError):
+        pass
+
+    class LoadError(StandardError):
+        pass
+
+    class BudgetExceeded(StandardError):
+        # Raised when a RubyBudget runs out; kind is "steps", "time" or
+        # "allocations"
+        def __init__(self, kind, message):
+            super().__init__(message)
+            self.kind = kind
+
+class RubyWarning(UserWarning):
+    pass
+
+class Locals():
+    
+    def __init__(self):
+        self.stack = [{}]
+        # Per frame: is it a block's? Blocks see and assign their enclosing
+        # scope's variables instead of shadowing them.
+        self.blocks = [False]
+
+    def push(self, block=False):
+        self.stack.append({})
+        self.blocks.append(block)
+
+    def pop(self):
+        self.stack.pop()
+        self.blocks.pop()
+
+    def update(self, d):
+        if d is None:
+            return
+        self.stack[-1].update(d)
+
+    def __getitem__(self, x):
+        def _wrap(y):
+            nonlocal x, self
+            self[x[:-1]] = y
+        
+        if x.endswith("="):
+            return _wrap
+        
+        for i in reversed(self.stack):
+            if x in i:
+                return i[x]
+        
+        raise RubyErrors.NameError("undefined local variable or method `%s'" % (x, ))
+
+    def __setitem__(self, x, y):
+        if not callable(y):
+            y = _variable(y)
+        frame = self.stack[-1]
+        if self.blocks[-1] and x not in frame:
+            n = len(self.stack) - 1
+            while n > 0 and self.blocks[n]:
+                n -= 1
+                if x in self.stack[n]:
+                    frame = self.stack[n]
+                    break
+        frame[x] = y
+
+    def method(self, x):
+        # x as a method call sees it: in the current method's frame (and its
+        # blocks'), else at the top level. Unlike __getitem__ it skips the
+        # frames of the methods that called this one, so a lookup doesn't cost
+        # more the deeper the recursion (see rcomp's trampoline option).
+        stack = self.stack
+        n = len(stack) - 1
+        while n > 0:
+            if x in stack[n]:
+                return stack[n][x]
+            if not self.blocks[n]:
+                break
+            n -= 1
+        if x in stack[0]:
+            return stack[0][x]
+        raise RubyErrors.NameError("undefined local variable or method `%s'" % (x, ))
+
+    def define(self, x, y):
+        # Sets x in the innermost frame even in a block (block parameters)
+        self.stack[-1][x] = _variable(y)
+
+    def value(self, x, default=None):
+        # The value of local variable x, or default if x is unset or names a method
+        for i in reversed(self.stack):
+            if x in i:
+                if getattr(i[x], "__code__", None) is _VARIABLE_CODE:
+                    return i[x]()
+                return default
+        return default
+
+def _variable(y):
+    def _wrap():
+        return y
+    return _wrap
+
+_VARIABLE_CODE = _variable(None).__code__
+
+class Methods():
+
+    def __init__(self, parent, v=None):
+        self.parent = parent
+        self.v = v
+        if self.v is None:
+            self.v = {}
+
+    def __getitem__(self, x):
+        try:
+            return self.v[x]
+        except KeyError:
+            fn = COMMON_METHODS.get(x)
+            if fn is not None:
+                return partial(fn, self.parent)
+            raise RubyErrors.NoMethodError("undefined method `%s' for %s" % (x, self.parent.__name__)) from None
+
+    def __setitem__(self, x, y):
+        self.v[x] = y
+
+class SlotLayout():
+    # Assigns names (of globals, of constants) indices in a flat list. The
+    # compiler emits the indices, so there's one layout per process, shared by
+    # every environment; it only grows.
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+
+    def slot(self, name):
+        n = self.index.get(name)
+        if n is None:
+            n = self.index[name] = len(self.names)
+            self.names.append(name)
+        return n
+
+GLOBAL_SLOTS = SlotLayout()
+CONSTANT_SLOTS = SlotLayout()
+
+# The value of a constant slot that was never assigned
+UNSET = object()
+
+class Constants():
+    # Values are kept in slots, indexed by CONSTANT_SLOTS. Compiled code reads
+    # rcslots[n] directly and assigns through assign(n, value); names are for
+    # dynamic access. version counts reassignments, so anything caching a
+    # constant's value can tell when it may be stale.
+
+    def __init__(self, v):
+        self.slots = []
+        self.version = 0
+        for x, y in (v or {}).items():
+            n = CONSTANT_SLOTS.slot(x)
+            self.slots_for(n)[n] = y
+        self.slots_for(0)
+
+    def slots_for(self, n):
+        # self.slots, grown to hold slot n (or every slot assigned so far)
+        if len(self.slots) <= n or len(self.slots) < len(CONSTANT_SLOTS.names):
+            self.slots.extend([UNSET] * (max(n + 1, len(CONSTANT_SLOTS.names)) - len(self.slots)))
+        return self.slots
+
+    def __getitem__(self, x):
+        if x.endswith("="):
+            return partial(self.__setitem__, x[:-1])
+
+        n = CONSTANT_SLOTS.index.get(x)
+        if n is not None and n < len(self.slots) and self.slots[n] is not UNSET:
+            return self.slots[n]
+        
+        raise RubyErrors.NameError("Uninitialized constant %s" % x)
+
+    def __setitem__(self, x, y):
+        self.assign(CONSTANT_SLOTS.slot(x), y)
+
+    def assign(self, n, y):
+        slots = self.slots_for(n)
+        if slots[n] is not UNSET:
+            warnings.warn(RubyWarning("already initialized constant %s" % CONSTANT_SLOTS.names[n]))
+            self.version += 1
+        slots[n] = y
+        return y
+
+    def missing(self, n):
+        raise RubyErrors.NameError("Uninitialized constant %s" % CONSTANT_SLOTS.names[n])
+
+    @property
+    def v(self):
+        return {CONSTANT_SLOTS.names[n]: y for n, y in enumerate(self.slots) if y is not UNSET}
+
+class Globals():
+    # Values are kept in slots indexed by GLOBAL_SLOTS (unset globals are nil);
+    # compiled code indexes rgslots[n] directly, names are for dynamic access
+
+    def __init__(self, v):
+        self.slots = []
+        for x, y in (v or {}).items():
+            self[x] = y
+        self.slots_for(0)
+
+    def slots_for(self, n):
+        if len(self.slots) <= n or len(self.slots) < len(GLOBAL_SLOTS.names):
+            self.slots.extend([None] * (max(n + 1, len(GLOBAL_SLOTS.names)) - len(self.slots)))
+        return self.slots
+
+    def __getitem__(self, x):
+        n = GLOBAL_SLOTS.index.get(x)
+        if n is None or n >= len(self.slots):
+            return None
+        return self.slots[n]
+
+    def __setitem__(self, x, y):
+        n = GLOBAL_SLOTS.slot(x)
+        self.slots_for(n)[n] = y
+
+    @property
+    def v(self):
+        return {GLOBAL_SLOTS.names[n]: y for n, y in enumerate(self.slots) if y is not None}
+
+# The RubyBudget that Object.__init__ charges objects to, while code runs under
+# one with an allocation quota (see _charging_allocations). Per thread and
+# asyncio task, so concurrent sessions each count their own.
+ALLOCATION_BUDGET = contextvars.ContextVar("ALLOCATION_BUDGET", default=None)
+
+class Object():
+
+    def __init__(self, *args):
+        budget = ALLOCATION_BUDGET.get()
+        if budget is not None:
+            budget.allocations += 1
+        self.__name__ = "Object"
+        self.methods = Methods(self, {
+            "initialize": self.initialize,
+            "to_s": self.to_s,
+            "==": partial(object.__eq__, self),
+            "!=": partial(object.__ne__, self)
+        })
+        self.ivars = {}
+        return self.methods["initialize"](*args)
+    
+    def __add__(self, other):
+        return self.methods["+"](other)
+    def __sub__(self, other):
+        return self.methods["-"](other)
+    def __mul__(self, other):
+        return self.methods["*"](other)
+    def __truediv__(self, other):
+        return self.methods["/"](other)
+    def __lshift__(self, other):
+        return self.methods["<<"](other)
+
+    def __gt__(self, other):
+        return self.methods[">"](other)
+    def __lt__(self, other):
+        return self.methods["<"](other)
+    def __ge__(self, other):
+        return self.methods[">="](other)
+    def __le__(self, other):
+        return self.methods["<="](other)
+    def __eq__(self, other):
+        return self.methods["=="](other)
+    def __ne__(self, other):
+        return not self.methods["=="](other)
+
+    def __repr__(self):
+        return self.methods["to_s"]().s
+
+    def to_s(self):
+        return String("#<%s:0x%08x>" % (self.__name__, id(self)))
+
+    def __str__(self):
+        return self.methods["to_s"]().s
+
+class Integer(Object):
+    # Integers are never changed once made, so small ones are shared: box(v)
+    # returns the one Integer for v in SMALL_MIN..SMALL_MAX (SMALL), and
+    # otherwise reuses a dead temporary from FREE (see arith) before making a
+    # new one. The runtime makes its Integers with box; Integer(v) always
+    # makes a new one.
+
+    SMALL_MIN = -5
+    SMALL_MAX = 1024
+    FREE = []
+
+    @staticmethod
+    def box(v):
+        if Integer.SMALL_MIN <= v <= Integer.SMALL_MAX:
+            return Integer.SMALL[v - Integer.SMALL_MIN]
+        if Integer.FREE:
+            res = Integer.FREE.pop()
+            res.int = v
+            return res
+        return Integer(v)
+
+    def initialize(self, *args):
+        self.int = int(args[0])
+        
+        self.methods["+"] = lambda other: Integer.box(self.int + int(other))
+        self.methods["-"] = lambda other: Integer.box(self.int - int(other))
+        self.methods["*"] = lambda other: Integer.box(self.int * int(other))
+        self.methods["/"] = lambda other: Integer.box(int(self.int / int(other)))
+
+        self.methods["=="] = lambda other: self.int == other.int
+        self.methods["!="] = lambda other: self.int != other.int
+        self.methods[">"]  = lambda other: self.int > other.int
+        self.methods["<"]  = lambda other: self.int < other.int
+        self.methods[">="] = lambda other: self.int >= other.int
+        self.methods["<="] = lambda other: self.int <= other.int
+        self.methods["times"] = self.times
+        
+        self.__name__ = "Integer"
+
+    def times(self, block=None):
+        if block is None:
+            return Lazy(lambda: map(Integer.box, range(self.int)))
+        for i in range(self.int):
+            block(Integer.box(i))
+        return self
+
+    def to_s(self):
+        return String(self.int)
+
+    def __int__(self):
+        return self.int
+
+    def __float__(self):
+        return float(self.int)
+
+    def __hash__(self):
+        return hash(self.int)
+
+Integer.SMALL = [Integer(i) for i in range(Integer.SMALL_MIN, Integer.SMALL_MAX + 1)]
+
+class String(Object):
+    # The text is the first n entries of a list of chunks, joined into one the
+    # first time it's read (s). Appending adds a chunk, so building a string
+    # piece by piece is linear. a + b shares a's list and appends b's text to
+    # it: a still only sees its first n chunks, and whichever of them appends
+    # when the list has grown past its n copies its chunks first. Materialising
+    # or folding replaces the list instead of changing it, so strings sharing
+    # it are unaffected.
+
+    # Runs of this many appended chunks are joined into one, so memory stays
+    # proportional to the text instead of to the number of appends
+    FOLD = 4096
+
+    def initialize(self, *args):
+        self.chunks = [str(args[0])]
+        self.n = 1
+        # Chunks before this index are already folded
+        self.folded = 1
+
+        self.methods["=="] = lambda other: self.s == other.s
+        self.methods["!="] = lambda other: self.s != other.s
+        self.methods["+"] = self.plus
+        self.methods["*"] = self.times
+        self.methods["<<"] = self.append
+        self.methods["concat"] = self.append
+        self.methods["size"] = self.size
+        self.methods["length"] = self.size
+        self.methods["to_sym"] = lambda: Symbol.intern(self.s)
+
+    @property
+    def s(self):
+        if self.n != 1:
+            self.chunks = ["".join(self.chunks[:self.n])]
+            self.n = self.folded = 1
+        return self.chunks[0]
+
+    @s.setter
+    def s(self, v):
+        self.chunks = [v]
+        self.n = self.folded = 1
+
+    def add_text(self, text):
+        if len(self.chunks) != self.n:
+            self.chunks = self.chunks[:self.n]
+        self.chunks.append(text)
+        self.n += 1
+        if self.n - self.folded >= self.FOLD:
+            self.chunks = self.chunks[:self.folded] + ["".join(self.chunks[self.folded:])]
+            self.n = self.folded = self.folded + 1
+
+    def plus(self, other):
+        if type(other) is not String:
+            raise RubyErrors.TypeError("no implicit conversion of %s into String" % other.__name__)
+        res = String("")
+        res.chunks, res.n, res.folded = self.chunks, self.n, self.folded
+        res.add_text(other.s)
+        return res
+
+    def append(self, other):
+        if type(other) is Integer:
+            self.add_text(chr(other.int))
+        elif type(other) is String:
+            self.add_text(other.s)
+        else:
+            raise RubyErrors.TypeError("no implicit conversion of %s into String" % other.__name__)
+        return self
+
+    def times(self, n):
+        return String(self.s * int(n))
+
+    def size(self):
+        return Integer(len(self.s))
+
+    def __hash__(self):
+        return hash(self.s)
+
+    @classmethod
+    def interpolate(cls, *parts):
+        # "a#{b}c": the str parts are literal text, the others are converted
+        # with to_s
+        res = String("")
+        res.chunks = [i if type(i) is str else rstr(i) for i in parts]
+        res.n = len(res.chunks)
+        return res
+
+    def to_s(self):
+        return self
+    
+    def __repr__(self):
+        return self.s
+
+    def __str__(self):
+        return self.s
+
+class Float(Object):
+    # Like Integer, but without shared values: box(v) reuses a dead temporary
+    # from FREE before making a new Float
+
+    FREE = []
+
+    @staticmethod
+    def box(v):
+        if Float.FREE:
+            res = Float.FREE.pop()
+            res.float = v
+            return res
+        return Float(v)
+
+    def initialize(self, *args):
+        try:
+            self.float = float(args[0])
+        except TypeError:
+            self.float = float(int(args[0]))
+        
+        self.methods["+"] = lambda other: Float.box(self.float + float(other))
+        self.methods["-"] = lambda other: Float.box(self.float - float(other))
+        self.methods["*"] = lambda other: Float.box(self.float * float(other))
+        self.methods["/"] = lambda other: Float.box(self.float / float(other))
+
+        self.methods["=="] = lambda other: self.float == other.float
+        self.methods["!="] = lambda other: self.float != other.float
+        self.methods[">"]  = lambda other: self.float > other.float
+        self.methods["<"]  = lambda other: self.float < other.float
+        self.methods[">="] = lambda other: self.float >= other.float
+        self.methods["<="] = lambda other: self.float <= other.float
+        
+        self.__name__ = "Float"
+
+    def to_s(self):
+        return String(self.float)
+
+    def __int__(self):
+        return int(self.float)
+    
+    def __float__(self):
+        return self.float
+
+    def __str__(self):
+        return str(self.float)
+
+    def __hash__(self):
+        return hash(self.float)
+
+class Symbol(Object):
+    # There's one Symbol per name (see intern), so symbols compare and hash by
+    # identity. name is a sys.intern'ed str: it's the very object used as the
+    # key in methods tables, so dispatching on a symbol finds its entry on the
+    # identity fast path with the str's cached hash, never comparing characters.
+
+    table = {}
+
+    @classmethod
+    def intern(cls, name):
+        try:
+            return cls.table[name]
+        except KeyError:
+            res = cls.table[name] = cls(sys.intern(name))
+            return res
+
+    def initialize(self, *args):
+        self.name = args[0]
+
+        self.methods["=="] = lambda other: other is self
+        self.methods["!="] = lambda other: other is not self
+        self.methods["to_sym"] = lambda: self
+
+        self.__name__ = "Symbol"
+
+    __hash__ = object.__hash__
+
+    def __eq__(self, other):
+        return other is self
+
+    def __ne__(self, other):
+        return other is not self
+
+    def to_s(self):
+        return String(self.name)
+
+class Class(Object):
+    # A builtin class as a Ruby value, e.g. the Array constant; args are the
+    # class name and the function implementing new
+
+    def initialize(self, *args):
+        self.name = args[0]
+        self.methods["new"] = args[1]
+        self.__name__ = "Class"
+
+    def to_s(self):
+        return String(self.name)
+
+OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge
+}
+COMPARISON_OPS = {"<", ">", "<=", ">=", "==", "!="}
+
+# In an arithmetic chain (x + y * 10 - 6) every intermediate result dies as
+# soon as the next operation has read it. rcomp compiles an operation on such
+# a temporary to rarith(op, a, b, temps), temps telling which of a (1) and b
+# (2) are temporaries: once the operation is done, the Integer / Float ones go
+# on their class's FREE list for box() to reuse. Integer / Float arithmetic
+# never keeps its operands, and nothing else can have seen a temporary.
+
+FREE_LIST_SIZE = 1024
+
+def _recycle(v):
+    cls = v.__class__
+    if cls is Integer:
+        # Small values may be the shared ones
+        if not Integer.SMALL_MIN <= v.int <= Integer.SMALL_MAX and len(Integer.FREE) < FREE_LIST_SIZE:
+            Integer.FREE.append(v)
+    elif cls is Float and len(Float.FREE) < FREE_LIST_SIZE:
+        Float.FREE.append(v)
+
+def arith(op, a, b, temps):
+    res = OPERATORS[op](a, b)
+    if temps & 1:
+        _recycle(a)
+    if temps & 2:
+        _recycle(b)
+    return res
+
+def _array_storage(items):
+    # An array.array of machine integers ("q") or doubles ("d") for contents
+    # that are all Integer (and fit) or all Float, a list of objects otherwise
+    if numpy and isinstance(items, numpy.ndarray):
+        # One copy, straight into the array.array's buffer
+        if items.dtype.kind == "i":
+            res = array.array("q")
+            res.frombytes(memoryview(numpy.ascontiguousarray(items, dtype=numpy.int64)).cast("B"))
+            return res
+        if items.dtype.kind == "f":
+            res = array.array("d")
+            res.frombytes(memoryview(numpy.ascontiguousarray(items, dtype=numpy.float64)).cast("B"))
+            return res
+        return items.tolist()
+    if isinstance(items, array.array):
+        return items
+    if len(items) > 0 and type(items[0]) in (Integer, Float):
+        t = type(items[0])
+        if all(type(i) is t for i in items):
+            try:
+                if t is Integer:
+                    return array.array("q", [i.int for i in items])
+                return array.array("d", [i.float for i in items])
+            except OverflowError:
+                pass
+    return list(items)
+
+def _box(v):
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, int):
+        return Integer.box(v)
+    if isinstance(v, float):
+        return Float.box(v)
+    return v
+
+def _unbox(v, typecode):
+    # v as an element of an array.array with the given typecode, or None
+    if typecode == "q" and type(v) is Integer and -2 ** 63 <= v.int < 2 ** 63:
+        return v.int
+    if typecode == "d" and type(v) is Float:
+        return v.float
+    return None
+
+def _numpy_view(data):
+    return numpy.frombuffer(data, dtype=numpy.int64 if data.typecode == "q" else numpy.float64)
+
+INT64_LIMIT = 2 ** 63
+
+def _int64_bound(x):
+    # The largest magnitude in x (an ndarray or a scalar) as an int, or None
+    # if x holds an inf / nan
+    x = numpy.asarray(x)
+    if x.size == 0:
+        return 0
+    try:
+        return max(abs(int(x.min())), abs(int(x.max())))
+    except (OverflowError, ValueError):
+        return None
+
+def _int64_safe(op, a, b):
+    # Whether op on int64 a and b can't overflow: numpy wraps around where
+    # Integer arithmetic would make a bignum
+    x, y = _int64_bound(a), _int64_bound(b)
+    if x is None or y is None:
+        return False
+    if op == "*":
+        return x * y < INT64_LIMIT
+    if op == "/":
+        # Only -2**63 / -1 leaves the range
+        return x < INT64_LIMIT
+    return x + y < INT64_LIMIT
+
+def _vectorised(op, a, b):
+    # The result of op as an ndarray, or None if int64 arithmetic could
+    # overflow (see _int64_safe)
+    if op in COMPARISON_OPS:
+        return OPERATORS[op](a, b)
+    if a.dtype.kind == "i" and not _int64_safe(op, a, b):
+        return None
+    # Like Integer / Float methods, the receiver's type wins
+    b = numpy.asarray(b).astype(a.dtype)
+    if op == "/":
+        if numpy.any(b == 0):
+            raise ZeroDivisionError("division by zero")
+        if a.dtype.kind == "i":
+            return (a / b).astype(a.dtype)
+    return OPERATORS[op](a, b)
+
+def _elementwise(op, typecode, a, b):
+    # The same operation on plain ints / floats, for when numpy isn't available
+    if op not in COMPARISON_OPS:
+        convert = int if typecode == "q" else float
+        b = [convert(i) for i in b]
+    if op == "/" and typecode == "q":
+        return array.array("q", [int(x / y) for x, y in zip(a, b)])
+    if op in COMPARISON_OPS:
+        return [OPERATORS[op](x, y) for x, y in zip(a, b)]
+    return array.array(typecode, [OPERATORS[op](x, y) for x, y in zip(a, b)])
+
+class Array(Object):
+    # Arithmetic and ordering comparisons are element-wise, against another Array
+    # of the same size or a single value. Numeric contents are stored unboxed in
+    # an array.array (see _array_storage) and only boxed into Integer / Float when
+    # accessed; element-wise operations and reductions on them run on the raw
+    # values, vectorised through numpy when it's installed. Storing an element of
+    # another type converts the array to a list of objects.
+
+    def initialize(self, *args):
+        self.data = _array_storage(args[0] if len(args) > 0 else [])
+
+        for op in OPERATORS:
+            self.methods[op] = partial(self.elementwise, op)
+        self.methods["=="] = self.equals
+        self.methods["!="] = lambda other: not self.equals(other)
+        self.methods["[]"] = self.get
+        self.methods["[]="] = self.set
+        self.methods["<<"] = self.append
+        self.methods["push"] = self.append
+        self.methods["pop"] = self.pop
+        self.methods["each"] = self.each
+        self.methods["map"] = self.map
+        self.methods["select"] = self.select
+        self.methods["reject"] = self.reject
+        self.methods["lazy"] = self.lazy
+        self.methods["size"] = self.size
+        self.methods["length"] = self.size
+        self.methods["sum"] = self.sum
+        self.methods["max"] = self.max
+        self.methods["min"] = self.min
+        self.methods["first"] = self.first
+        self.methods["last"] = self.last
+
+        self.__name__ = "Array"
+
+    def typed(self):
+        return isinstance(self.data, array.array)
+
+    def boxed(self):
+        if self.typed():
+            return [_box(i) for i in self.data]
+        return self.data
+
+    def untype(self):
+        if self.typed():
+            self.data = self.boxed()
+
+    def elementwise(self, op, other):
+        if isinstance(other, Array) and len(other.data) != len(self.data):
+            raise RubyErrors.ArgumentError("array sizes differ (%d and %d)" % (len(self.data), len(other.data)))
+
+        if self.typed():
+            vectorise = _load_numpy() is not None
+            if isinstance(other, Array) and other.typed():
+                b = other.data
+            elif type(other) is Integer and -2 ** 63 <= other.int < 2 ** 63:
+                b = other.int if vectorise else [other.int] * len(self.data)
+            elif type(other) is Float:
+                b = other.float if vectorise else [other.float] * len(self.data)
+            else:
+                b = None
+
+            if b is not None and vectorise:
+                res = _vectorised(op, _numpy_view(self.data), _numpy_view(b) if isinstance(b, array.array) else b)
+                if res is not None:
+                    return Array(res)
+                # Could overflow: plain ints, which may not fit the storage
+                # either, in which case the result is boxed
+                if not isinstance(b, array.array):
+                    b = [b] * len(self.data)
+            if b is not None:
+                try:
+                    return Array(_elementwise(op, self.data.typecode, self.data, b))
+                except OverflowError:
+                    pass
+
+        others = other.boxed() if isinstance(other, Array) else [other] * len(self.data)
+        return Array([OPERATORS[op](x, y) for x, y in zip(self.boxed(), others)])
+
+    def equals(self, other):
+        if not isinstance(other, Array) or len(other.data) != len(self.data):
+            return False
+        if self.typed() and other.typed():
+            return self.data == other.data
+        return all(x == y for x, y in zip(self.boxed(), other.boxed()))
+
+    def get(self, i):
+        i = int(i)
+        if not -len(self.data) <= i < len(self.data):
+            return None
+        if self.typed():
+            return _box(self.data[i])
+        return self.data[i]
+
+    def set(self, i, v):
+        i = int(i)
+        if i < -len(self.data):
+            raise RubyErrors.IndexError("index %d too small for array; minimum: -%d" % (i, len(self.data)))
+        if i >= len(self.data):
+            self.untype()
+            self.data.extend([None] * (i - len(self.data) + 1))
+        if self.typed():
+            raw = _unbox(v, self.data.typecode)
+            if raw is not None:
+                self.data[i] = raw
+                return v
+            self.untype()
+        self.data[i] = v
+        return v
+
+    def append(self, v):
+        if len(self.data) == 0:
+            self.data = _array_storage([v])
+            return self
+        if self.typed():
+            raw = _unbox(v, self.data.typecode)
+            if raw is not None:
+                self.data.append(raw)
+                return self
+            self.untype()
+        self.data.append(v)
+        return self
+
+    def pop(self):
+        if len(self.data) == 0:
+            return None
+        return _box(self.data.pop())
+
+    def each(self, block=None):
+        if block is None:
+            return self.lazy()
+        for i in list(self.data):
+            block(_box(i))
+        return self
+
+    def map(self, block):
+        return Array([block(_box(i)) for i in list(self.data)])
+
+    def select(self, block):
+        return Array([_box(i) for i in list(self.data) if truthy(block(_box(i)))])
+
+    def reject(self, block):
+        return Array([_box(i) for i in list(self.data) if not truthy(block(_box(i)))])
+
+    def lazy(self):
+        return Lazy(lambda: map(_box, list(self.data)))
+
+    def size(self):
+        return Integer(len(self.data))
+
+    def sum(self):
+        if len(self.data) == 0:
+            return Integer(0)
+        if self.typed() and _load_numpy() is not None:
+            view = _numpy_view(self.data)
+            if view.dtype.kind == "f" or _int64_bound(view) * len(view) < INT64_LIMIT:
+                return _box(view.sum().item())
+        if self.typed():
+            return _box(sum(self.data))
+        return functools.reduce(operator.add, self.data)
+
+    def max(self):
+        if len(self.data) == 0:
+            return None
+        if self.typed() and _load_numpy() is not None:
+            return _box(_numpy_view(self.data).max().item())
+        if self.typed():
+            return _box(max(self.data))
+        return max(self.data)
+
+    def min(self):
+        if len(self.data) == 0:
+            return None
+        if self.typed() and _load_numpy() is not None:
+            return _box(_numpy_view(self.data).min().item())
+        if self.typed():
+            return _box(min(self.data))
+        return min(self.data)
+
+    def first(self, n=None):
+        if n is None:
+            return self.get(0)
+        return Array(self.boxed()[:int(n)])
+
+    def last(self):
+        return self.get(-1)
+
+    def to_s(self):
+        return String("[" + ", ".join(rstr(i) for i in self.boxed()) + "]")
+
+def array_new(size=None, value=None):
+    if size is None:
+        return Array([])
+    data = _array_storage([value])
+    if isinstance(data, array.array):
+        return Array(data * int(size))
+    return Array([value] * int(size))
+
+ARRAY_CLASS = Class("Array", array_new)
+
+class _IdentityKey():
+    # Hash key for objects without a value-based key form: equal only to itself
+
+    __slots__ = ("obj", )
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __hash__(self):
+        return id(self.obj)
+
+    def __eq__(self, other):
+        return type(other) is _IdentityKey and other.obj is self.obj
+
+def hash_key(v):
+    # A hashable Python value standing in for v: Integer -> int, String -> str,
+    # Float -> ("f", float) so it doesn't collide with an equal Integer,
+    # Symbol -> itself
+    t = type(v)
+    if t is Integer:
+        return v.int
+    if t is String:
+        return v.s
+    if t is Float:
+        return ("f", v.float)
+    if t is Symbol:
+        return v
+    if v is None or t is bool:
+        return (t, v)
+    return _IdentityKey(v)
+
+def unhash_key(k):
+    t = type(k)
+    if t is int:
+        return Integer(k)
+    if t is str:
+        return String(k)
+    if t is Symbol:
+        return k
+    if t is _IdentityKey:
+        return k.obj
+    if k[0] == "f":
+        return Float(k[1])
+    return k[1]
+
+class Hash(Object):
+    # Keys are stored as their hash_key form in a plain dict (itself a compact,
+    # open-addressed table), so Integer / Float / String keys cost no boxed
+    # objects until they're enumerated.
+
+    def initialize(self, *args):
+        self.default = args[0] if len(args) > 0 else None
+        self.data = {}
+
+        self.methods["[]"] = self.get
+        self.methods["[]="] = self.set
+        self.methods["delete"] = self.delete
+        self.methods["each"] = self.each
+        self.methods["keys"] = self.keys
+        self.methods["values"] = self.values
+        self.methods["size"] = self.size
+        self.methods["length"] = self.size
+
+        self.__name__ = "Hash"
+
+    def get(self, k):
+        return self.data.get(hash_key(k), self.default)
+
+    def set(self, k, v):
+        self.data[hash_key(k)] = v
+        return v
+
+    def delete(self, k):
+        return self.data.pop(hash_key(k), None)
+
+    def each(self, block):
+        for k, v in list(self.data.items()):
+            block(unhash_key(k), v)
+        return self
+
+    def keys(self):
+        return Array([unhash_key(k) for k in self.data])
+
+    def values(self):
+        return Array(list(self.data.values()))
+
+    def size(self):
+        return Integer(len(self.data))
+
+    def to_s(self):
+        return String("{" + ", ".join("%s => %s" % (rstr(unhash_key(k)), rstr(v)) for k, v in self.data.items()) + "}")
+
+HASH_CLASS = Class("Hash", Hash)
+
+def truthy(v):
+    # Ruby truthiness: everything but nil and false
+    return v is not None and v is not False
+
+def _int_storage(r):
+    # Array storage for a Python range, without boxing every element
+    try:
+        return array.array("q", r)
+    except OverflowError:
+        return [Integer(i) for i in r]
+
+class Range(Object):
+    # begin..end / begin...end over Integers, iterated with a Python range so
+    # no Array is built unless one's asked for (to_a, map, select)
+
+    def initialize(self, *args):
+        self.begin, self.end = args[0], args[1]
+        self.exclusive = args[2] if len(args) > 2 else False
+        if not isinstance(self.begin, Integer) or not isinstance(self.end, Integer):
+            raise RubyErrors.TypeError("Range only supports Integer bounds")
+
+        self.methods["each"] = self.each
+        self.methods["map"] = self.map
+        self.methods["select"] = self.select
+        self.methods["reject"] = self.reject
+        self.methods["lazy"] = self.lazy
+        self.methods["to_a"] = self.to_a
+        self.methods["first"] = self.first
+        self.methods["last"] = self.last
+        self.methods["sum"] = self.sum
+        self.methods["size"] = self.size
+        self.methods["min"] = self.min
+        self.methods["max"] = self.max
+        self.methods["include?"] = self.include
+
+        self.__name__ = "Range"
+
+    def range(self):
+        return range(self.begin.int, self.end.int if self.exclusive else self.end.int + 1)
+
+    def each(self, block=None):
+        if block is None:
+            return self.lazy()
+        for i in self.range():
+            block(Integer.box(i))
+        return self
+
+    def map(self, block):
+        return Array([block(Integer.box(i)) for i in self.range()])
+
+    def select(self, block):
+        return Array([Integer.box(i) for i in self.range() if truthy(block(Integer.box(i)))])
+
+    def reject(self, block):
+        return Array([Integer.box(i) for i in self.range() if not truthy(block(Integer.box(i)))])
+
+    def lazy(self):
+        return Lazy(lambda: map(Integer, self.range()))
+
+    def to_a(self):
+        return Array(_int_storage(self.range()))
+
+    def first(self, n=None):
+        r = self.range()
+        if n is None:
+            return Integer(r[0]) if len(r) > 0 else None
+        return Array(_int_storage(r[:int(n)]))
+
+    def last(self, n=None):
+        r = self.range()
+        if n is None:
+            return Integer(r[-1]) if len(r) > 0 else None
+        return Array(_int_storage(r[max(len(r) - int(n), 0):]))
+
+    def sum(self):
+        r = self.range()
+        return Integer((r.start + r.stop - 1) * len(r) // 2)
+
+    def size(self):
+        return Integer(len(self.range()))
+
+    def min(self):
+        return self.first()
+
+    def max(self):
+        return self.last()
+
+    def include(self, v):
+        return isinstance(v, Integer) and v.int in self.range()
+
+    def to_s(self):
+        return String("%d%s%d" % (self.begin.int, "..." if self.exclusive else "..", self.end.int))
+
+class Lazy(Object):
+    # A lazy enumerator: source is a zero-argument function returning a fresh
+    # Python iterator, and every map / select / ... wraps it in another
+    # generator, so (1..n).lazy.map { }.select { }.first(3) only computes the
+    # elements it needs.
+
+    def initialize(self, *args):
+        self.source = args[0]
+
+        self.methods["map"] = self.map
+        self.methods["select"] = self.select
+        self.methods["reject"] = self.reject
+        self.methods["take"] = self.take
+        self.methods["take_while"] = self.take_while
+        self.methods["first"] = self.first
+        self.methods["each"] = self.each
+        self.methods["to_a"] = self.to_a
+        self.methods["force"] = self.to_a
+        self.methods["sum"] = self.sum
+        self.methods["lazy"] = self.lazy
+
+        self.__name__ = "Enumerator::Lazy"
+
+    def chain(self, gen):
+        source = self.source
+        return Lazy(lambda: gen(source()))
+
+    def map(self, block):
+        return self.chain(lambda it: (block(i) for i in it))
+
+    def select(self, block):
+        return self.chain(lambda it: (i for i in it if truthy(block(i))))
+
+    def reject(self, block):
+        return self.chain(lambda it: (i for i in it if not truthy(block(i))))
+
+    def take(self, n):
+        return self.chain(lambda it: itertools.islice(it, int(n)))
+
+    def take_while(self, block):
+        return self.chain(lambda it: itertools.takewhile(lambda i: truthy(block(i)), it))
+
+    def first(self, n=None):
+        if n is None:
+            return next(iter(self.source()), None)
+        return Array(list(itertools.islice(self.source(), int(n))))
+
+    def each(self, block=None):
+        if block is None:
+            return self
+        for i in self.source():
+            block(i)
+        return self
+
+    def to_a(self):
+        return Array(list(self.source()))
+
+    def sum(self):
+        return functools.reduce(operator.add, self.source(), Integer(0))
+
+    def lazy(self):
+        return self
+
+    def to_s(self):
+        return String("#<Enumerator::Lazy>")
+
+def method_key(name):
+    # The methods key named by a Symbol or String
+    if type(name) is Symbol:
+        return name.name
+    if type(name) is String:
+        return name.s
+    raise RubyErrors.TypeError("%s is not a symbol nor a string" % rstr(name))
+
+def object_send(obj, name, *args, block=None):
+    if block is not None:
+        return obj.methods[method_key(name)](*args, block=block)
+    return obj.methods[method_key(name)](*args)
+
+def object_respond_to(obj, name):
+    key = method_key(name)
+    return key in obj.methods.v or key in COMMON_METHODS
+
+# Methods every object has, bound on lookup instead of stored in each object's
+# methods table
+COMMON_METHODS = {
+    "send": object_send,
+    "__send__": object_send,
+    "public_send": object_send,
+    "respond_to?": object_respond_to,
+}
+
+def rstr(v):
+    # str(v) without allocating an intermediate String for the builtin types
+    t = type(v)
+    if t is String:
+        return v.s
+    if t is Integer:
+        return str(v.int)
+    if t is Float:
+        return str(v.float)
+    return str(v)
+
+class File(Object):
+    # Output is collected in self.buffer and written out once it holds at least
+    # buffer_size characters (or on flush / gets / exit). A buffer_size of 0
+    # writes through; that's the default for terminals.
+
+    BUFFER_SIZE = 65536
+
+    open_files = weakref.WeakValueDictionary()
+
+    def initialize(self, *args):
+        self.file = args[0]
+        if len(args) > 1:
+            self.buffer_size = int(args[1])
+        elif self.file is not None and self.file.isatty():
+            self.buffer_size = 0
+        else:
+            self.buffer_size = self.BUFFER_SIZE
+        self.buffer = []
+        self.buffered = 0
+        File.open_files[id(self)] = self
+
+        self.methods["puts"] = self.puts
+        self.methods["gets"] = self.gets
+        self.methods["print"] = self.print
+        self.methods["flush"] = self.flush
+
+        self.__name__ = "File"
+
+    def write(self, s):
+        if self.buffer_size <= 0:
+            self.file.write(s)
+            return
+        self.buffer.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.buffer_size:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if len(self.buffer) > 0:
+            self.file.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+
+    def print(self, *args):
+        self.write(" ".join(map(rstr, args)))
+
+    def flush(self):
+        self.flush_buffer()
+        self.file.flush()
+
+    def puts(self, *args):
+        self.write(" ".join(map(rstr, args)) + "\n")
+
+    def gets(self):
+        # Like C stdio, reading flushes pending output so prompts show up
+        flush_all_files()
+        return String(self.file.readline()[:-1])
+
+def flush_all_files():
+    for f in list(File.open_files.values()):
+        if f.file is not None and not f.file.closed:
+            f.flush_buffer()
+
+atexit.register(flush_all_files)
+
+class AsyncFile(File):
+    # File backed by an asyncio StreamReader / StreamWriter pair. Its I/O methods
+    # are coroutines, so it can only be used from code compiled with async_mode.
+
+    def initialize(self, *args):
+        self.reader = args[0]
+        self.writer = args[1] if len(args) > 1 else None
+        super().initialize(None, 0)
+
+    async def print(self, *args):
+        self.writer.write(" ".join(map(rstr, args)).encode())
+        await self.writer.drain()
+
+    async def flush(self):
+        await self.writer.drain()
+
+    async def puts(self, *args):
+        self.writer.write((" ".join(map(rstr, args)) + "\n").encode())
+        await self.writer.drain()
+
+    async def gets(self):
+        return String((await self.reader.readline()).decode()[:-1])
+
+async def rawait(v):
+    if inspect.isawaitable(v):
+        return await v
+    return v
+
+# Methods compiled with trampoline=True are generator functions wrapped in
+# Trampolined. Their calls to methods yield (method, args) instead of calling,
+# and a call in tail position returns a TailCall; run_trampoline runs the
+# generators on a list of its own, so recursion depth is bounded by memory
+# instead of Python's stack, and tail calls don't grow it at all.
+
+class Trampolined():
+    __slots__ = ("fn", "__name__")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.__name__ = fn.__name__
+
+    def __call__(self, *args):
+        return run_trampoline(self.fn(*args))
+
+class TailCall():
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+def _invoke(fn, args):
+    # Calls fn; for a trampolined method that's just making its frame
+    if fn.__class__ is Trampolined:
+        return fn.fn(*args)
+    return fn(*args)
+
+def run_trampoline(res):
+    # res: The result of calling a trampolined method's generator function
+    stack = []
+    error = None
+    while True:
+        # res (or error) is the outcome of the last call, for the frame on top
+        # of the stack: a new frame, a tail call or a value
+        if error is None:
+            try:
+                while res.__class__ is TailCall:
+                    res = _invoke(res.fn, res.args)
+            except BaseException as e:
+                error = e
+        if error is None and res.__class__ is GeneratorType:
+            stack.append(res)
+            res = None
+        if not stack:
+            if error is not None:
+                raise error
+            return res
+        frame = stack[-1]
+        try:
+            if error is None:
+                fn, args = frame.send(res)
+            else:
+                e, error = error, None
+                fn, args = frame.throw(e)
+        except StopIteration as e:
+            stack.pop()
+            res = e.value
+            continue
+        except BaseException as e:
+            stack.pop()
+            error = e
+            continue
+        try:
+            res = _invoke(fn, args)
+        except BaseException as e:
+            error = e
+
+# memoize :name[, size] replaces method name with a Memoized wrapper caching
+# its results by argument values (see hash_key), evicting the least recently
+# used entry past size. It's for pure methods only: side effects happen on the
+# first call with given arguments and never again.
+
+class Memoized():
+
+    DEFAULT_SIZE = 4096
+
+    def __init__(self, fn, size=None):
+        self.fn = fn
+        self.size = self.DEFAULT_SIZE if size is None else size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.__name__ = fn.__name__
+
+    def __call__(self, *args, **kwargs):
+        if kwargs:
+            # A block can do anything, don't cache
+            return self.fn(*args, **kwargs)
+        key = tuple(map(hash_key, args))
+        try:
+            res = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            res = self.cache[key] = self.fn(*args)
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+            return res
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return res
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.cache), "size": self.size}
+
+class AsyncMemoized(Memoized):
+    # For async mode's coroutine methods
+
+    async def __call__(self, *args, **kwargs):
+        if kwargs:
+            return await self.fn(*args, **kwargs)
+        key = tuple(map(hash_key, args))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        res = self.cache[key] = await self.fn(*args)
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return res
+
+def _method_frame(rlocals, name):
+    # The Locals frame defining method name
+    key = method_key(name)
+    for frame in reversed(rlocals.stack):
+        if key in frame:
+            if getattr(frame[key], "__code__", None) is _VARIABLE_CODE:
+                raise RubyErrors.NameError("`%s' is a variable, not a method" % key)
+            return frame, key
+    raise RubyErrors.NameError("undefined method `%s'" % key)
+
+def memoize(rlocals, name, size=None):
+    frame, key = _method_frame(rlocals, name)
+    if not isinstance(frame[key], Memoized):
+        cls = AsyncMemoized if inspect.iscoroutinefunction(frame[key]) else Memoized
+        frame[key] = cls(frame[key], None if size is None else int(size))
+    return name
+
+def memo_stats(rlocals, name):
+    frame, key = _method_frame(rlocals, name)
+    if not isinstance(frame[key], Memoized):
+        raise RubyErrors.ArgumentError("`%s' isn't memoized" % key)
+    res = Hash()
+    for k, v in frame[key].stats().items():
+        res.set(Symbol.intern(k), Integer(v))
+    return res
+
+# Specialised versions of while loops (see rcomp.LoopTrace), by the code object
+# running the loop and then the number the compiler gave it: a trace lives as
+# long as the code of its loop
+LOOP_TRACES = weakref.WeakKeyDictionary()
+
+# Makes a trace from the rserial'd loop and whether it counts budget steps;
+# rcomp sets it when it's imported
+loop_tracer = None
+
+def _no_steps(n):
+    pass
+
+def run_loop_trace(k, loop, budgets, rlocals, steps=_no_steps):
+    # Called by the generic loop after each iteration; True if the loop was
+    # finished by a specialised version. steps: A RubyBudget's consume.
+    traces = LOOP_TRACES.get(sys._getframe(1).f_code)
+    if traces is None:
+        traces = LOOP_TRACES[sys._getframe(1).f_code] = {}
+    trace = traces.get(k)
+    if trace is None:
+        trace = traces[k] = loop_tracer(loop, budgets)
+    trace.count += 1
+    if trace.count < trace.WARMUP:
+        return False
+    trace.count = 0
+
+    values = []
+    types = []
+    for i in trace.names:
+        v = rlocals.value(i)
+        if type(v) is Integer:
+            values.append(v.int)
+            types.append("int")
+        elif type(v) is Float:
+            values.append(v.float)
+            types.append("float")
+        else:
+            trace.guard_failures += 1
+            return False
+
+    types = tuple(types)
+    if types not in trace.versions:
+        trace.versions[types] = trace.specialize(types)
+    fn = trace.versions[types]
+    if fn is None:
+        trace.guard_failures += 1
+        return False
+
+    trace.entries += 1
+    fn(rlocals, steps, *values)
+    return True
+
+# require / load / require_relative compile Ruby source, which the runtime on
+# its own (in a raot module) can't do; rcomp sets module_loader to its
+# ModuleLoader when it's imported.
+module_loader = None
+
+def ruby_require(eglobals, kind, name):
+    # kind: "require", "require_relative" or "load"
+    if module_loader is None:
+        raise RubyErrors.LoadError("cannot load such file -- %s (%s needs the compiler, rcomp)" % (name, kind))
+    return module_loader.load(eglobals, kind, str(name))
+
+def _no_tick():
+    pass
+
+class RubyBudget():
+    # Quotas for one run of code compiled with CompileOptions(budgets=True):
+    #
+    # max_steps:       Loop iterations plus method and block calls
+    # timeout:         Seconds of wall-clock time from start()
+    # max_allocations: Objects created
+    #
+    # Quotas are only checked every CHECK_INTERVAL steps, so a program can
+    # overrun them by that much work. Exceeding any quota raises
+    # RubyErrors.BudgetExceeded inside the running program.
+
+    CHECK_INTERVAL = 1024
+
+    def __init__(self, max_steps=None, timeout=None, max_allocations=None):
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.max_allocations = max_allocations
+        self.steps = 0
+        self.deadline = None
+        self.allocations = 0
+
+    def start(self):
+        self.steps = 0
+        if self.timeout is not None:
+            self.deadline = time.monotonic() + self.timeout
+        self.allocations = 0
+
+    def check(self):
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise RubyErrors.BudgetExceeded("steps", "step budget of %d exceeded" % self.max_steps)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise RubyErrors.BudgetExceeded("time", "time budget of %gs exceeded" % self.timeout)
+        if self.max_allocations is not None and self.allocations > self.max_allocations:
+            raise RubyErrors.BudgetExceeded("allocations", "allocation budget of %d exceeded" % self.max_allocations)
+
+    def consume(self, n):
+        # n steps taken at once (by a specialised loop)
+        self.steps += n
+        self.check()
+
+    def ticker(self):
+        # The rtick the compiled code calls once per step: a countdown local to
+        # the closure, with the quotas only looked at when it runs out
+        interval = self.CHECK_INTERVAL
+        if self.max_steps is not None:
+            interval = max(1, min(interval, self.max_steps + 1))
+        left = interval
+        def rtick():
+            nonlocal left
+            left -= 1
+            if left == 0:
+                left = interval
+                self.consume(interval)
+        return rtick
+
+    def install(self, eglobals):
+        # Makes code run with eglobals count against this budget
+        self.start()
+        eglobals["rtick"] = self.ticker()
+        eglobals["rsteps"] = self.consume
+        eglobals["rtrace"] = partial(run_loop_trace, steps=self.consume)
+
+    @staticmethod
+    def uninstall(eglobals):
+        eglobals["rtick"] = _no_tick
+        eglobals["rsteps"] = _no_steps
+        eglobals["rtrace"] = run_loop_trace
+
+@contextlib.contextmanager
+def _charging_allocations(budget):
+    # Objects created in the block (in this thread / task) count against
+    # budget, if it has an allocation quota
+    if budget is None or budget.max_allocations is None:
+        yield
+        return
+    token = ALLOCATION_BUDGET.set(budget)
+    try:
+        yield
+    finally:
+        ALLOCATION_BUDGET.reset(token)
+
+# The RuntimeStats of the run going on in this thread / asyncio task, if it's
+# collecting them
+RUNTIME_STATS = contextvars.ContextVar("RUNTIME_STATS", default=None)
+
+class RuntimeStats():
+    # Counters of runtime events during one run (ruby_exec(stats=True)):
+    #
+    # allocations:   {class: objects created}
+    # lookups:       {(class, method): Methods lookups}
+    # lookup_misses: {(class, method): lookups not in the object's own table,
+    #                that fell back to COMMON_METHODS or failed}
+    # outer_scans:   {variable: Locals reads not found in the innermost frame}
+    #
+    # While any run is counting(), counting versions of Object.__init__,
+    # Methods.__getitem__ and Locals.__getitem__ are swapped into their
+    # classes; they charge the RUNTIME_STATS of the thread / task they're
+    # called from, so concurrent runs keep their counts apart. Once the last
+    # run is done the originals are put back, so runs without stats execute
+    # the same code as ever and pay nothing.
+
+    # Runs counting, and the methods the counting versions replaced
+    _active = 0
+    _saved = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.allocations = collections.Counter()
+        self.lookups = collections.Counter()
+        self.lookup_misses = collections.Counter()
+        self.outer_scans = collections.Counter()
+
+    @contextlib.contextmanager
+    def counting(self):
+        # Counts the events of the block (in this thread / task) into self
+        token = RUNTIME_STATS.set(self)
+        with RuntimeStats._lock:
+            RuntimeStats._install()
+        try:
+            yield self
+        finally:
+            with RuntimeStats._lock:
+                RuntimeStats._uninstall()
+            RUNTIME_STATS.reset(token)
+
+    @staticmethod
+    def _install():
+        RuntimeStats._active += 1
+        if RuntimeStats._active > 1:
+            return
+        object_init = Object.__init__
+        methods_getitem = Methods.__getitem__
+        locals_getitem = Locals.__getitem__
+
+        def __init__(self, *args):
+            stats = RUNTIME_STATS.get()
+            if stats is not None:
+                stats.allocations[type(self).__name__] += 1
+            object_init(self, *args)
+
+        def lookup(self, x):
+            stats = RUNTIME_STATS.get()
+            if stats is not None:
+                key = (type(self.parent).__name__, x)
+                stats.lookups[key] += 1
+                if x not in self.v:
+                    stats.lookup_misses[key] += 1
+            return methods_getitem(self, x)
+
+        def read(self, x):
+            stats = RUNTIME_STATS.get()
+            if stats is not None and x not in self.stack[-1] and not x.endswith("="):
+                stats.outer_scans[x] += 1
+            return locals_getitem(self, x)
+
+        RuntimeStats._saved = (object_init, methods_getitem, locals_getitem)
+        Object.__init__ = __init__
+        Methods.__getitem__ = lookup
+        Locals.__getitem__ = read
+
+    @staticmethod
+    def _uninstall():
+        RuntimeStats._active -= 1
+        if RuntimeStats._active == 0:
+            Object.__init__, Methods.__getitem__, Locals.__getitem__ = RuntimeStats._saved
+            RuntimeStats._saved = None
+
+    def as_dict(self):
+        return {
+            "allocations": dict(self.allocations),
+            "lookups": dict(self.lookups),
+            "lookup_misses": dict(self.lookup_misses),
+            "outer_scans": dict(self.outer_scans),
+        }
+
+class ExecEnvironment(tuple):
+    # What ruby_exec returns: the (eglobals, locals) pair, plus stats()
+
+    def __new__(cls, eglobals, locals, stats=None):
+        res = super().__new__(cls, (eglobals, locals))
+        res._stats = stats
+        return res
+
+    def stats(self):
+        # The RuntimeStats counters if the run collected them (else None), and
+        # "caches": {name: Memoized.stats()} for every memoized method
+        res = {} if self._stats is None else self._stats.as_dict()
+        caches = {}
+        for frame in self[0]["rlocals"].stack:
+            for name, fn in frame.items():
+                if isinstance(fn, Memoized):
+                    caches[name] = fn.stats()
+        res["caches"] = caches
+        return res
+
+def _exec_globals(constants, rglobals, rlocals_init):
+    rglobals = Globals(rglobals)
+    rconsts = Constants(constants)
+    eglobals = {
+        "rlocals": Locals(),
+        "rglobals": rglobals,
+        "rconsts": rconsts,
+        "rgslots": rglobals.slots,
+        "rcslots": rconsts.slots,
+        "UNSET": UNSET,
+        "rawait": rawait,
+        "Trampolined": Trampolined,
+        "TailCall": TailCall,
+        "rarith": arith,
+        "rtrace": run_loop_trace,
+        "rtick": _no_tick,
+        "rsteps": _no_steps,
+        "__builtins__": {},
+        "LITERAL_TYPE_MAP": {
+            "int": Integer.box,
+            "str": String,
+            "float": Float.box,
+            "list": Array,
+            "range": Range,
+            "sym": Symbol.intern,
+            "interp": String.interpolate
+        }
+    }
+    eglobals["rlocals"].update(rlocals_init)
+    eglobals["rlocals"]["memoize"] = partial(memoize, eglobals["rlocals"])
+    eglobals["rlocals"]["memo_stats"] = partial(memo_stats, eglobals["rlocals"])
+    for kind in ("require", "require_relative", "load"):
+        eglobals["rlocals"][kind] = partial(ruby_require, eglobals, kind)
+    if rglobals["LOADED_FEATURES"] is None:
+        rglobals["LOADED_FEATURES"] = Array([])
+    if rglobals["LOAD_PATH"] is None:
+        rglobals["LOAD_PATH"] = Array([String(".")])
+    return eglobals
+
+def _sync_slots(eglobals):
+    # Makes room for the slots compiled since the environment was made
+    eglobals["rglobals"].slots_for(0)
+    eglobals["rconsts"].slots_for(0)
+
+def ruby_exec(code, *, constants=None, rglobals=None, rlocals_init=None, budget=None, stats=False):
+    # budget: A RubyBudget, for code compiled with CompileOptions(budgets=True)
+    # stats:  Count runtime events, for the result's stats() (see RuntimeStats)
+    eglobals = _exec_globals(constants, rglobals, rlocals_init)
+    if budget is not None:
+        budget.install(eglobals)
+    counters = RuntimeStats() if stats else None
+    locals = {}
+    with _charging_allocations(budget):
+        if counters is None:
+            exec(code, eglobals, locals)
+        else:
+            with counters.counting():
+                exec(code, eglobals, locals)
+    return ExecEnvironment(eglobals, locals, counters)
+
+async def ruby_exec_async(code, *, constants=None, rglobals=None, rlocals_init=None, budget=None):
+    # code must come from ruby_aspython_async
+    eglobals = _exec_globals(constants, rglobals, rlocals_init)
+    if budget is not None:
+        budget.install(eglobals)
+    locals = {}
+    with _charging_allocations(budget):
+        exec(code, eglobals, locals)
+        locals["result"] = await locals["ruby_main"]()
+    return ExecEnvironment(eglobals, locals)
+
+def standard_env(stdin, stdout):
+    consts = {
+        "STDIN":  stdin,
+        "STDOUT": stdout,
+        "Array":  ARRAY_CLASS,
+        "Hash":   HASH_CLASS
+    }
+    rlocals = {
+        "puts": stdout.methods["puts"],
+        "gets": stdin.methods["gets"],
+        "print": stdout.methods["print"]
+    }
+    rglobals = {
+        "stdout": stdout,
+        "stdin": stdin
+    }
+    return consts, rlocals, rglobals
+
+STDIN  = File(sys.stdin)
+STDOUT = File(sys.stdout)
+
+def module_globals(stdin=None, stdout=None):
+    # A fresh standard environment's globals, for a raot-compiled module to
+    # run its program with (it binds them as its own module globals)
+    consts, rlocals, rglobals = standard_env(STDIN if stdin is None else stdin, STDOUT if stdout is None else stdout)
+    eglobals = _exec_globals(consts, rglobals, rlocals)
+    del eglobals["__builtins__"]
+    return eglobals
@@ -0,0 +1,334 @@
+# Binary serialisation of rast trees, so a program parsed once can be compiled
+# again without re-running rlex.lex + rast.parse.
+#
+# Layout (all integers are LEB128 varints, signed ones zigzag-encoded):
+#
+#   "RAST" version
+#   string table:  count, then (byte length, UTF-8 bytes) per string
+#   root node
+#
+#   node:   kind (0: None, else 1 + index in NODE_TYPES), token,
+#           child count (0: children is None, else 1 + count), children
+#   token:  kind (0: None, else 1 + index in rlex.TOKEN_TYPES), value,
+#           line (signed), char (signed)
+#   value:  tag (VALUE_*), then the int (signed) / 8 byte double / string
+#           table index / item count and items
+#
+# The body (Block) of a Define is prefixed with its length in bytes, so a lazy
+# load can skip it and only decode it the first time its children are used.
+
+import mmap
+import struct
+import contextlib
+
+import rlex
+import rast
+
+MAGIC = b"RAST"
+VERSION = 1
+
+NODE_TYPES = (
+    rast.Node, rast.Call, rast.AssignGlobal, rast.Name, rast.Constant, rast.Global,
+    rast.Literal, rast.Symbol, rast.Interpolation, rast.ArrayLiteral, rast.NameSequence,
+    rast.Block, rast.If, rast.While, rast.Define,
+)
+NODE_TYPE_INDEX = {t: n for n, t in enumerate(NODE_TYPES)}
+TOKEN_TYPE_INDEX = rlex.TOKEN_TYPE_INDEX
+DEFINE_KIND = 1 + NODE_TYPE_INDEX[rast.Define]
+
+VALUE_NONE = 0
+VALUE_INT = 1
+VALUE_FLOAT = 2
+VALUE_STR = 3
+VALUE_FALSE = 4
+VALUE_TRUE = 5
+VALUE_LIST = 6      # An Interpolation's parts
+VALUE_TOKENS = 7    # A list of tokens inside an Interpolation's parts
+
+DOUBLE = struct.Struct("<d")
+
+class FormatError(ValueError):
+    pass
+
+class Writer():
+
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+
+    def varint(self, v, out=None):
+        out = self.out if out is None else out
+        while v > 0x7f:
+            out.append(v & 0x7f | 0x80)
+            v >>= 7
+        out.append(v)
+
+    def signed(self, v):
+        self.varint(v << 1 if v >= 0 else (-v << 1) - 1)
+
+    def string(self, s):
+        n = self.strings.get(s)
+        if n is None:
+            n = self.strings[s] = len(self.strings)
+        self.varint(n)
+
+    def value(self, v):
+        out = self.out
+        t = type(v)
+        if v is None:
+            out.append(VALUE_NONE)
+        elif t is bool:
+            out.append(VALUE_TRUE if v else VALUE_FALSE)
+        elif t is int:
+            out.append(VALUE_INT)
+            self.signed(v)
+        elif t is float:
+            out.append(VALUE_FLOAT)
+            out += DOUBLE.pack(v)
+        elif t is str:
+            out.append(VALUE_STR)
+            self.string(v)
+        elif t is list:
+            out.append(VALUE_LIST)
+            self.varint(len(v))
+            for i in v:
+                if type(i) is list:
+                    out.append(VALUE_TOKENS)
+                    self.varint(len(i))
+                    for j in i:
+                        self.token(j)
+                else:
+                    self.value(i)
+        else:
+            raise TypeError("Can't serialise token value %r" % (v, ))
+
+    def token(self, tok):
+        if tok is None:
+            self.out.append(0)
+            return
+        self.out.append(1 + TOKEN_TYPE_INDEX[type(tok)])
+        self.value(tok.value)
+        self.signed(tok.line)
+        self.signed(tok.char)
+
+    def node(self, node):
+        if node is None:
+            self.out.append(0)
+            return
+        kind = 1 + NODE_TYPE_INDEX[type(node)]
+        self.out.append(kind)
+        self.token(node.token)
+        if node.children is None:
+            self.out.append(0)
+            return
+        self.varint(len(node.children) + 1)
+        for n, i in enumerate(node.children):
+            if kind == DEFINE_KIND and n == 1:
+                self.body(i)
+            else:
+                self.node(i)
+
+    def body(self, node):
+        # Length-prefixed, see Reader.body
+        out = self.out
+        self.out = bytearray()
+        self.node(node)
+        body, self.out = self.out, out
+        self.varint(len(body))
+        self.out += body
+
+    def getvalue(self, root):
+        self.node(root)
+        head = bytearray(MAGIC)
+        head.append(VERSION)
+        self.varint(len(self.strings), head)
+        for s in self.strings:
+            b = s.encode("utf-8")
+            self.varint(len(b), head)
+            head += b
+        return bytes(head + self.out)
+
+class Reader():
+
+    def __init__(self, data, lazy=False):
+        # data: bytes, or an mmap for lazy loading
+        self.data = data
+        self.lazy = lazy
+        if data[:len(MAGIC)] != MAGIC:
+            raise FormatError("Not a serialised rast tree")
+        if len(data) <= len(MAGIC):
+            raise FormatError("Truncated rast data")
+        if data[len(MAGIC)] != VERSION:
+            raise FormatError("Unsupported rast serialisation version %d (expected %d)" % (data[len(MAGIC)], VERSION))
+        self.pos = len(MAGIC) + 1
+        self.strings = []
+        with self.decoding():
+            for _ in range(self.varint()):
+                n = self.varint()
+                if self.pos + n > len(data):
+                    raise FormatError("Truncated rast data")
+                self.strings.append(bytes(data[self.pos:self.pos + n]).decode("utf-8"))
+                self.pos += n
+
+    @contextlib.contextmanager
+    def decoding(self):
+        # Reads past the end of the data (which index or unpack out of range)
+        # come out as a FormatError, like any other malformed input
+        try:
+            yield
+        except (IndexError, struct.error):
+            raise FormatError("Truncated rast data") from None
+
+    def root(self):
+        with self.decoding():
+            return self.node()
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        b = data[pos]
+        pos += 1
+        res = b & 0x7f
+        shift = 7
+        while b & 0x80:
+            b = data[pos]
+            pos += 1
+            res |= (b & 0x7f) << shift
+            shift += 7
+        self.pos = pos
+        return res
+
+    def signed(self):
+        v = self.varint()
+        return -((v + 1) >> 1) if v & 1 else v >> 1
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == VALUE_STR:
+            return self.strings[self.varint()]
+        if tag == VALUE_INT:
+            return self.signed()
+        if tag == VALUE_NONE:
+            return None
+        if tag == VALUE_FLOAT:
+            res = DOUBLE.unpack_from(self.data, self.pos)[0]
+            self.pos += 8
+            return res
+        if tag == VALUE_FALSE or tag == VALUE_TRUE:
+            return tag == VALUE_TRUE
+        if tag == VALUE_LIST:
+            res = []
+            for _ in range(self.varint()):
+                if self.data[self.pos] == VALUE_TOKENS:
+                    self.pos += 1
+                    res.append([self.token() for _ in range(self.varint())])
+                else:
+                    res.append(self.value())
+            return res
+        raise FormatError("Bad value tag %d at %d" % (tag, self.pos - 1))
+
+    def token(self):
+        kind = self.data[self.pos]
+        self.pos += 1
+        if kind == 0:
+            return None
+        if kind > len(rlex.TOKEN_TYPES):
+            raise FormatError("Bad token kind %d at %d" % (kind, self.pos - 1))
+        tok = object.__new__(rlex.TOKEN_TYPES[kind - 1])
+        tok.value = self.value()
+        tok.line = self.signed()
+        tok.char = self.signed()
+        return tok
+
+    def node(self):
+        kind = self.data[self.pos]
+        self.pos += 1
+        if kind == 0:
+            return None
+        if kind > len(NODE_TYPES):
+            raise FormatError("Bad node kind %d at %d" % (kind, self.pos - 1))
+        node = object.__new__(NODE_TYPES[kind - 1])
+        node.token = self.token()
+        count = self.varint()
+        if count == 0:
+            node.children = None
+            return node
+        children = []
+        for n in range(count - 1):
+            if kind == DEFINE_KIND and n == 1:
+                children.append(self.body())
+            else:
+                children.append(self.node())
+        node.children = children
+        return node
+
+    def body(self):
+        length = self.varint()
+        end = self.pos + length
+        if not self.lazy:
+            res = self.node()
+        else:
+            res = LazyBlock(self, self.pos)
+        self.pos = end
+        return res
+
+class LazyBlock(rast.Block):
+    # A Define's body whose children are decoded from the serialised data the
+    # first time they're accessed
+
+    def __init__(self, reader, pos):
+        self._reader = reader
+        with reader.decoding():
+            kind = reader.data[pos]
+            if kind != 1 + NODE_TYPE_INDEX[rast.Block]:
+                raise FormatError("Define body at %d isn't a Block" % pos)
+            reader.pos = pos + 1
+            self.token = reader.token()
+        self._pos = reader.pos
+        self._children = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            reader = self._reader
+            saved = reader.pos
+            reader.pos = self._pos
+            with reader.decoding():
+                count = reader.varint()
+                self._children = [reader.node() for _ in range(count - 1)]
+            reader.pos = saved
+        return self._children
+
+    @children.setter
+    def children(self, v):
+        self._children = v
+
+def dumps(tree):
+    return Writer().getvalue(tree)
+
+def loads(data, lazy=False):
+    return Reader(data, lazy).root()
+
+def dump(tree, file):
+    file.write(dumps(tree))
+
+def load(file, lazy=False):
+    # file: A binary file. With lazy=True it's memory-mapped and Define bodies
+    # are only read from it when used; the mapping lives as long as the tree.
+    if lazy:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        data = file.read()
+    reader = Reader(data, lazy)
+    return reader.root()
+
+if __name__ == "__main__":
+    import sys
+    import pickle
+
+    source = open(sys.argv[1]).read()
+    tree = rast.parse(rlex.lex(source))
+    data = dumps(tree)
+    assert repr(loads(data)) == repr(tree)
+    print("%d bytes serialised, %d bytes pickled" % (len(data), len(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL))))
@@ -0,0 +1,189 @@
+# Snapshots of a RubySession's state after its prelude: constants, globals,
+# top-level variables and methods, so another session (in another process,
+# say) can start where it left off instead of running the prelude again.
+#
+# A snapshot is MAGIC followed by a marshal'd dict of plain values. A method is
+# kept as the marshal'd code object of its Python function, which restores in
+# the time it takes to unmarshal, and as its rserial'd AST when the session
+# compiled it from source (RubySession.definitions). The AST is recompiled
+# instead where the code can't be used:
+#
+#   - another Python version (marshal's code format is version specific)
+#   - slot layouts that disagree with the snapshot's: compiled code indexes
+#     rgslots / rcslots by numbers only meaningful in the compiling process
+#
+# Values: nil, true, false, Integer, Float, String, Symbol and Arrays of them.
+# Files, Classes and builtins belong to the environment and are left to the
+# restoring session's; anything else can't be snapshotted (TypeError).
+# Memoized methods come back memoized with empty caches.
+
+import array
+import types
+import marshal
+import importlib.util
+
+import rast
+import rserial
+import rcomp
+from rruntime import *
+from rruntime import _variable, _VARIABLE_CODE, _sync_slots
+
+MAGIC = b"RSNP"
+VERSION = 1
+
+def _encode(v, what):
+    # v as plain marshal-able values; what: Describes v for errors
+    t = type(v)
+    if v is None or t is bool:
+        return v
+    if t is Integer:
+        return ("i", v.int)
+    if t is Float:
+        return ("f", v.float)
+    if t is String:
+        return ("s", v.s)
+    if t is Symbol:
+        return ("y", v.name)
+    if t is Array:
+        if v.typed():
+            return ("a", v.data.typecode, v.data.tobytes())
+        return ("l", [_encode(i, what) for i in v.data])
+    raise TypeError("can't snapshot %s: %s" % (what, t.__name__))
+
+def _decode(v):
+    if v is None or type(v) is bool:
+        return v
+    tag = v[0]
+    if tag == "i":
+        return Integer(v[1])
+    if tag == "f":
+        return Float(v[1])
+    if tag == "s":
+        return String(v[1])
+    if tag == "y":
+        return Symbol.intern(v[1])
+    if tag == "a":
+        data = array.array(v[1])
+        data.frombytes(v[2])
+        return Array(data)
+    if tag == "l":
+        return Array([_decode(i) for i in v[1]])
+    raise rserial.FormatError("Unknown value tag %r" % (tag, ))
+
+def _environmental(v):
+    # Objects the session's environment provides rather than its code
+    return isinstance(v, (File, Class)) or callable(v) and not isinstance(v, (types.FunctionType, Trampolined, Memoized))
+
+def _method(session, name, fn):
+    # (code bytes or None, AST bytes or None, trampolined, memoize size or
+    # None) for a top-level method
+    size = None
+    if isinstance(fn, Memoized):
+        size, fn = fn.size, fn.fn
+    trampolined = isinstance(fn, Trampolined)
+    if trampolined:
+        fn = fn.fn
+    code = None
+    if isinstance(fn, types.FunctionType) and fn.__globals__ is session.eglobals and fn.__closure__ is None:
+        code = marshal.dumps(fn.__code__)
+    ast = session.definitions.get(name)
+    if ast is not None:
+        ast = rserial.dumps(ast)
+    if code is None and ast is None:
+        raise TypeError("can't snapshot method %s: no code or source for it" % name)
+    return code, ast, trampolined, size
+
+def dumps(session):
+    eglobals = session.eglobals
+    constants = {}
+    for name, v in eglobals["rconsts"].v.items():
+        if not _environmental(v):
+            constants[name] = _encode(v, "constant " + name)
+    rglobals = {}
+    for name, v in eglobals["rglobals"].v.items():
+        if not _environmental(v):
+            rglobals[name] = _encode(v, "global $" + name)
+    variables = {}
+    methods = {}
+    for name, v in session.rlocals.stack[0].items():
+        if getattr(v, "__code__", None) is _VARIABLE_CODE:
+            variables[name] = _encode(v(), "variable " + name)
+        elif not _environmental(v):
+            methods[name] = _method(session, name, v)
+    return MAGIC + marshal.dumps({
+        "version": VERSION,
+        "python": importlib.util.MAGIC_NUMBER,
+        "global_slots": list(GLOBAL_SLOTS.names),
+        "constant_slots": list(CONSTANT_SLOTS.names),
+        "constants": constants,
+        "globals": rglobals,
+        "variables": variables,
+        "methods": methods,
+    })
+
+def _adopt_layout(layout, names):
+    # Whether code compiled against names can index layout: true if one is a
+    # prefix of the other, after which layout is grown to match names
+    if layout.names[:len(names)] != names[:len(layout.names)]:
+        return False
+    for i in names[len(layout.names):]:
+        layout.slot(i)
+    return True
+
+def loads(data, session):
+    # Restores a snapshot into session (a fresh one, usually: what it already
+    # has is overwritten where the snapshot has the same names)
+    if data[:len(MAGIC)] != MAGIC:
+        raise rserial.FormatError("Not a session snapshot")
+    try:
+        snapshot = marshal.loads(data[len(MAGIC):])
+    except (EOFError, ValueError, TypeError):
+        raise rserial.FormatError("Truncated or corrupt session snapshot") from None
+    if snapshot["version"] != VERSION:
+        raise rserial.FormatError("Unsupported snapshot version %r" % (snapshot["version"], ))
+
+    usable = snapshot["python"] == importlib.util.MAGIC_NUMBER \
+        and _adopt_layout(GLOBAL_SLOTS, snapshot["global_slots"]) \
+        and _adopt_layout(CONSTANT_SLOTS, snapshot["constant_slots"])
+    eglobals = session.eglobals
+    _sync_slots(eglobals)
+
+    rconsts = eglobals["rconsts"]
+    for name, v in snapshot["constants"].items():
+        # Directly into the slot: restoring isn't reassigning
+        n = CONSTANT_SLOTS.slot(name)
+        rconsts.slots_for(n)[n] = _decode(v)
+    for name, v in snapshot["globals"].items():
+        eglobals["rglobals"][name] = _decode(v)
+    frame = session.rlocals.stack[0]
+    for name, v in snapshot["variables"].items():
+        frame[name] = _variable(_decode(v))
+
+    recompile = []
+    for name, (code, ast, trampolined, size) in snapshot["methods"].items():
+        code = marshal.loads(code) if code is not None and usable else None
+        if code is None:
+            if ast is None:
+                raise rserial.FormatError("Method %s can't be restored in this process and has no source" % name)
+            recompile.append(rserial.loads(ast))
+            continue
+        fn = types.FunctionType(code, eglobals, name)
+        frame[name] = Trampolined(fn) if trampolined else fn
+
+    if recompile:
+        tree = rast.Block(children=[rast.NameSequence(children=[])] + recompile)
+        session.run(compile(rcomp.ruby_aspython(tree, options=session.options), "<restored methods>", "exec"))
+        for i in recompile:
+            session.definitions[i.children[0].token.value] = i
+
+    for name, (code, ast, trampolined, size) in snapshot["methods"].items():
+        if ast is not None:
+            session.definitions.setdefault(name, rserial.loads(ast, lazy=True))
+        if size is not None:
+            memoize(session.rlocals, String(name), size)
+
+def dump(session, file):
+    file.write(dumps(session))
+
+def load(file, session):
+    loads(file.read(), session)